@@ -0,0 +1,309 @@
+import threading
+
+import cv2
+import numpy as np
+
+# FLANN index algorithm identifiers (see flann/defines.h)
+FLANN_INDEX_KDTREE = 1
+FLANN_INDEX_LSH = 6
+FLANN_DIST_HAMMING = 9
+
+MATCHER_BACKENDS = ("bruteforce", "flann")
+
+
+def keypoints_to_array(keypoints):
+    """
+    Convert a sequence of `cv2.KeyPoint` objects to an (N, 2) float32 array of their coordinates.
+    """
+    if len(keypoints) == 0:
+        return np.zeros((0, 2), dtype=np.float32)
+    return cv2.KeyPoint_convert(keypoints).reshape(-1, 2)
+
+
+def ratio_test(indices, distances, ratio=0.8):
+    """
+    Apply the Lowe ratio test to the two nearest neighbours of every query descriptor at once.
+    Args:
+        indices (numpy.ndarray): (N, 2) neighbour indices, -1 for missing neighbours.
+        distances (numpy.ndarray): (N, 2) neighbour distances.
+        ratio (float, optional): The ratio threshold. Defaults to 0.8.
+    Returns:
+        numpy.ndarray: Boolean mask of the query descriptors that pass the test.
+    """
+    valid = np.all(indices[:, :2] >= 0, axis=1)
+    return valid & (distances[:, 0] < ratio * distances[:, 1])
+
+
+class DescriptorMatcher:
+    """
+    A descriptor matcher trained once on the reference descriptors and then queried with the descriptors of each frame.
+    Subclasses implement `knn_search`, the query indices are always the frame descriptors and the train indices the
+    reference descriptors.
+    """
+
+    def knn_search(self, descriptors, k=2):
+        """
+        Find the `k` nearest reference descriptors of every frame descriptor.
+        Args:
+            descriptors (numpy.ndarray): The descriptors of the frame.
+            k (int, optional): The number of neighbours. Defaults to 2.
+        Returns:
+            tuple: (indices, distances) arrays of shape (N, k). Row i holds the neighbours of frame descriptor i,
+                missing neighbours have index -1 and an infinite distance.
+        """
+        raise NotImplementedError
+
+    def good_matches(self, descriptors, ratio=0.8):
+        """
+        Match frame descriptors against the reference and keep only the reliable matches.
+        Args:
+            descriptors (numpy.ndarray): The descriptors of the frame.
+            ratio (float, optional): The Lowe ratio test threshold. Defaults to 0.8.
+        Returns:
+            tuple: (query_indices, train_indices) arrays of the retained matches.
+        """
+        if descriptors is None or len(descriptors) == 0:
+            empty = np.zeros(0, dtype=np.intp)
+            return empty, empty
+        indices, distances = self.knn_search(descriptors, k=2)
+        query_indices = np.flatnonzero(ratio_test(indices, distances, ratio))
+        return query_indices, indices[query_indices, 0].astype(np.intp)
+
+
+class BruteForceMatcher(DescriptorMatcher):
+    """
+    Exhaustive matching with `cv2.batchDistance`, the distance computation behind `cv2.BFMatcher`, which returns the
+    neighbours as index and distance arrays instead of one `cv2.DMatch` object per match.
+    Attributes:
+        cross_check (bool): Whether only mutual best matches are kept, in place of the ratio test.
+    """
+
+    def __init__(self, reference_descriptors, binary=False, cross_check=False):
+        self.norm = cv2.NORM_HAMMING if binary else cv2.NORM_L2
+        self.distance_type = cv2.CV_32S if binary else cv2.CV_32F
+        self.cross_check = cross_check
+        self.reference_descriptors = (
+            reference_descriptors if binary else np.float32(reference_descriptors)
+        )
+
+    def _search(self, descriptors, k, cross_check=False):
+        if self.distance_type == cv2.CV_32F:
+            descriptors = np.float32(descriptors)
+        distances, indices = cv2.batchDistance(
+            descriptors,
+            self.reference_descriptors,
+            self.distance_type,
+            normType=self.norm,
+            K=k,
+            crosscheck=cross_check,
+        )
+        distances = distances.astype(np.float32)
+        distances[indices < 0] = np.inf
+        return indices, distances
+
+    def knn_search(self, descriptors, k=2):
+        indices, distances = self._search(descriptors, k)
+        if indices.shape[1] < k:
+            # Fewer reference descriptors than neighbours requested
+            missing = k - indices.shape[1]
+            indices = np.pad(indices, ((0, 0), (0, missing)), constant_values=-1)
+            distances = np.pad(
+                distances, ((0, 0), (0, missing)), constant_values=np.inf
+            )
+        return indices, distances
+
+    def good_matches(self, descriptors, ratio=0.8):
+        if self.cross_check and descriptors is not None and len(descriptors):
+            indices, _ = self._search(descriptors, 1, cross_check=True)
+            query_indices = np.flatnonzero(indices[:, 0] >= 0)
+            return query_indices, indices[query_indices, 0].astype(np.intp)
+        return super().good_matches(descriptors, ratio)
+
+
+class FlannMatcher(DescriptorMatcher):
+    """
+    Approximate nearest neighbour matching with a FLANN index built once over the reference descriptors:
+    a randomized KD-tree forest for float descriptors (SIFT) or LSH for binary descriptors (ORB).
+    """
+
+    def __init__(self, reference_descriptors, binary=False, checks=50):
+        self.binary = binary
+        self.search_params = dict(checks=checks)
+        if binary:
+            index_params = dict(
+                algorithm=FLANN_INDEX_LSH,
+                table_number=6,
+                key_size=12,
+                multi_probe_level=1,
+            )
+            self.index = cv2.flann_Index(
+                reference_descriptors, index_params, FLANN_DIST_HAMMING
+            )
+        else:
+            index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
+            self.index = cv2.flann_Index(
+                np.asarray(reference_descriptors, dtype=np.float32), index_params
+            )
+
+    def knn_search(self, descriptors, k=2):
+        if not self.binary:
+            descriptors = np.asarray(descriptors, dtype=np.float32)
+        indices, distances = self.index.knnSearch(
+            descriptors, k, params=self.search_params
+        )
+        distances = distances.astype(np.float32)
+        if not self.binary:
+            # The KD-tree reports squared L2 distances
+            np.sqrt(distances, out=distances)
+        distances[indices < 0] = np.inf
+        return indices, distances
+
+
+def create_matcher(
+    reference_descriptors, backend="bruteforce", binary=False, cross_check=False
+):
+    """
+    Create a descriptor matcher indexed over the reference descriptors.
+    Args:
+        reference_descriptors (numpy.ndarray): The descriptors of the reference image.
+        backend (str, optional): "bruteforce" for exhaustive matching or "flann" for approximate nearest neighbours
+            (a KD-tree for float descriptors such as SIFT, LSH for binary descriptors such as ORB). Defaults to "bruteforce".
+        binary (bool, optional): Whether the descriptors are binary (ORB). Defaults to False.
+        cross_check (bool, optional): Keep only mutual best matches. Only supported by the brute force backend,
+            the FLANN backend always uses the ratio test. Defaults to False.
+    Returns:
+        DescriptorMatcher: The trained matcher.
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    if backend == "bruteforce":
+        return BruteForceMatcher(
+            reference_descriptors, binary=binary, cross_check=cross_check
+        )
+    if backend == "flann":
+        return FlannMatcher(reference_descriptors, binary=binary)
+    raise ValueError(
+        f"Unknown matcher backend '{backend}', expected one of {MATCHER_BACKENDS}"
+    )
+
+
+class HomographyTracker:
+    """
+    Keeps the last good frame-to-reference homography and re-validates it on every new frame by tracking a sparse set
+    of its RANSAC inliers with pyramidal Lucas-Kanade optical flow. While the tracked points still reproject onto
+    their reference positions, the homography is reused and the expensive feature detection, matching and RANSAC are
+    skipped; once the median reprojection error passes `max_error` the caller has to fall back to full detection.
+    The tracker is safe to use from several threads. Homographies are tagged with the version of the reference they
+    were estimated against, and once `set_reference_version` moves to a new reference, resets and tracking for an
+    older version are ignored, so a frame processed while the reference changes cannot leave a stale homography.
+    Attributes:
+        homography (numpy.ndarray): The homography mapping frame coordinates to reference coordinates, or None.
+        reprojection_error (float): The median reprojection error in pixels measured by the last `track` call.
+        reference_version (int): The version of the reference homographies are tracked against.
+    """
+
+    def __init__(self, max_points=200, min_points=20, max_error=2.0):
+        self.max_points = max_points
+        self.min_points = min_points
+        self.max_error = max_error
+        self.reprojection_error = None
+        self.reference_version = 0
+        self._lock = threading.Lock()
+        self.reset()
+
+    def set_reference_version(self, version):
+        """
+        Stop tracking because the reference changed to `version`.
+        """
+        with self._lock:
+            self.reference_version = version
+            self._clear()
+
+    def _clear(self):
+        self.homography = None
+        self.gray_frame = self.frame_points = self.reference_points = None
+
+    def reset(
+        self,
+        gray_frame=None,
+        frame_points=None,
+        reference_points=None,
+        homography=None,
+        version=None,
+    ):
+        """
+        Start tracking a new homography, or stop tracking if called without arguments.
+        Args:
+            gray_frame (numpy.ndarray, optional): The grayscale frame the homography was estimated on.
+            frame_points (numpy.ndarray, optional): (N, 2) inlier keypoint coordinates in the frame.
+            reference_points (numpy.ndarray, optional): (N, 2) matching coordinates in the reference.
+            homography (numpy.ndarray, optional): The 3x3 frame-to-reference homography.
+            version (int, optional): The version of the reference the homography was estimated against. The reset
+                is ignored unless it is the current `reference_version`. Defaults to the current version.
+        """
+        with self._lock:
+            if version is None or version == self.reference_version:
+                self._reset(gray_frame, frame_points, reference_points, homography)
+
+    def _reset(self, gray_frame, frame_points, reference_points, homography):
+        self.homography = None
+        if homography is None or len(frame_points) < self.min_points:
+            self._clear()
+            return
+        # Track an evenly spread subset of the inliers
+        step = max(1, len(frame_points) // self.max_points)
+        self.gray_frame = gray_frame
+        self.frame_points = np.ascontiguousarray(frame_points[::step], np.float32)
+        self.reference_points = np.ascontiguousarray(
+            reference_points[::step], np.float32
+        )
+        self.homography = homography
+
+    def track(self, gray_frame, version=None):
+        """
+        Re-validate the current homography on a new frame.
+        Args:
+            gray_frame (numpy.ndarray): The new grayscale frame.
+            version (int, optional): The version of the reference the frame is aligned to. Defaults to the current
+                `reference_version`.
+        Returns:
+            numpy.ndarray: The still valid homography, or None if full detection is needed.
+        """
+        with self._lock:
+            if version is not None and version != self.reference_version:
+                return None
+            return self._track(gray_frame)
+
+    def _track(self, gray_frame):
+        if self.homography is None:
+            return None
+
+        next_points, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.gray_frame,
+            gray_frame,
+            self.frame_points.reshape(-1, 1, 2),
+            None,
+            winSize=(21, 21),
+            maxLevel=3,
+        )
+        tracked = status.ravel() == 1
+        if np.count_nonzero(tracked) < self.min_points:
+            self._clear()
+            return None
+
+        frame_points = next_points.reshape(-1, 2)[tracked]
+        reference_points = self.reference_points[tracked]
+        projected = cv2.perspectiveTransform(
+            frame_points.reshape(-1, 1, 2), self.homography
+        ).reshape(-1, 2)
+        self.reprojection_error = float(
+            np.median(np.linalg.norm(projected - reference_points, axis=1))
+        )
+        if self.reprojection_error > self.max_error:
+            self._clear()
+            return None
+
+        self.gray_frame = gray_frame
+        self.frame_points = frame_points
+        self.reference_points = reference_points
+        return self.homography
@@ -1,64 +1,153 @@
+import argparse
 import os
+import sys
 import time
 from datetime import datetime
-import queue
 import threading
+from collections import deque
 import tkinter as tk
 from tkinter import filedialog
 
 import cv2
-import numpy as np
-from PIL import Image, ImageTk
-from skimage.exposure import match_histograms
-from skimage.metrics import structural_similarity
+from PIL import ImageTk
 
-from changechip import pipeline
-from widgets import PanZoomCanvas
+from alignment import HomographyTracker, keypoints_to_array
+from capture import FrameCapture
+from changechip import (
+    ClusteringSession,
+    ReferenceFeatures,
+    get_reference_features,
+    preload_modules,
+)
+from histogram import HistogramMatcher
+from instrumentation import stage
+from modes import HEAVY_MODES, MODE_MODULES, changechip_overlay, ssim_difference
+from scheduler import ProcessingScheduler
+from sources import CameraSource, open_source
+from widgets import PanZoomCanvas, to_display_image
+
+
+# The reader id of the capture buttons in the frame buffer, the scheduler leases frames as reader 0
+BUTTON_READER = 1
+
+
+class Setting:
+    """
+    A setting of a headless app, with the get / set interface of the Tk variable it stands in for.
+    """
+
+    def __init__(self, value=None):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
 
 
 class PCBQualityAssuranceApp:
-    def __init__(self, root, camera_id, camera_frame_width, camera_frame_height):
+    def __init__(
+        self,
+        root,
+        camera_id=1,
+        camera_frame_width=2560,
+        camera_frame_height=1440,
+        source=None,
+    ):
+        """
+        Set up the app on `root`, capturing from the camera `camera_id` unless another frame source is given.
+
+        Args:
+            root (tk.Tk): The main window, or None to run headless: without a window and without starting capture,
+                for harnesses that drive the processing themselves, see `benchmarks/benchmark_live.py`.
+            camera_id (int, optional): The index of the camera. Defaults to 1.
+            camera_frame_width (int, optional): The requested camera frame width. Defaults to 2560.
+            camera_frame_height (int, optional): The requested camera frame height. Defaults to 1440.
+            source (optional): A frame source from `sources`, e.g. a replayed video, used instead of the camera.
+        """
         print("Starting App")
+        self.headless = root is None
         self.root = root
-        self.root.title("PCB Quality Assurance Toolkit")
         self.window_width = 1600
         self.window_height = 900
-        self.root.geometry(f"{self.window_width}x{self.window_height}")
-        self.root.minsize(1400, 800)
-        self.root.config()
+        if not self.headless:
+            self.root.title("PCB Quality Assurance Toolkit")
+            self.root.geometry(f"{self.window_width}x{self.window_height}")
+            self.root.minsize(1400, 800)
+            self.root.config()
 
         self.font = "Segoe UI"
         self.fontsize = 12
 
         self.reference_image = None
-        self.current_frame = None
+        self.reference_features = None
+        self.reference_orb_features = None
+        self.reference_digest = None  # The image_digest of the reference, matched by its features
+        self.reference_histogram_matcher = None
+        self.changechip_resize_factor = 0.5
+        self.matcher_backend = "bruteforce"  # "bruteforce" or "flann"
+        self.clustering_engine = "kmeans"  # "kmeans", "minibatch" or "subsample"
+        self.homography_tracker = HomographyTracker()
+        self.clustering_session = ClusteringSession()
+        self.preload_mode_modules = True  # Import a mode's dependencies in the background when it is selected
+        self.frame_buffer_slots = 4  # Two frames leased by the scheduler and the capture buttons, two for capture
+        self.display_fps = 30  # Frames decoded for display only, the scheduler gets a fresh frame whenever it is idle
         self.processed_frame = None
-        self.frame_queue = queue.Queue(maxsize=1)  # Queue to hold frames for processing
+        self.processed_job = None  # The scheduler job of the processed frame
+        self.displayed_job = None  # The job of the processed frame on display
+        self.reference_version = 0  # Counts reference changes, the reference canvas redraws on a new version
+        self.reference_lock = threading.Lock()  # Guards the reference and its features while the dispatcher reads them
+        self.use_worker_processes = True  # Run SSIM and ChangeChip in worker processes instead of threads
+        self.show_metrics = True  # Per-stage timings and FPS of the processed frames below the output
+        self.mode_frame_times = {}  # Completion times of the last processed frames of every mode
         self.flicker_state = True
 
-        self.cap = cv2.VideoCapture(
-            camera_id, cv2.CAP_DSHOW
-        )  # Changed to use default camera
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, camera_frame_width)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, camera_frame_height)
-        print("Initialized Webcam")
-
-        # Set up the GUI
-        self.setup_gui()
-        print("GUI Setup Complete")
+        if source is None:
+            source = CameraSource(camera_id, camera_frame_width, camera_frame_height)
+            print("Initialized Webcam")
+        self.cap = source
+
+        # Set up the settings and, unless headless, the GUI
+        self.setup_variables()
+        if not self.headless:
+            self.setup_gui()
+            print("GUI Setup Complete")
+
+        # Start the image processing scheduler, it processes the latest captured frame in the background
+        self.scheduler = ProcessingScheduler(
+            prepare=self.prepare_frame,
+            process=self.process_mode,
+            on_result=self.on_frame_processed,
+            options=self.changechip_options(),
+            use_processes=self.use_worker_processes,
+        )
 
-        # Start video capture
-        self.capture_thread = threading.Thread(target=self.capture_webcam)
-        self.capture_thread.daemon = True
-        self.capture_thread.start()
+        # Start video capture, frames are only decoded when they are displayed or processed
+        self.capture = FrameCapture(
+            self.cap,
+            slots=self.frame_buffer_slots,
+            wants_frame=self.wants_frame,
+            on_frame=self.on_frame_captured,
+            display_fps=self.display_fps,
+        )
+        if not self.headless:
+            self.capture.start()
 
-        # Start the image processing thread
-        self.processing_thread = threading.Thread(target=self.process_output)
-        self.processing_thread.daemon = True
-        self.processing_thread.start()
+            # Release the video capture when the app closes
+            self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
-        # Release the video capture when the app closes
-        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+    def setup_variables(self):
+        """
+        Creates the variables of the mode and the processing options, which the radio buttons and checkboxes of
+        the GUI are bound to. A headless app has no Tk interpreter and uses plain `Setting`s instead.
+        """
+        variable = Setting if self.headless else tk.StringVar
+        self.mode = variable(value="none")
+        variable = Setting if self.headless else tk.IntVar
+        self.homography_var = variable(value=0)
+        self.tracking_var = variable(value=0)
+        self.histogram_var = variable(value=0)
 
     def setup_gui(self):
         # Configure grid layout
@@ -147,7 +236,6 @@ class PCBQualityAssuranceApp:
         button.pack(side=tk.LEFT, expand=True, fill="both")
 
     def setup_radio_buttons(self):
-        self.mode = tk.StringVar(value="none")
         modes = (
             ("None", "none"),
             ("Overlay", "overlay"),
@@ -163,16 +251,32 @@ class PCBQualityAssuranceApp:
                 text=mode_text,
                 value=mode_value,
                 variable=self.mode,
+                command=self.on_mode_change,
                 bg="azure1",
                 font=(self.font, self.fontsize),
             )
             r.pack(fill="x", padx=5)
 
-    def setup_checkboxes(self):
-        self.homography_var = tk.IntVar()
-        self.histogram_var = tk.IntVar()
+    def on_mode_change(self):
+        """
+        Cancel the frame being processed in the previous mode, and start importing the dependencies of the
+        selected mode in the background, so the first processed frame of the mode does not stall on them.
+        """
+        self.scheduler.cancel_all()
+        mode = self.mode.get()
+        if not self.preload_mode_modules:
+            return
+        if self.use_worker_processes and mode in HEAVY_MODES:
+            self.scheduler.warm_up(mode)
+            return
+        modules = MODE_MODULES.get(mode, ())
+        if all(m in sys.modules for m in modules):
+            return
+        threading.Thread(target=preload_modules, args=(modules,), daemon=True).start()
 
+    def setup_checkboxes(self):
         self.setup_checkbox("Align Images", self.homography_var)
+        self.setup_checkbox("Track Alignment", self.tracking_var)
         self.setup_checkbox("Match Colors", self.histogram_var)
 
     def setup_checkbox(self, text, variable):
@@ -197,6 +301,16 @@ class PCBQualityAssuranceApp:
         )
         self.output_label.pack(fill="x", padx=5, pady=(5, 0))
         self.output_canvas = PanZoomCanvas(master=self.right_frame)
+        self.metrics_label = tk.Label(
+            self.right_frame,
+            text="",
+            bg="azure1",
+            anchor="w",
+            justify=tk.LEFT,
+            font=(self.font, self.fontsize - 2),
+        )
+        if self.show_metrics:
+            self.metrics_label.pack(fill="x", padx=5, pady=(5, 0))
         self.defect_capture_button = tk.Button(
             self.right_frame,
             text="Capture Defect",
@@ -206,25 +320,33 @@ class PCBQualityAssuranceApp:
         )
         self.defect_capture_button.pack(fill="x", padx=5, pady=(5, 5))
 
-    def capture_webcam(self):
-        """
-        Continuously captures frames from the webcam. The latest frame is always stored in `self.current_frame`.
-        Frames are also placed in a queue for further processing, ensuring that only the most recent frame is kept
-        if the queue becomes full.
-        """
-        while self.cap.isOpened():
-            ret, frame = self.cap.read()
-            if ret:
-                self.current_frame = frame
-                # Only put the latest frame into the queue, discard the old one if the queue is full
-                if not self.frame_queue.full():
-                    self.frame_queue.put(frame)
-                else:
-                    try:
-                        self.frame_queue.get_nowait()
-                    except queue.Empty:
-                        pass
-                    self.frame_queue.put(frame)
+    def wants_frame(self):
+        """
+        Called by the capture thread for every grabbed frame: a frame is wanted for processing while a reference
+        is set and the scheduler is idle, so it always processes a frame grabbed just now instead of a stale one.
+        """
+        return self.reference_image is not None and self.scheduler.idle
+
+    def on_frame_captured(self, frame_ref):
+        """
+        Called by the capture thread with every frame decoded because `wants_frame` returned True. The frame is
+        submitted to the scheduler by reference, the worker processes read it from the shared frame buffer.
+
+        Args:
+            frame_ref (framebuffer.FrameRef): The id, capture time and frame buffer slot of the frame.
+        """
+        # The frame buffer is created with the first frame
+        self.scheduler.frame_buffer = self.capture.frame_buffer
+        self.scheduler.submit(frame_ref, self.mode.get(), frame_ref.captured_at)
+
+    @property
+    def current_frame(self):
+        """
+        The latest captured frame, or None before the first one. This is a view of a slot of the frame buffer
+        that capture overwrites once newer frames arrive, which is fine for display. Use `self.capture.lease` to
+        keep the frame intact while using it.
+        """
+        return self.capture.latest_frame()[1]
 
     def resize_all_canvases(self, event):
         """
@@ -259,68 +381,129 @@ class PCBQualityAssuranceApp:
         In case of any exceptions during the update process, the error is printed to the console.
 
         This function is designed to be called repeatedly using `root.after`, creating a loop that updates
-        the display every 10 milliseconds.
+        the display every 10 milliseconds. A canvas is only redrawn when the frame it shows changed, most ticks
+        only check the frame ids.
         """
         if self.current_frame is not None:
             try:
                 self.update_input_display()
                 self.update_reference_display()
                 self.update_output_display()
+                self.update_metrics_display()
             except Exception as e:
                 print(f"Error updating display: {e}")
 
         # Schedule the next display update
         self.root.after(10, self.update_display)
 
-    def update_canvas_display(self, canvas, frame):
+    def update_canvas_display(self, canvas, frame, frame_id):
         """
-        Updates a given canvas with the provided frame. The frame is converted to the appropriate format and
-        resized to fit the canvas dimensions before being displayed.
+        Updates a given canvas with the provided frame, unless it already shows the frame `frame_id` at the
+        current canvas size. The frame is resized to the canvas size before it is rotated and converted.
 
         Args:
             canvas (tk.Canvas): The canvas widget to update.
             frame (np.array): The frame to display on the canvas, expected in numpy array format.
+            frame_id (hashable): Identifies the frame, e.g. its capture sequence number.
 
-        This function resizes the frame to match the canvas size and converts it to a format suitable for
-        display in the Tkinter canvas. It then creates an image on the canvas at the top-left corner (0, 0).
-        The converted frame is stored in the canvas to prevent it from being garbage collected.
+        The Tkinter image of the canvas is stored in the canvas, which also prevents it from being garbage
+        collected, and is updated in place while the canvas size does not change.
         """
         canvas_size = (canvas.winfo_width(), canvas.winfo_height())
-        converted_frame = self.convert_frame_format(frame, canvas_size)
-        canvas.create_image(0, 0, anchor=tk.NW, image=converted_frame)
-        canvas.image = converted_frame
+        key = (frame_id, canvas_size)
+        if getattr(canvas, "frame_key", None) == key:
+            return
+        pil_image = self.convert_frame_format(frame, canvas_size, convert_to_tk=False)
+        photo_image = getattr(canvas, "image", None)
+        photo_size = (
+            (photo_image.width(), photo_image.height()) if photo_image is not None else None
+        )
+        if photo_size == pil_image.size:
+            photo_image.paste(pil_image)
+        else:
+            photo_image = ImageTk.PhotoImage(pil_image)
+            canvas.delete("all")
+            canvas.create_image(0, 0, anchor=tk.NW, image=photo_image)
+            canvas.image = photo_image
+        canvas.frame_key = key
 
     def update_input_display(self):
-        self.update_canvas_display(self.input_canvas, self.current_frame)
+        frame_id, frame = self.capture.latest_frame()
+        self.update_canvas_display(self.input_canvas, frame, ("frame", frame_id))
 
     def update_reference_display(self):
-        image_source = (
-            self.current_frame if self.reference_image is None else self.reference_image
-        )
-        self.update_canvas_display(self.reference_canvas, image_source)
+        if self.reference_image is None:
+            frame_id, frame = self.capture.latest_frame()
+            self.update_canvas_display(self.reference_canvas, frame, ("frame", frame_id))
+        else:
+            # The reference is only converted again when it changes or the canvas is resized
+            self.update_canvas_display(
+                self.reference_canvas,
+                self.reference_image,
+                ("reference", self.reference_version),
+            )
 
     def update_output_display(self):
         if self.reference_image is not None:
-            self.output_canvas.set_image(
-                self.convert_frame_format(self.processed_frame, convert_to_tk=False)
-            )
-        else:
+            job = self.processed_job
+            if job is not None and job is not self.displayed_job:
+                # Kept at full resolution for zooming, converted once per processed frame
+                self.output_canvas.set_image(
+                    self.convert_frame_format(job.output, convert_to_tk=False)
+                )
+                job.displayed_at = time.perf_counter()
+                self.displayed_job = job
+        elif self.output_canvas.pil_image is not None:
             self.output_canvas.remove_image()
 
+    def update_metrics_display(self):
+        """
+        Show the capture rate, drop rate and age of the latest camera frame, and the frame rate, latencies and stage
+        timings of the processed frame on display below the output.
+        """
+        if not self.show_metrics:
+            return
+        capture = self.capture.metrics
+        frame_age = self.capture.frame_age() or 0.0
+        text = (
+            f"camera: {capture.fps:.1f} FPS, {capture.decode_fps:.1f} decoded, "
+            f"{capture.drop_rate:.0%} dropped, frame age {frame_age * 1000:.0f} ms"
+        )
+        job = self.displayed_job
+        if job is not None:
+            times = self.mode_frame_times.get(job.mode, ())
+            fps = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 else 0.0
+            text += (
+                f"\n{job.mode}: {fps:.1f} FPS, {job.metrics.total.wall * 1000:.0f} ms per frame, "
+                f"capture to display {job.display_latency * 1000:.0f} ms "
+                f"(queued {job.queue_latency * 1000:.0f} ms), "
+                f"{self.scheduler.dropped} frames dropped"
+            )
+            if job.metrics.stages:
+                text += "\n" + job.metrics.summary()
+        if self.metrics_label.cget("text") != text:
+            self.metrics_label.config(text=text)
+
     # ------------------------- Image Processing Functions ------------------------- #
 
-    def process_output(self):
+    def on_frame_processed(self, job, window=30):
         """
-        Continuously processes frames from the frame queue. If no reference image is available,
-        it skips processing and waits briefly to avoid high CPU usage.
+        Called by the scheduler with every processed frame: publishes it for display and records its completion
+        time for the frame rate of its mode over the last `window` frames.
+
+        Args:
+            job (scheduler.FrameJob): The processed frame.
+            window (int, optional): The number of frames the frame rate is averaged over. Defaults to 30.
         """
-        while True:
-            frame = self.frame_queue.get()  # Wait for a frame to be available
-            if frame is not None and self.reference_image is not None:
-                try:
-                    self.processed_frame = self.process_current_frame(frame)
-                except Exception as e:
-                    print(f"Error processing output frame: {e}")
+        if job.error is not None:
+            print(f"Error processing output frame: {job.error}")
+            return
+        times = self.mode_frame_times.get(job.mode)
+        if times is None:
+            times = self.mode_frame_times[job.mode] = deque(maxlen=window)
+        times.append(job.finished_at)
+        self.processed_frame = job.output
+        self.processed_job = job
 
     def process_current_frame(self, frame):
         """
@@ -335,16 +518,52 @@ class PCBQualityAssuranceApp:
         Returns:
             np.array: The processed frame based on the selected mode.
         """
-        histogram_active = self.histogram_var.get() == 1
-        homography_active = self.homography_var.get() == 1
-        mode = self.mode.get()
+        return self.process_mode(self.mode.get(), self.prepare_frame(frame))
+
+    def prepare_frame(self, frame):
+        """
+        Applies color histogram matching and homography transformation to a frame if they are active.
 
-        if histogram_active:
-            frame = self.match_colors(self.reference_image, frame)
+        Args:
+            frame (np.array): The captured frame.
 
-        if homography_active:
-            frame = self.apply_homography(self.reference_image, frame)
+        Returns:
+            np.array: The prepared frame.
+        """
+        # The reference may change on the Tk thread meanwhile, use one consistent snapshot of it
+        with self.reference_lock:
+            reference_image = self.reference_image
+            reference_version = self.reference_version
+            reference_orb_features = self.reference_orb_features
+            reference_digest = self.reference_digest
+            histogram_matcher = self.reference_histogram_matcher
+
+        if self.histogram_var.get() == 1:
+            with stage("match colors"):
+                frame = self.match_colors(reference_image, frame, histogram_matcher)
+
+        if self.homography_var.get() == 1:
+            with stage("align"):
+                frame = self.apply_homography(
+                    reference_image,
+                    frame,
+                    reference_version,
+                    reference_orb_features,
+                    reference_digest,
+                )
+        return frame
+
+    def process_mode(self, mode, frame):
+        """
+        Processes a prepared frame in the given mode, on the calling thread.
+
+        Args:
+            mode (str): The processing mode.
+            frame (np.array): The prepared frame.
 
+        Returns:
+            np.array: The processed frame.
+        """
         mode_functions = {
             "overlay": self.process_overlay,
             "difference": self.process_difference,
@@ -407,12 +626,7 @@ class PCBQualityAssuranceApp:
 
 
     def process_ssim(self, reference_image, current_frame):
-        gray_reference = cv2.cvtColor(reference_image, cv2.COLOR_BGR2GRAY)
-        gray_frame = cv2.cvtColor(current_frame, cv2.COLOR_BGR2GRAY)
-        _, diff = structural_similarity(gray_reference, gray_frame, full=True)
-        diff = (diff * 255).astype("uint8")
-        diff_color = cv2.cvtColor(diff, cv2.COLOR_GRAY2BGR)
-        return diff_color
+        return ssim_difference(reference_image, current_frame)
 
     def process_flicker(self, reference_image, frame, delay=0.3):
         time.sleep(delay)
@@ -420,52 +634,139 @@ class PCBQualityAssuranceApp:
         return reference_image if self.flicker_state else frame
 
     def process_changechip(self, reference_image, frame):
-        output = pipeline((frame, reference_image), resize_factor=0.5)
-        output = cv2.resize(output, None, fx=2, fy=2)
-        return output
+        return changechip_overlay(
+            reference_image,
+            frame,
+            reference_features=self.reference_features,
+            clustering_session=self.clustering_session,
+            **self.changechip_options(),
+        )
+
+    def changechip_options(self):
+        """
+        The ChangeChip settings, passed to `modes.changechip_overlay` in the thread or worker running the mode.
+        """
+        return {
+            "resize_factor": self.changechip_resize_factor,
+            "matcher": self.matcher_backend,
+            "clustering_engine": self.clustering_engine,
+        }
 
     # ------------------------- Feature-Based Homography ------------------------- #
 
-    def apply_homography(self, reference_image, current_frame):
-        # Convert images to grayscale
-        gray_reference = cv2.cvtColor(reference_image, cv2.COLOR_BGR2GRAY)
+    def apply_homography(
+        self,
+        reference_image,
+        current_frame,
+        reference_version=None,
+        reference_features=None,
+        reference_digest=None,
+    ):
+        """
+        Aligns the current frame to the reference image.
+
+        In tracking mode the last good homography is kept and only re-validated with sparse optical flow,
+        falling back to full ORB detection and RANSAC when its reprojection error becomes too large.
+
+        Args:
+            reference_image (np.array): The reference image.
+            current_frame (np.array): The frame to align.
+            reference_version (int, optional): The version of the reference. A homography estimated against an
+                older version than the tracker's is not tracked. Defaults to the current version.
+            reference_features (ReferenceFeatures, optional): The ORB features of the reference, see
+                `estimate_homography`.
+            reference_digest (str, optional): The image_digest of the reference, see `estimate_homography`.
+
+        Returns:
+            np.array: The current frame warped onto the reference image.
+        """
         gray_frame = cv2.cvtColor(current_frame, cv2.COLOR_BGR2GRAY)
+        tracking_active = self.tracking_var.get() == 1
+
+        h = (
+            self.homography_tracker.track(gray_frame, reference_version)
+            if tracking_active
+            else None
+        )
+        if h is None:
+            h, frame_points, reference_points = self.estimate_homography(
+                reference_image, gray_frame, reference_features, reference_digest
+            )
+            if h is None:
+                return current_frame
+            if tracking_active:
+                self.homography_tracker.reset(
+                    gray_frame, frame_points, reference_points, h, reference_version
+                )
 
-        # Detect ORB keypoints and descriptors
+        # Use homography to warp current frame
+        height, width, channels = reference_image.shape
+        aligned_frame = cv2.warpPerspective(current_frame, h, (width, height))
+
+        return aligned_frame
+
+    def estimate_homography(
+        self, reference_image, gray_frame, reference_features=None, reference_digest=None
+    ):
+        """
+        Estimates the frame-to-reference homography from ORB features.
+
+        Args:
+            reference_image (np.array): The reference image.
+            gray_frame (np.array): The grayscale frame.
+            reference_features (ReferenceFeatures, optional): The ORB features of the reference. Defaults to the
+                features computed when the reference was set, recomputed if they belong to another image.
+            reference_digest (str, optional): The image_digest of `reference_image`, saves hashing it. Defaults to
+                the digest of the current reference.
+
+        Returns:
+            tuple: The homography (None if it could not be estimated) and the frame and reference
+                coordinates of its RANSAC inliers.
+        """
+        # Reuse the reference ORB features computed when the reference was set
+        if reference_features is None:
+            with self.reference_lock:
+                reference_features = self.reference_orb_features
+                reference_digest = self.reference_digest
+        if reference_features is None or not reference_features.matches_image(
+            reference_image, detector="orb", digest=reference_digest
+        ):
+            reference_features = ReferenceFeatures.compute(
+                reference_image, detector="orb"
+            )
+
+        # Detect ORB keypoints and descriptors on the current frame
         orb = cv2.ORB_create()
-        keypoints1, descriptors1 = orb.detectAndCompute(gray_reference, None)
         keypoints2, descriptors2 = orb.detectAndCompute(gray_frame, None)
 
-        # Match descriptors
-        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-        matches = bf.match(descriptors1, descriptors2)
-        matches = sorted(matches, key=lambda x: x.distance)
+        # Match descriptors against the reference index
+        matcher = reference_features.matcher(self.matcher_backend, cross_check=True)
+        frame_indices, reference_indices = matcher.good_matches(descriptors2)
 
         # Extract location of good matches
-        points1 = np.zeros((len(matches), 2), dtype=np.float32)
-        points2 = np.zeros((len(matches), 2), dtype=np.float32)
-
-        for i, match in enumerate(matches):
-            points1[i, :] = keypoints1[match.queryIdx].pt
-            points2[i, :] = keypoints2[match.trainIdx].pt
+        points1 = reference_features.points[reference_indices]
+        points2 = keypoints_to_array(keypoints2)[frame_indices]
 
         # Check if there are enough points to find homography
-        if len(matches) < 4:
+        if len(frame_indices) < 4:
             print("Not enough matches to compute homography.")
-            return current_frame
+            return None, points2, points1
 
         # Find homography
         h, mask = cv2.findHomography(points2, points1, cv2.RANSAC)
+        if h is None:
+            return None, points2, points1
 
-        # Use homography to warp current frame
-        height, width, channels = reference_image.shape
-        aligned_frame = cv2.warpPerspective(current_frame, h, (width, height))
-
-        return aligned_frame
-
+        inliers = mask.ravel() == 1
+        return h, points2[inliers], points1[inliers]
 
-    def match_colors(self, reference_image, current_frame):
-        return match_histograms(current_frame, reference_image, channel_axis=-1)
+    def match_colors(self, reference_image, current_frame, matcher=None):
+        # The reference CDFs are computed once when the reference is set
+        if matcher is None:
+            matcher = self.reference_histogram_matcher
+        if matcher is None:
+            matcher = HistogramMatcher(reference_image)
+        return matcher.match(current_frame)
 
     # ----------------------------- Button Functions ----------------------------- #
 
@@ -475,8 +776,9 @@ class PCBQualityAssuranceApp:
             dir = os.path.join("images", "reference_images")
             os.makedirs(dir, exist_ok=True)
 
-            # Copy the current frame to use as the reference image
-            self.reference_image = self.current_frame.copy()
+            # Copy the current frame out of the frame buffer to use as the reference image
+            with self.capture.lease(BUTTON_READER) as frame:
+                self.set_reference_image(frame.copy())
 
             # Generate a timestamped filename for the reference image
             current_time_str = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -490,14 +792,50 @@ class PCBQualityAssuranceApp:
         except Exception as e:
             print(f"An error occurred while capturing the reference image: {e}")
 
+    def set_reference_image(self, reference_image):
+        """
+        Sets the reference image and precomputes its alignment features, so that frames processed
+        against it only need to detect features on their own side.
+
+        Args:
+            reference_image (np.array): The new reference image, or None to clear it.
+        """
+        # Compute the features of the new reference first, then swap everything at once under the lock
+        reference_features = reference_orb_features = histogram_matcher = None
+        if reference_image is not None:
+            reference_features = get_reference_features(
+                reference_image, self.changechip_resize_factor
+            )
+            reference_orb_features = ReferenceFeatures.compute(
+                reference_image, detector="orb"
+            )
+            reference_orb_features.matcher(self.matcher_backend, cross_check=True)
+            histogram_matcher = HistogramMatcher(reference_image)
+
+        with self.reference_lock:
+            self.scheduler.options = self.changechip_options()
+            self.scheduler.set_reference(reference_image)
+            self.reference_image = reference_image
+            self.reference_version += 1
+            self.reference_features = reference_features
+            self.reference_orb_features = reference_orb_features
+            self.reference_digest = (
+                None if reference_orb_features is None else reference_orb_features.digest
+            )
+            self.reference_histogram_matcher = histogram_matcher
+            # Homographies estimated against the previous reference are ignored from now on
+            self.homography_tracker.set_reference_version(self.reference_version)
+        self.clustering_session.reset()
+        self.processed_job = None
+
     def clear_reference(self):
-        self.reference_image = None
+        self.set_reference_image(None)
         print("Reference image cleared")
 
     def upload_reference(self):
         file_path = filedialog.askopenfilename()
         if file_path:
-            self.reference_image = cv2.imread(file_path)
+            self.set_reference_image(cv2.imread(file_path))
 
     def capture_defect(self):
         try:
@@ -505,16 +843,14 @@ class PCBQualityAssuranceApp:
             dir = os.path.join("images", "defect_images")
             os.makedirs(dir, exist_ok=True)
 
-            # Copy the current frame to use as the defect image
-            defect_image = self.current_frame.copy()
-
             # Generate a timestamped filename for the defect image
             current_time_str = datetime.now().strftime("%Y%m%d_%H%M%S")
             defect_image_filename = f"defect_image_{current_time_str}.png"
             defect_image_path = os.path.join(dir, defect_image_filename)
 
-            # Save the defect image to the specified path
-            cv2.imwrite(defect_image_path, defect_image)
+            # Save the current frame straight from the frame buffer, leased while it is written
+            with self.capture.lease(BUTTON_READER) as defect_image:
+                cv2.imwrite(defect_image_path, defect_image)
             print(f"Defect image saved at {defect_image_path}")
 
         except Exception as e:
@@ -541,28 +877,41 @@ class PCBQualityAssuranceApp:
 
         Notes:
             - If target_size is specified, the frame is resized to the target dimensions using OpenCV's resize function.
-            - Converts the frame from BGR to RGB color space using OpenCV and then creates a PIL Image from the array.
-            - Rotates the PIL image by the specified rotation_angle before returning to adjust for image orientation.
+            - The resized frame is rotated by the specified rotation_angle, a multiple of 90 degrees, to adjust for
+              image orientation, and converted from BGR to RGB color space with OpenCV, see `widgets.to_display_image`.
         """
-        # Resize the frame if target_size is specified
-        resized_frame = cv2.resize(frame, target_size) if target_size else frame
-
-        # Convert BGR to RGB and create a PIL Image
-        pil_image = Image.fromarray(
-            cv2.cvtColor(resized_frame, cv2.COLOR_BGR2RGB)
-        ).rotate(rotation_angle)
+        # Resize first, then rotate and convert BGR to RGB at the target size
+        pil_image = to_display_image(frame, target_size, rotation_angle)
 
         # Convert PIL Image to Tkinter PhotoImage if requested
         return ImageTk.PhotoImage(pil_image) if convert_to_tk else pil_image
 
     def on_closing(self):
+        self.scheduler.shutdown()
+        # The capture thread returns from grab with the next frame, before the camera is released under it
+        self.capture.stop()
         self.cap.release()
-        self.root.destroy()
+        if not self.headless:
+            self.root.destroy()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PCB Quality Assurance Toolkit")
+    parser.add_argument(
+        "--source",
+        default="1",
+        help="Camera index, video file or directory of images to replay",
+    )
+    parser.add_argument(
+        "--fps", type=float, default=None, help="Replay rate of a video or images"
+    )
+    parser.add_argument("--width", type=int, default=2560, help="Camera frame width")
+    parser.add_argument("--height", type=int, default=1440, help="Camera frame height")
+    args = parser.parse_args()
+
     root = tk.Tk()
     app = PCBQualityAssuranceApp(
-        root, camera_id=1, camera_frame_width=2560, camera_frame_height=1440
+        root,
+        source=open_source(args.source, args.fps, args.width, args.height),
     )
     root.mainloop()
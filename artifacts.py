@@ -0,0 +1,91 @@
+import os
+
+import cv2
+import numpy as np
+
+
+class ArtifactSink:
+    """
+    Receives the debug and visualisation artefacts of the pipeline stages. A stage hands over the name of an artefact
+    together with a callable producing it, so the artefact is only computed when the sink wants it. Subclasses
+    implement `wants` and `write`. The artefact passed to `write` may share memory with buffers the pipeline keeps
+    modifying, a sink holding on to it has to copy it.
+    """
+
+    def wants(self, name):
+        """
+        Whether the artefact called `name` should be produced.
+        """
+        return False
+
+    def emit(self, name, producer):
+        """
+        Produce and write an artefact if the sink wants it.
+        Args:
+            name (str): The name of the artefact, a file name such as "aligned.png".
+            producer (callable): Called without arguments to produce the artefact.
+        """
+        if self.wants(name):
+            self.write(name, producer())
+
+    def write(self, name, artifact):
+        raise NotImplementedError
+
+
+class NullSink(ArtifactSink):
+    """
+    Discards every artefact without producing it.
+    """
+
+    def write(self, name, artifact):
+        pass
+
+
+NULL_SINK = NullSink()
+
+
+class DirectorySink(ArtifactSink):
+    """
+    Writes artefacts to files named after them in a directory: matplotlib figures with `savefig`, ".csv" artefacts
+    with `numpy.savetxt` and everything else as an image with `cv2.imwrite`.
+    Attributes:
+        output_directory (str): The directory the files are written to.
+        names (set): The names of the artefacts to write, or None for all of them.
+    """
+
+    def __init__(self, output_directory, names=None):
+        self.output_directory = output_directory
+        self.names = None if names is None else set(names)
+        os.makedirs(output_directory, exist_ok=True)
+
+    def wants(self, name):
+        return self.names is None or name in self.names
+
+    def write(self, name, artifact):
+        path = os.path.join(self.output_directory, name)
+        if hasattr(artifact, "savefig"):
+            artifact.savefig(path)
+        elif name.endswith(".csv"):
+            np.savetxt(path, artifact, delimiter=",")
+        else:
+            cv2.imwrite(path, artifact)
+
+
+def resolve_sink(artifacts=None, debug=False, output_directory=None):
+    """
+    Select the sink a pipeline stage emits its artefacts to.
+    Args:
+        artifacts (ArtifactSink, optional): An explicit sink, takes precedence. Defaults to None.
+        debug (bool, optional): Write every artefact to `output_directory`. Defaults to False.
+        output_directory (str, optional): The directory for `debug`. Defaults to None.
+    Returns:
+        ArtifactSink: `artifacts`, a `DirectorySink` on `output_directory` in debug mode, or the shared `NullSink`.
+    Raises:
+        AssertionError: If debug is True but output_directory is not provided.
+    """
+    if artifacts is not None:
+        return artifacts
+    if debug:
+        assert output_directory is not None, "Output directory must be provided"
+        return DirectorySink(output_directory)
+    return NULL_SINK
@@ -0,0 +1,325 @@
+"""
+Batch inspection of archived boards with the ChangeChip pipeline, fanned out over a pool of worker processes.
+
+Boards are given either as a CSV manifest with "input" and "reference" columns (and an optional "name" column), or
+as a directory of input images together with a single reference image or a directory holding a reference of the same
+file name for every input. A reference may also be a `changechip.ReferenceModel` saved as a ".npz" file, built for
+the same pipeline options. Every board gets a result overlay named after it and a row in "scores.csv" in the output
+directory, so board names must be unique.
+
+Usage:
+    python batch.py --inputs images/defect_images --reference images/reference.png --output results
+    python batch.py --manifest boards.csv --output results --workers 8 --threads-per-worker 1
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from changechip import ReferenceModel, pipeline, preload_modules
+from sources import IMAGE_EXTENSIONS
+
+SCORE_FIELDS = (
+    "name",
+    "input",
+    "reference",
+    "changed_fraction",
+    "max_mse",
+    "accepted_classes",
+    "seconds",
+    "error",
+)
+
+THREAD_ENVIRONMENT = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+
+def read_manifest(path):
+    """
+    Read the boards of a CSV manifest. Relative paths are resolved against the directory of the manifest.
+    Returns:
+        list: (name, input path, reference path) of every board.
+    Raises:
+        ValueError: If the manifest has no "input" or "reference" column, or two boards share a name.
+    """
+    root = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as file:
+        reader = csv.DictReader(file)
+        missing = {"input", "reference"} - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"Manifest {path} lacks the columns {sorted(missing)}")
+        rows = list(reader)
+    boards = []
+    for row in rows:
+        input_path = os.path.join(root, row["input"])
+        name = row.get("name") or os.path.splitext(os.path.basename(input_path))[0]
+        boards.append((name, input_path, os.path.join(root, row["reference"])))
+    check_unique_names(boards)
+    return boards
+
+
+def pair_directory(inputs, reference):
+    """
+    Pair every image in `inputs` with `reference`, either a single reference image or a directory holding a
+    reference of the same file name.
+    Returns:
+        list: (name, input path, reference path) of every board.
+    Raises:
+        ValueError: If a reference of the same name is missing, or two images differ only in their extension.
+    """
+    boards = []
+    for file_name in sorted(os.listdir(inputs)):
+        if not file_name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        reference_path = reference
+        if os.path.isdir(reference):
+            reference_path = os.path.join(reference, file_name)
+            if not os.path.exists(reference_path):
+                raise ValueError(f"No reference {reference_path} for {file_name}")
+        name = os.path.splitext(file_name)[0]
+        boards.append((name, os.path.join(inputs, file_name), reference_path))
+    check_unique_names(boards)
+    return boards
+
+
+def check_unique_names(boards):
+    """
+    Check that no two boards share a name, as the name is the file name of their overlay.
+    Raises:
+        ValueError: If names collide, e.g. manifest inputs with the same file name in different directories.
+    """
+    seen = {}
+    for name, input_path, _ in boards:
+        # Names differing only in case collide on case-insensitive file systems
+        key = os.path.normcase(name)
+        if key in seen:
+            raise ValueError(
+                f"Boards {seen[key]} and {input_path} are both named '{name}', "
+                "their overlays would overwrite each other"
+            )
+        seen[key] = input_path
+
+
+def pin_worker_threads(threads):
+    """
+    Process pool initializer: limit the BLAS, OpenMP and OpenCV thread pools of a worker so that the workers
+    together do not oversubscribe the cores.
+    """
+    for variable in THREAD_ENVIRONMENT:
+        os.environ[variable] = str(threads)
+    cv2.setNumThreads(threads)
+    # The OpenMP runtime of scikit-learn is only loaded on import, load it before applying the limits
+    preload_modules()
+    from threadpoolctl import threadpool_limits
+
+    threadpool_limits(limits=threads)
+
+
+# The reference models of a worker, keyed by (path, resize factor, alignment, matcher). Boards sharing a
+# reference are handed to the same worker, so a handful of entries is enough.
+REFERENCE_MODEL_CACHE_SIZE = 4
+_reference_models = OrderedDict()
+
+
+def reference_model(path, options):
+    """
+    Return the `ReferenceModel` of a reference for the pipeline options, building it on first use in this worker.
+    Args:
+        path (str): A reference image, or a model saved with `ReferenceModel.save` as a ".npz" file.
+        options (dict): Keyword arguments of `changechip.pipeline`.
+    Returns:
+        ReferenceModel: The model of the reference.
+    Raises:
+        ValueError: If the reference image cannot be read.
+    """
+    resize_factor = options.get("resize_factor", 1.0)
+    alignment = options.get("alignment", "features")
+    matcher = options.get("matcher", "bruteforce")
+    key = (path, resize_factor, alignment, matcher)
+    model = _reference_models.get(key)
+    if model is not None:
+        _reference_models.move_to_end(key)
+        return model
+
+    if path.endswith(".npz"):
+        model = ReferenceModel.load(path)
+    else:
+        reference_image = cv2.imread(path)
+        if reference_image is None:
+            raise ValueError(f"Could not read the reference image {path}")
+        model = ReferenceModel.build(
+            reference_image, resize_factor, alignment=alignment, matcher=matcher
+        )
+    _reference_models[key] = model
+    while len(_reference_models) > REFERENCE_MODEL_CACHE_SIZE:
+        _reference_models.popitem(last=False)
+    return model
+
+
+def inspect_board(board, output_directory, options, verbose=False):
+    """
+    Run the pipeline on one board and write its overlay as "<name>.png" to `output_directory`.
+    Args:
+        board (tuple): (name, input path, reference path).
+        output_directory (str): The directory of the overlays.
+        options (dict): Keyword arguments of `changechip.pipeline`.
+        verbose (bool, optional): Keep the timing output of the pipeline. Defaults to False.
+    Returns:
+        dict: The row of the board in "scores.csv".
+    """
+    name, input_path, reference_path = board
+    row = {"name": name, "input": input_path, "reference": reference_path}
+    start_time = time.time()
+    try:
+        input_image = cv2.imread(input_path)
+        if input_image is None:
+            raise ValueError("Could not read the input image")
+        reference = reference_model(reference_path, options)
+        log = (
+            contextlib.nullcontext()
+            if verbose
+            else contextlib.redirect_stdout(io.StringIO())
+        )
+        with log:
+            output, details = pipeline(
+                (input_image, reference),
+                return_details=True,
+                **options,
+            )
+        cv2.imwrite(os.path.join(output_directory, name + ".png"), output)
+        row.update(
+            changed_fraction=f"{details['changed_fraction']:.6f}",
+            max_mse=f"{details['max_mse']:.6f}",
+            accepted_classes=" ".join(map(str, details["accepted_classes"])),
+        )
+    except Exception as error:
+        # One line per board in the scores, OpenCV errors span several lines
+        row["error"] = " ".join(f"{type(error).__name__}: {error}".split())
+    row["seconds"] = f"{time.time() - start_time:.3f}"
+    return row
+
+
+def inspect_boards(
+    boards,
+    output_directory,
+    options,
+    workers=None,
+    threads_per_worker=1,
+    verbose=False,
+):
+    """
+    Inspect boards in parallel, writing their overlays and "scores.csv" to `output_directory`.
+    Args:
+        boards (list): (name, input path, reference path) of every board.
+        output_directory (str): The output directory.
+        options (dict): Keyword arguments of `changechip.pipeline`.
+        workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+        threads_per_worker (int, optional): The BLAS / OpenMP / OpenCV threads of every worker. Defaults to 1.
+        verbose (bool, optional): Keep the timing output of the pipeline. Defaults to False.
+    Returns:
+        tuple: The score rows in the order of `boards`, and the throughput in boards per second.
+    Raises:
+        ValueError: If two boards share a name, see `check_unique_names`.
+    """
+    check_unique_names(boards)
+    os.makedirs(output_directory, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    # Group boards by reference so the chunks of a worker mostly share one reference
+    order = sorted(range(len(boards)), key=lambda i: boards[i][2])
+    chunksize = max(1, min(16, len(boards) // (4 * workers)))
+    rows = [None] * len(boards)
+
+    start_time = time.time()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=pin_worker_threads,
+        initargs=(threads_per_worker,),
+    ) as executor:
+        results = executor.map(
+            inspect_board,
+            [boards[i] for i in order],
+            [output_directory] * len(order),
+            [options] * len(order),
+            [verbose] * len(order),
+            chunksize=chunksize,
+        )
+        for done, (i, row) in enumerate(zip(order, results), 1):
+            rows[i] = row
+            status = row.get("error") or f"changed {row['changed_fraction']}"
+            print(f"[{done}/{len(boards)}] {row['name']}: {status}")
+    elapsed = time.time() - start_time
+
+    with open(os.path.join(output_directory, "scores.csv"), "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=SCORE_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows, len(boards) / elapsed if elapsed > 0 else float("inf")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", help="CSV with input and reference columns")
+    source.add_argument("--inputs", help="Directory of input images")
+    parser.add_argument(
+        "--reference", help="Reference image, or directory of references for --inputs"
+    )
+    parser.add_argument("--output", required=True, help="Output directory")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--resize-factor", type=float, default=1.0)
+    parser.add_argument("--clusters", type=int, default=16)
+    parser.add_argument("--matcher", default="bruteforce")
+    parser.add_argument("--alignment", default="features")
+    parser.add_argument("--clustering-engine", default="kmeans")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.manifest:
+        boards = read_manifest(args.manifest)
+    elif args.reference is None:
+        parser.error("--inputs requires --reference")
+    else:
+        boards = pair_directory(args.inputs, args.reference)
+    if not boards:
+        sys.exit("No boards to inspect")
+
+    options = {
+        "resize_factor": args.resize_factor,
+        "clusters": args.clusters,
+        "matcher": args.matcher,
+        "alignment": args.alignment,
+        "clustering_engine": args.clustering_engine,
+    }
+    rows, throughput = inspect_boards(
+        boards,
+        args.output,
+        options,
+        workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+        verbose=args.verbose,
+    )
+    failed = sum(1 for row in rows if row.get("error"))
+    print(
+        f"Inspected {len(rows)} boards ({failed} failed) at {throughput:.2f} boards/s, "
+        f"scores in {os.path.join(args.output, 'scores.csv')}"
+    )
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
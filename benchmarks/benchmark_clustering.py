@@ -0,0 +1,103 @@
+"""
+Benchmark the clustering engines of changechip.k_means_clustering and report how closely their change maps agree
+with the exact "kmeans" engine.
+
+Every engine is compared against the first run of the exact engine, so the "kmeans" row shows the agreement between
+two random initialisations of the exact engine itself. The adjusted Rand index (ARI) compares whole label maps and
+drops sharply when the unchanged background is split differently; the mask agreement compares only the pixels
+finally reported as changes.
+
+Usage:
+    python benchmarks/benchmark_clustering.py --width 640 --height 360 --repeat 3
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from changechip import (  # noqa: E402
+    CLUSTERING_ENGINES,
+    clustering_to_mse_values,
+    find_group_of_accepted_classes_DBSCAN,
+    get_descriptors,
+    k_means_clustering,
+)
+
+
+def make_image_pair(width, height, rng):
+    """
+    Create an aligned reference / input pair of synthetic boards, the input with a few components changed.
+    """
+    reference = np.full((height, width, 3), 30, dtype=np.uint8)
+    for _ in range(width * height // 2500):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        size = int(rng.integers(3, 30))
+        cv2.rectangle(reference, (x, y), (x + size, y + size), color, -1)
+    input_image = reference.copy()
+    for _ in range(5):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        cv2.circle(input_image, (x, y), int(rng.integers(5, 20)), (0, 0, 255), -1)
+    noise = rng.normal(0, 2, input_image.shape)
+    input_image = np.clip(input_image + noise, 0, 255).astype(np.uint8)
+    return input_image, reference
+
+
+def change_mask(change_map, images, clusters):
+    """
+    The pixels reported as changed: the clusters accepted by the MSE / DBSCAN heuristic.
+    """
+    mse_array = clustering_to_mse_values(change_map, *images, clusters)
+    accepted = find_group_of_accepted_classes_DBSCAN(mse_array)[0]
+    return np.isin(change_map, accepted)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--clusters", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    images = make_image_pair(args.width, args.height, rng)
+    descriptors = get_descriptors(images, 5, 3, 9)
+    shape = images[0].shape
+    print(f"{len(descriptors)} descriptors of dimension {descriptors.shape[1]}")
+
+    results, timings = {}, {}
+    for engine in CLUSTERING_ENGINES:
+        results[engine], best = [], np.inf
+        for _ in range(max(2, args.repeat)):
+            start_time = time.perf_counter()
+            results[engine].append(
+                k_means_clustering(descriptors, args.clusters, shape, engine=engine)
+            )
+            best = min(best, time.perf_counter() - start_time)
+        timings[engine] = best
+
+    exact = results["kmeans"][0]
+    exact_mask = change_mask(exact, images, args.clusters)
+    print(f"{'engine':>10} {'ms':>10} {'speedup':>8} {'ARI':>6} {'mask agreement':>15}")
+    for engine in CLUSTERING_ENGINES:
+        ari = adjusted_rand_score(exact.ravel(), results[engine][-1].ravel())
+        agreement = np.mean(
+            change_mask(results[engine][-1], images, args.clusters) == exact_mask
+        )
+        print(
+            f"{engine:>10} {timings[engine] * 1000:>10.1f} "
+            f"{timings['kmeans'] / timings[engine]:>8.2f} {ari:>6.3f} {agreement:>15.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark the CPU the Tk thread spends converting frames for display, per second of running the app, with the
+previous display loop against the current one, and check that both convert frames to the same pixels.
+
+The previous loop converted the input, the reference and the full resolution output on every 10 ms tick, with PIL
+rotating every image. The current one converts a canvas only when its frame changed: the input at the camera frame
+rate, the output at the processing frame rate and the reference once, flipping the downscaled image with OpenCV.
+Building the Tk images is not included, it needs a display.
+
+Usage:
+    python benchmarks/benchmark_display.py --width 2560 --height 1440 --camera-fps 30 --processed-fps 5
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from widgets import to_display_image  # noqa: E402
+
+
+def convert_frame_format_pil(frame, target_size=None, rotation_angle=180):
+    """
+    The previous conversion: resize, convert to RGB, and rotate with PIL.
+    """
+    resized_frame = cv2.resize(frame, target_size) if target_size else frame
+    return Image.fromarray(cv2.cvtColor(resized_frame, cv2.COLOR_BGR2RGB)).rotate(
+        rotation_angle
+    )
+
+
+def display_second(convert, frames, reference, output, canvas_size, ticks, changes):
+    """
+    CPU seconds of the conversions of one second of display ticks.
+    Args:
+        changes (tuple): The ticks the input, reference and output change on, None to convert on every tick.
+    """
+    input_ticks, reference_ticks, output_ticks = changes
+    start_time = time.process_time()
+    for tick in range(ticks):
+        frame = frames[tick % len(frames)]
+        if input_ticks is None or tick in input_ticks:
+            convert(frame, canvas_size)
+        if reference_ticks is None or tick in reference_ticks:
+            convert(reference, canvas_size)
+        if output_ticks is None or tick in output_ticks:
+            convert(output)
+    return time.process_time() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--width", type=int, default=2560)
+    parser.add_argument("--height", type=int, default=1440)
+    parser.add_argument("--canvas-width", type=int, default=640)
+    parser.add_argument("--canvas-height", type=int, default=360)
+    parser.add_argument("--camera-fps", type=float, default=30)
+    parser.add_argument("--processed-fps", type=float, default=5)
+    parser.add_argument("--tick-ms", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    shape = (args.height, args.width, 3)
+    frames = [rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(2)]
+    reference = rng.integers(0, 256, shape, dtype=np.uint8)
+    output = rng.integers(0, 256, shape, dtype=np.uint8)
+    canvas_size = (args.canvas_width, args.canvas_height)
+
+    for size in (canvas_size, None):
+        expected = np.asarray(convert_frame_format_pil(frames[0], size))
+        if not np.array_equal(np.asarray(to_display_image(frames[0], size)), expected):
+            sys.exit(f"The conversions differ at size {size or 'of the frame'}")
+
+    ticks = int(round(1000 / args.tick_ms))
+
+    def change_ticks(fps):
+        return {int(i * ticks / fps) for i in range(int(fps))}
+
+    previous = display_second(
+        convert_frame_format_pil,
+        frames,
+        reference,
+        output,
+        canvas_size,
+        ticks,
+        (None, None, None),
+    )
+    current = display_second(
+        to_display_image,
+        frames,
+        reference,
+        output,
+        canvas_size,
+        ticks,
+        (change_ticks(args.camera_fps), {0}, change_ticks(args.processed_fps)),
+    )
+    print(
+        f"{args.width}x{args.height} frames on {args.canvas_width}x{args.canvas_height} canvases, "
+        f"{ticks} ticks per second, camera at {args.camera_fps:g} FPS, output at {args.processed_fps:g} FPS"
+    )
+    print(f"previous display loop: {previous * 1000:8.1f} ms CPU per second")
+    print(
+        f"current display loop:  {current * 1000:8.1f} ms CPU per second "
+        f"({previous / current:.1f}x less)"
+    )
+
+
+if __name__ == "__main__":
+    main()
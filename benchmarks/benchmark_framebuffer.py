@@ -0,0 +1,168 @@
+"""
+Benchmark moving camera frames from a capture process to a processing process through the shared memory
+framebuffer.FrameRingBuffer against pickling them through a multiprocessing queue.
+
+Both producers copy a source frame per captured frame, standing in for the camera decoding into a new array or into
+a slot. The producer writes the frame number into the first and last bytes of every frame and the consumer checks
+them, so a frame overwritten while leased fails the benchmark.
+
+Usage:
+    python benchmarks/benchmark_framebuffer.py --width 2560 --height 1440 --seconds 3
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from framebuffer import FrameRingBuffer  # noqa: E402
+
+
+def stamp(frame, number):
+    flat = frame.reshape(-1)
+    flat[:8] = flat[-8:] = np.frombuffer(np.int64(number).tobytes(), np.uint8)
+
+
+def read_stamp(frame):
+    flat = frame.reshape(-1)
+    return int(flat[:8].view(np.int64)[0]), int(flat[-8:].view(np.int64)[0])
+
+
+def touch(frame):
+    # A cheap read of the whole frame, as processing would do
+    return int(frame[::16, ::16].sum())
+
+
+def queue_producer(queue, source, stop):
+    number = 0
+    while not stop.is_set():
+        number += 1
+        frame = source.copy()
+        stamp(frame, number)
+        queue.put(frame)
+
+
+def queue_consumer(queue, stop, results):
+    received = torn = 0
+    while not stop.is_set():
+        try:
+            frame = queue.get(timeout=0.1)
+        except Exception:
+            continue
+        first, last = read_stamp(frame)
+        torn += first != last
+        touch(frame)
+        received += 1
+    results.put((received, torn))
+
+
+def ring_producer(spec, lock, source, written, stop):
+    buffer = FrameRingBuffer.attach(spec, lock)
+    number = 0
+    while not stop.is_set():
+        _, view = buffer.begin_write()
+        np.copyto(view, source)
+        number += 1
+        stamp(view, number)
+        buffer.commit()
+    written.value = buffer.written
+    buffer.close()
+
+
+def ring_consumer(spec, lock, stop, results):
+    buffer = FrameRingBuffer.attach(spec, lock)
+    received = torn = 0
+    last_sequence = 0
+    while not stop.is_set():
+        lease = buffer.acquire(0)
+        if lease is None or lease[1] == last_sequence:
+            buffer.release(0)
+            time.sleep(0)
+            continue
+        slot, last_sequence, _ = lease
+        frame = buffer.frames[slot]
+        touch(frame)
+        first, last = read_stamp(frame)
+        torn += not first == last == last_sequence
+        del frame
+        buffer.release(0)
+        received += 1
+    results.put((received, torn))
+    buffer.close()
+
+
+def run(context, producer, producer_args, consumer, consumer_args, seconds):
+    stop = context.Event()
+    results = context.Queue()
+    processes = [
+        context.Process(target=producer, args=(*producer_args, stop)),
+        context.Process(target=consumer, args=(*consumer_args, stop, results)),
+    ]
+    for process in processes:
+        process.start()
+    time.sleep(seconds)
+    stop.set()
+    received, torn = results.get()
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            # A producer blocked on a full queue
+            process.terminate()
+    return received / seconds, torn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--width", type=int, default=2560)
+    parser.add_argument("--height", type=int, default=1440)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--slots", type=int, default=4)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    shape = (args.height, args.width, 3)
+    source = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+    print(f"{args.width}x{args.height} frames, {source.nbytes / 2**20:.1f} MiB each")
+
+    queue = context.Queue(maxsize=2)
+    queue_fps, queue_torn = run(
+        context,
+        queue_producer,
+        (queue, source),
+        queue_consumer,
+        (queue,),
+        args.seconds,
+    )
+    print(f"pickled queue:      {queue_fps:8.1f} frames/s received")
+
+    lock = context.Lock()
+    buffer = FrameRingBuffer(shape, slots=args.slots, readers=1, lock=lock)
+    written = context.Value("q", 0)
+    try:
+        ring_fps, ring_torn = run(
+            context,
+            ring_producer,
+            (buffer.spec, lock, source, written),
+            ring_consumer,
+            (buffer.spec, lock),
+            args.seconds,
+        )
+    finally:
+        buffer.close()
+    print(
+        f"shared ring buffer: {ring_fps:8.1f} frames/s received, "
+        f"{written.value / args.seconds:.1f} frames/s captured "
+        f"({ring_fps / queue_fps:.1f}x the queue)"
+    )
+
+    if queue_torn or ring_torn:
+        sys.exit(f"Torn frames: {queue_torn} from the queue, {ring_torn} from the ring")
+
+
+if __name__ == "__main__":
+    main()
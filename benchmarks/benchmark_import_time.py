@@ -0,0 +1,74 @@
+"""
+Measure the startup import time of changechip and app with `python -X importtime`, against importing them together
+with the heavy dependencies they now load on first use (the previous eager startup).
+
+Usage:
+    python benchmarks/benchmark_import_time.py --repeat 5 --top 10
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFERRED_MODULES = (
+    "sklearn.cluster",
+    "sklearn.decomposition",
+    "skimage.metrics",
+    "matplotlib.pyplot",
+    "seaborn",
+)
+
+SCENARIOS = (
+    ("changechip", "import changechip"),
+    ("app", "import app"),
+    ("app, eager", "import app, " + ", ".join(DEFERRED_MODULES)),
+)
+
+
+def import_times(statement):
+    """
+    Run `statement` in a fresh interpreter with `-X importtime`.
+    Returns:
+        dict: The cumulative import time in microseconds of every top-level package imported.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Nested imports are indented by two more spaces than the module importing them
+        if not name.startswith("  "):
+            name = name.strip()
+            times[name] = times.get(name, 0) + int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"{'scenario':>12} {'total ms':>10}  heaviest imports (ms)")
+    for label, statement in SCENARIOS:
+        runs = [import_times(statement) for _ in range(args.repeat)]
+        best = min(runs, key=lambda times: sum(times.values()))
+        heaviest = sorted(best.items(), key=lambda item: -item[1])[: args.top]
+        print(
+            f"{label:>12} {sum(best.values()) / 1000:>10.1f}  "
+            + ", ".join(f"{name} {us / 1000:.0f}" for name, us in heaviest)
+        )
+
+
+if __name__ == "__main__":
+    main()
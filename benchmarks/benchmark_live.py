@@ -0,0 +1,149 @@
+"""
+Benchmark the live processing modes of the app headless on recorded board footage, reporting the sustained frame
+rate and the p50 / p99 latency from grabbing a frame to its processed output for every mode.
+
+By default every grabbed frame is processed by `process_current_frame` on the calling thread. With --scheduler the
+frames go through the same path as in the app instead: `capture.FrameCapture`, the shared frame buffer and
+`scheduler.ProcessingScheduler` with its worker processes. The footage is replayed in real time at --fps, so a mode
+slower than the footage skips frames like it does on the camera.
+
+Usage:
+    python benchmarks/benchmark_live.py --source footage.mp4 --reference reference.png --seconds 10
+    python benchmarks/benchmark_live.py --source images/defect_images --fps 5 --align --scheduler
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import PCBQualityAssuranceApp  # noqa: E402
+from changechip import preload_modules  # noqa: E402
+from modes import HEAVY_MODES, MODE_MODULES  # noqa: E402
+from sources import open_source  # noqa: E402
+
+MODES = ("none", "overlay", "difference", "ssim", "flicker", "changechip")
+
+
+def run_direct(app, source, seconds):
+    """
+    Grab and process frames on this thread for `seconds`.
+    Returns:
+        list: The grab-to-output latency of every processed frame, in seconds.
+    """
+    latencies = []
+    end_time = time.perf_counter() + seconds
+    while time.perf_counter() < end_time:
+        if not source.grab():
+            break
+        grabbed_at = time.perf_counter()
+        ret, frame = source.retrieve()
+        if not ret:
+            continue
+        app.process_current_frame(frame)
+        latencies.append(time.perf_counter() - grabbed_at)
+    return latencies
+
+
+def run_scheduler(app, seconds):
+    """
+    Capture and process frames in the background like the app does for `seconds`.
+    Returns:
+        list: The grab-to-output latency of every processed frame, in seconds.
+    """
+    latencies = []
+    lock = threading.Lock()
+
+    def on_result(job):
+        app.on_frame_processed(job)
+        if job.error is None:
+            with lock:
+                latencies.append(job.finished_at - job.captured_at)
+
+    app.scheduler.on_result = on_result
+    app.capture.start()
+    time.sleep(seconds)
+    app.capture.stop()
+    app.scheduler.cancel_all()
+    with lock:
+        return list(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--source", required=True, help="Video file or directory of images"
+    )
+    parser.add_argument(
+        "--reference", help="Reference image. Defaults to the first frame"
+    )
+    parser.add_argument("--fps", type=float, default=None, help="Replay rate")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Per mode")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--align", action="store_true", help="Align the frames")
+    parser.add_argument("--match-colors", action="store_true")
+    parser.add_argument(
+        "--scheduler",
+        action="store_true",
+        help="Process through the capture thread and the scheduler as in the app",
+    )
+    args = parser.parse_args()
+
+    if args.reference:
+        reference_image = cv2.imread(args.reference)
+        if reference_image is None:
+            sys.exit(f"Could not read the reference image {args.reference}")
+    else:
+        ret, reference_image = open_source(args.source, loop=False).read()
+        if not ret:
+            sys.exit(f"No frames in {args.source}")
+
+    print(
+        f"{'mode':<12}{'FPS':>8}{'p50 ms':>10}{'p99 ms':>10}{'frames':>8}{'skipped':>9}"
+    )
+    for mode in args.modes:
+        source = open_source(args.source, args.fps)
+        # The app and the pipeline log their progress, keep the table readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            app = PCBQualityAssuranceApp(None, source=source)
+            app.homography_var.set(int(args.align))
+            app.histogram_var.set(int(args.match_colors))
+            app.mode.set(mode)
+            app.set_reference_image(reference_image)
+            # Import the dependencies of the mode ahead of the measurement
+            if args.scheduler and mode in HEAVY_MODES:
+                app.scheduler.warm_up(mode).result()
+            else:
+                preload_modules(MODE_MODULES.get(mode, ()))
+            start_time = time.perf_counter()
+            if args.scheduler:
+                latencies = run_scheduler(app, args.seconds)
+            else:
+                latencies = run_direct(app, source, args.seconds)
+            elapsed = time.perf_counter() - start_time
+            app.on_closing()
+        # The frames of the footage replayed but not processed
+        skipped = source.skipped
+        if args.scheduler:
+            skipped += app.capture.metrics.grabbed - len(latencies)
+
+        if not latencies:
+            print(f"{mode:<12}{'no frames processed':>36}")
+            continue
+        p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+        print(
+            f"{mode:<12}{len(latencies) / elapsed:8.2f}{p50:10.1f}{p99:10.1f}"
+            f"{len(latencies):8d}{skipped:9d}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark the descriptor matcher backends against the number of keypoints.
+
+Synthetic descriptors are used so the keypoint count can be controlled exactly: the frame descriptors are noisy
+copies of the reference descriptors, like a board imaged twice.
+
+Usage:
+    python benchmarks/benchmark_matchers.py --counts 1000 5000 20000 --repeat 3
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alignment import MATCHER_BACKENDS, create_matcher  # noqa: E402
+
+
+def make_descriptors(count, binary, rng):
+    """
+    Create reference descriptors and a noisy frame copy of them.
+    Returns:
+        tuple: The reference and frame descriptors.
+    """
+    if binary:
+        # 256-bit ORB descriptors, frame flips ~5% of the bits
+        reference = rng.integers(0, 256, size=(count, 32), dtype=np.uint8)
+        flips = rng.random((count, 32, 8)) < 0.05
+        flip_bytes = np.packbits(flips, axis=-1).reshape(count, 32)
+        frame = reference ^ flip_bytes
+    else:
+        # 128-dimensional SIFT descriptors
+        reference = rng.random((count, 128), dtype=np.float32) * 100
+        frame = reference + rng.normal(0, 5, size=reference.shape).astype(np.float32)
+        frame = np.clip(frame, 0, None)
+    return reference, frame
+
+
+def time_backend(reference, frame, backend, binary, repeat):
+    """
+    Time index construction and matching for one backend.
+    Returns:
+        tuple: (build time, best match time, number of good matches)
+    """
+    start_time = time.perf_counter()
+    matcher = create_matcher(reference, backend, binary=binary)
+    build_time = time.perf_counter() - start_time
+
+    match_times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        query_indices, _ = matcher.good_matches(frame)
+        match_times.append(time.perf_counter() - start_time)
+    return build_time, min(match_times), len(query_indices)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--counts", type=int, nargs="+", default=[1000, 2500, 5000, 10000, 20000]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(
+        f"{'descriptor':<10} {'keypoints':>9} {'backend':<10} "
+        f"{'build ms':>9} {'match ms':>9} {'good':>7}"
+    )
+    for binary, name in ((False, "sift"), (True, "orb")):
+        for count in args.counts:
+            reference, frame = make_descriptors(count, binary, rng)
+            for backend in MATCHER_BACKENDS:
+                build_time, match_time, good = time_backend(
+                    reference, frame, backend, binary, args.repeat
+                )
+                print(
+                    f"{name:<10} {count:>9} {backend:<10} "
+                    f"{build_time * 1000:>9.1f} {match_time * 1000:>9.1f} {good:>7}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark changechip.clustering_to_mse_values against the previous per-cluster mask loop for growing cluster counts,
+and check that both compute the same values.
+
+Usage:
+    python benchmarks/benchmark_mse.py --width 640 --height 360 --clusters 2 4 8 16 32 64
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from changechip import clustering_to_mse_values  # noqa: E402
+
+
+def clustering_to_mse_values_loop(change_map, input_image, reference_image, n):
+    """
+    The previous implementation: one full-image boolean mask per cluster over 64-bit integer images.
+    """
+    input_image = input_image.astype(int)
+    reference_image = reference_image.astype(int)
+    squared_diff = np.mean((input_image - reference_image) ** 2, axis=-1)
+    mse = np.zeros(n, dtype=float)
+    size = np.zeros(n, dtype=int)
+    for k in range(n):
+        mask = change_map == k
+        size[k] = np.sum(mask)
+        if size[k] > 0:
+            mse[k] = np.sum(squared_diff[mask])
+    return ((mse / size) / (255**2)).tolist()
+
+
+def best_time(function, repeat, *args):
+    best = np.inf
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start_time)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument(
+        "--clusters", type=int, nargs="+", default=[2, 4, 8, 16, 32, 64]
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    shape = (args.height, args.width, 3)
+    input_image = rng.integers(0, 256, shape, dtype=np.uint8)
+    reference_image = rng.integers(0, 256, shape, dtype=np.uint8)
+
+    print(
+        f"{'clusters':>8} {'loop ms':>10} {'bincount ms':>12} {'speedup':>8} {'max abs err':>12}"
+    )
+    failed = False
+    for n in args.clusters:
+        change_map = rng.integers(0, n, shape[:2])
+        arguments = (change_map, input_image, reference_image, n)
+        loop_time, expected = best_time(
+            clustering_to_mse_values_loop, args.repeat, *arguments
+        )
+        fused_time, result = best_time(
+            clustering_to_mse_values, args.repeat, *arguments
+        )
+        error = np.abs(np.array(result) - np.array(expected)).max()
+        failed |= not error < 1e-12
+        print(
+            f"{n:>8} {loop_time * 1000:>10.1f} {fused_time * 1000:>12.1f} "
+            f"{loop_time / fused_time:>8.1f} {error:>12.2e}"
+        )
+
+    if failed:
+        sys.exit("bincount MSE differs from the loop implementation")
+
+
+if __name__ == "__main__":
+    main()
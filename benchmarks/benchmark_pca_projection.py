@@ -0,0 +1,118 @@
+"""
+Benchmark the PCA projection methods of changechip.descriptors_to_pca across image and window sizes, and check that
+the convolution projection is numerically equivalent to the tiled (exact) projection.
+
+Both methods are checked on the same PCA basis, shared through a changechip.PCAModelCache: scikit-learn fits the
+basis with a randomized solver, so two fits of the same windows already differ by up to 1e-5 relative. On the same
+basis both projections are computed in float64 and only differ by the rounding of summing the products in another
+order, well below the 1e-9 relative error the check allows.
+
+Usage:
+    python benchmarks/benchmark_pca_projection.py --sizes 320x240 640x480 1280x720 --window-sizes 3 5 7 9 11
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from changechip import (  # noqa: E402
+    PROJECTION_METHODS,
+    PCAModelCache,
+    descriptors_to_pca,
+)
+
+MAX_RELATIVE_ERROR = 1e-9
+
+
+def make_difference_image(width, height, rng):
+    """
+    Create a 4-channel difference image with smooth noise and a few sharp blobs, like a real diff.
+    """
+    noise = rng.integers(0, 12, size=(height, width, 4), dtype=np.uint8)
+    diff = cv2.GaussianBlur(noise, (5, 5), 0)
+    for _ in range(20):
+        x, y = rng.integers(0, width), rng.integers(0, height)
+        cv2.circle(
+            diff, (int(x), int(y)), int(rng.integers(5, 40)), (200, 180, 160, 140), -1
+        )
+    return diff
+
+
+def parse_size(size):
+    width, height = size.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes",
+        type=parse_size,
+        nargs="+",
+        default=[(320, 240), (640, 480), (1280, 720)],
+        help="Image sizes as WIDTHxHEIGHT",
+    )
+    parser.add_argument("--window-sizes", type=int, nargs="+", default=[3, 5, 7, 9, 11])
+    parser.add_argument("--pca-dim", type=int, default=9)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(
+        f"{'size':>10} {'window':>6} "
+        + " ".join(f"{m + ' ms':>15}" for m in PROJECTION_METHODS)
+        + f" {'max rel err':>12}"
+    )
+    failed = False
+    for width, height in args.sizes:
+        diff = make_difference_image(width, height, rng)
+        shape = (height, width)
+        for window_size in args.window_sizes:
+            padding = window_size // 2
+            padded = cv2.copyMakeBorder(
+                diff, padding, padding, padding, padding, cv2.BORDER_CONSTANT, value=0
+            )[:, :, 1:]
+            # The basis is fitted by the first call and reused by all others
+            pca_cache = PCAModelCache()
+            results, timings = {}, {}
+            for method in PROJECTION_METHODS:
+                best = np.inf
+                for _ in range(args.repeat):
+                    start_time = time.perf_counter()
+                    results[method] = descriptors_to_pca(
+                        padded,
+                        args.pca_dim,
+                        window_size,
+                        shape,
+                        projection=method,
+                        pca_cache=pca_cache,
+                    )
+                    best = min(best, time.perf_counter() - start_time)
+                timings[method] = best
+            if pca_cache.version != 1:
+                sys.exit(
+                    "The PCA basis was refitted, the projections are not comparable"
+                )
+
+            exact = results["tiled"]
+            error = np.abs(results["convolution"] - exact).max() / np.abs(exact).max()
+            failed |= not error < MAX_RELATIVE_ERROR
+            print(
+                f"{f'{width}x{height}':>10} {window_size:>6} "
+                + " ".join(f"{timings[m] * 1000:>15.1f}" for m in PROJECTION_METHODS)
+                + f" {error:>12.2e}"
+            )
+
+    if failed:
+        sys.exit("convolution projection differs from the tiled projection")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from framebuffer import FrameRingBuffer
+
+
+class CaptureMetrics:
+    """
+    Counters and rates of a `FrameCapture`, updated by its thread and read live by the GUI.
+    Attributes:
+        grabbed (int): The frames grabbed from the source.
+        decoded (int): The grabbed frames decoded into the frame buffer.
+        dropped (int): The grabbed frames skipped without decoding, as nothing would have consumed them.
+        failed (int): The failed grabs and decodes.
+    """
+
+    def __init__(self, window=60):
+        self.grabbed = 0
+        self.decoded = 0
+        self.dropped = 0
+        self.failed = 0
+        # (grab time, decoded) of the last grabbed frames
+        self._frames = deque(maxlen=window)
+
+    def record(self, grabbed_at, decoded):
+        """
+        Count a grabbed frame, decoded or dropped.
+        """
+        self.grabbed += 1
+        if decoded:
+            self.decoded += 1
+        else:
+            self.dropped += 1
+        self._frames.append((grabbed_at, decoded))
+
+    def _rate(self, frames):
+        if len(frames) < 2 or frames[-1][0] <= frames[0][0]:
+            return 0.0
+        return (len(frames) - 1) / (frames[-1][0] - frames[0][0])
+
+    @property
+    def fps(self):
+        """
+        The rate the source delivered the recent frames at, in frames per second.
+        """
+        return self._rate(tuple(self._frames))
+
+    @property
+    def decode_fps(self):
+        """
+        The rate of decoded frames over the recent frames, in frames per second.
+        """
+        frames = tuple(self._frames)
+        return self.fps * sum(decoded for _, decoded in frames) / max(len(frames), 1)
+
+    @property
+    def drop_rate(self):
+        """
+        The fraction of the recent frames dropped without decoding.
+        """
+        frames = tuple(self._frames)
+        return sum(not decoded for _, decoded in frames) / max(len(frames), 1)
+
+
+class FrameCapture:
+    """
+    Captures frames from a camera on a background thread into a `FrameRingBuffer`. Every frame is grabbed as soon as
+    the camera delivers it, so the camera never queues stale frames, but only decoded when something will consume
+    it: the display, at most `display_fps` times per second, and whoever `wants_frame`, e.g. an idle scheduler. The
+    thread blocks in `grab` while waiting for the camera, and backs off for `retry_interval` when the camera fails.
+    Decoded frames are numbered by their sequence numbers in the frame buffer and stamped with their grab time.
+    Attributes:
+        source (cv2.VideoCapture): The camera, or anything with its isOpened, grab and retrieve methods.
+        frame_buffer (FrameRingBuffer): The decoded frames, created with the size of the first one, None before, and
+            replaced by a new buffer when the size of the frames changes.
+        metrics (CaptureMetrics): The live capture counters and rates.
+        wants_frame (callable): Returns whether a consumer waits for a frame, checked for every grabbed frame.
+        on_frame (callable): Called on the capture thread with the `framebuffer.FrameRef` of every frame decoded
+            because `wants_frame` returned True.
+        display_fps (float): The rate of frames decoded for display only.
+    """
+
+    def __init__(
+        self,
+        source,
+        slots=4,
+        readers=2,
+        wants_frame=None,
+        on_frame=None,
+        display_fps=30,
+        retry_interval=0.1,
+    ):
+        self.source = source
+        self.slots = slots
+        self.readers = readers
+        self.wants_frame = wants_frame
+        self.on_frame = on_frame
+        self.display_fps = display_fps
+        self.retry_interval = retry_interval
+        self.frame_buffer = None
+        # The buffer replaced last, still read by consumers that fetched it before it was replaced
+        self._retired_buffer = None
+        self.metrics = CaptureMetrics()
+        self._decoded_at = -float("inf")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        """
+        Stop the capture thread, waiting up to `timeout` for a blocked `grab` to return, and free the frame buffer.
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        # A thread still blocked in grab would decode into the freed slots
+        if self.frame_buffer is not None and not self._thread.is_alive():
+            self.frame_buffer.close()
+            self.frame_buffer = None
+            if self._retired_buffer is not None:
+                self._retired_buffer.close()
+                self._retired_buffer = None
+
+    def latest(self):
+        """
+        Returns:
+            framebuffer.FrameRef: The latest decoded frame, or None before the first one.
+        """
+        frame_buffer = self.frame_buffer
+        if frame_buffer is None:
+            return None
+        slot, sequence = frame_buffer.latest()
+        return frame_buffer.ref(slot) if sequence > 0 else None
+
+    def latest_frame(self):
+        """
+        The latest decoded frame and its id, (0, None) before the first one. The frame is a view of a slot of the
+        frame buffer that capture overwrites once newer frames arrive, which is fine for display. Use `lease` to keep
+        the frame intact while using it.
+        """
+        frame_buffer = self.frame_buffer
+        if frame_buffer is None:
+            return 0, None
+        slot, sequence = frame_buffer.latest()
+        return sequence, frame_buffer.frames[slot] if sequence > 0 else None
+
+    def frame_age(self, now=None):
+        """
+        Seconds since the latest decoded frame was grabbed, None before the first one.
+        """
+        ref = self.latest()
+        return None if ref is None else ref.age(now)
+
+    @contextmanager
+    def lease(self, reader):
+        """
+        Lease the latest decoded frame, so capture does not overwrite it until the context exits.
+        Args:
+            reader (int): The reader id of the lease in the frame buffer.
+        Yields:
+            np.array: The frame, a view of its slot in the frame buffer.
+        Raises:
+            ValueError: If no frame was decoded yet.
+        """
+        frame_buffer = self.frame_buffer
+        lease = None if frame_buffer is None else frame_buffer.acquire(reader)
+        if lease is None:
+            raise ValueError("No frame captured yet")
+        try:
+            yield frame_buffer.frames[lease[0]]
+        finally:
+            frame_buffer.release(reader)
+
+    def _run(self):
+        while not self._stop.is_set() and self.source.isOpened():
+            if not self.source.grab():
+                self.metrics.failed += 1
+                # A disconnected camera fails at once, do not spin on it
+                self._stop.wait(self.retry_interval)
+                continue
+            grabbed_at = time.perf_counter()
+            wanted = self.wants_frame is not None and self.wants_frame()
+            # Leave room for jitter, or a camera running at `display_fps` would only be decoded every other frame
+            due = (grabbed_at - self._decoded_at) * self.display_fps >= 0.8
+            if not (wanted or due):
+                self.metrics.record(grabbed_at, decoded=False)
+                continue
+
+            ref = self._decode(grabbed_at)
+            if ref is None:
+                self.metrics.failed += 1
+                continue
+            self.metrics.record(grabbed_at, decoded=True)
+            self._decoded_at = grabbed_at
+            if wanted and self.on_frame is not None:
+                self.on_frame(ref)
+
+    def _decode(self, grabbed_at):
+        if self.frame_buffer is None:
+            ret, frame = self.source.retrieve()
+        else:
+            slot, view = self.frame_buffer.begin_write()
+            ret, frame = self.source.retrieve(image=view)
+            if ret and frame is view:
+                self.frame_buffer.commit(grabbed_at)
+                return self.frame_buffer.ref(slot)
+            # No frame, or the backend allocated a new one instead of decoding into the slot, e.g. of another size
+            self.frame_buffer.abort()
+        if not ret:
+            return None
+        if (
+            self.frame_buffer is None
+            or frame.shape != self.frame_buffer.shape
+            or frame.dtype != self.frame_buffer.dtype
+        ):
+            self._replace_buffer(frame.shape, frame.dtype)
+        slot, view = self.frame_buffer.begin_write()
+        view[...] = frame
+        self.frame_buffer.commit(grabbed_at)
+        return self.frame_buffer.ref(slot)
+
+    def _replace_buffer(self, shape, dtype):
+        """
+        Decode into a new frame buffer for frames of another size. The previous buffer may still be read, e.g. by the
+        display, so it is only closed when the buffer is replaced again or capture stops, and not before the frames
+        leased from it are released.
+        """
+        if self._retired_buffer is not None:
+            self._retired_buffer.close()
+        self._retired_buffer = self.frame_buffer
+        self.frame_buffer = FrameRingBuffer(
+            shape, dtype, slots=self.slots, readers=self.readers
+        )
@@ -1,16 +1,31 @@
 import os
+import contextlib
+import hashlib
+import importlib
+import threading
+from collections import OrderedDict
+
 import cv2
 import numpy as np
 
-from skimage.exposure import match_histograms
-from sklearn.cluster import KMeans, DBSCAN
-from sklearn.decomposition import PCA
+import time
 
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
-import seaborn as sns
+from alignment import create_matcher, keypoints_to_array
+from artifacts import resolve_sink
+from instrumentation import record_metrics, stage
+from histogram import match_histograms_lut
 
-import time
+# sklearn, matplotlib and seaborn are imported where they are used, so that importing this module stays cheap
+# for callers that never run change detection
+CHANGECHIP_MODULES = ("sklearn.cluster", "sklearn.decomposition")
+
+
+def preload_modules(modules=CHANGECHIP_MODULES):
+    """
+    Import the heavy dependencies of change detection ahead of their first use, e.g. from a background thread.
+    """
+    for module in modules:
+        importlib.import_module(module)
 
 
 def resize_images(images, resize_factor=1.0):
@@ -29,135 +44,712 @@ def resize_images(images, resize_factor=1.0):
     input_image, reference_image = images
     average_width = (input_image.shape[1] + reference_image.shape[1]) * 0.5
     average_height = (input_image.shape[0] + reference_image.shape[0]) * 0.5
-    new_shape = (
-        int(resize_factor * average_width),
-        int(resize_factor * average_height),
+    return resize_to(images, (average_height, average_width), resize_factor)
+
+
+def resize_to(images, shape, resize_factor=1.0):
+    """
+    Resize images to a (height, width) `shape` scaled by `resize_factor`.
+    Returns:
+        tuple: The resized images.
+    """
+    new_shape = (int(resize_factor * shape[1]), int(resize_factor * shape[0]))
+    return tuple(
+        cv2.resize(image, new_shape, interpolation=cv2.INTER_AREA) for image in images
     )
 
-    input_image = cv2.resize(input_image, new_shape, interpolation=cv2.INTER_AREA)
-    reference_image = cv2.resize(
-        reference_image, new_shape, interpolation=cv2.INTER_AREA
+
+class ReferenceFeatures:
+    """
+    Keypoints and descriptors of a reference image, computed once and reused for every frame aligned against it.
+    Attributes:
+        keypoints (tuple): The keypoints of the reference image.
+        points (numpy.ndarray): The (N, 2) coordinates of the keypoints.
+        descriptors (numpy.ndarray): The descriptors of the reference image.
+        shape (tuple): The (height, width) of the image the features were computed on.
+        detector (str): The feature detector used, "sift" or "orb".
+        digest (str): The `image_digest` of the image the features were computed on.
+    """
+
+    def __init__(self, keypoints, descriptors, shape, detector="sift", digest=None):
+        self.keypoints = keypoints
+        self.points = keypoints_to_array(keypoints)
+        self.descriptors = descriptors
+        self.shape = tuple(shape)
+        self.detector = detector
+        self.digest = digest
+        self._matchers = {}
+
+    @classmethod
+    def compute(cls, image, detector="sift"):
+        """
+        Detect keypoints and compute their descriptors for an image.
+        Args:
+            image (numpy.ndarray): The (already resized) reference image.
+            detector (str, optional): "sift" or "orb". ORB features are computed on the grayscale image. Defaults to "sift".
+        Returns:
+            ReferenceFeatures: The features of the image.
+        """
+        if detector == "orb":
+            keypoints, descriptors = cv2.ORB_create().detectAndCompute(
+                cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), None
+            )
+        else:
+            keypoints, descriptors = cv2.SIFT_create().detectAndCompute(image, None)
+        return cls(
+            keypoints,
+            descriptors,
+            image.shape[:2],
+            detector=detector,
+            digest=image_digest(image),
+        )
+
+    def matches_image(self, image, detector="sift", digest=None):
+        """
+        Check whether these features were computed by `detector` on `image`, comparing content hashes.
+        Args:
+            image (numpy.ndarray): The image.
+            detector (str, optional): The feature detector. Defaults to "sift".
+            digest (str, optional): The `image_digest` of `image` if known, saves hashing it. Defaults to None.
+        """
+        if self.detector != detector or self.shape != tuple(image.shape[:2]):
+            return False
+        return self.digest == (image_digest(image) if digest is None else digest)
+
+    def matcher(self, backend="bruteforce", cross_check=False):
+        """
+        Return a matcher indexed over the reference descriptors, building the index on first use.
+        Args:
+            backend (str, optional): The matcher backend, see `alignment.create_matcher`. Defaults to "bruteforce".
+            cross_check (bool, optional): Keep only mutual best matches (brute force only). Defaults to False.
+        Returns:
+            alignment.DescriptorMatcher: The trained matcher.
+        """
+        key = (backend, cross_check)
+        matcher = self._matchers.get(key)
+        if matcher is None:
+            matcher = create_matcher(
+                self.descriptors,
+                backend,
+                binary=self.detector == "orb",
+                cross_check=cross_check,
+            )
+            self._matchers[key] = matcher
+        return matcher
+
+
+# Reference features keyed by (content hash, resize factor). The reference only changes when the
+# operator captures or uploads a new one, so a handful of entries is enough.
+REFERENCE_FEATURE_CACHE_SIZE = 4
+_reference_feature_cache = OrderedDict()
+_reference_feature_cache_lock = threading.Lock()
+
+
+def image_digest(image):
+    """
+    Compute a content hash of an image, including its shape and dtype.
+    Args:
+        image (numpy.ndarray): The image to hash.
+    Returns:
+        str: The hex digest of the image.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((image.shape, image.dtype.str)).encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+def get_reference_features(reference_image, resize_factor=1.0):
+    """
+    Return the SIFT features of a reference image resized by `resize_factor`, computing them only on a cache miss.
+    Args:
+        reference_image (numpy.ndarray): The full-size reference image.
+        resize_factor (float, optional): The factor the reference is resized by before detection. Defaults to 1.0.
+    Returns:
+        ReferenceFeatures: The cached features of the resized reference image.
+    Example:
+        >>> features = get_reference_features(reference_image, resize_factor=0.5)
+        >>> pipeline((input_image, reference_image), resize_factor=0.5, reference_features=features)
+    """
+    key = (image_digest(reference_image), resize_factor)
+    with _reference_feature_cache_lock:
+        features = _reference_feature_cache.get(key)
+        if features is not None:
+            _reference_feature_cache.move_to_end(key)
+            return features
+
+    height, width = reference_image.shape[:2]
+    resized_reference = cv2.resize(
+        reference_image,
+        (int(resize_factor * width), int(resize_factor * height)),
+        interpolation=cv2.INTER_AREA,
     )
+    features = ReferenceFeatures.compute(resized_reference)
 
-    return input_image, reference_image
+    with _reference_feature_cache_lock:
+        _reference_feature_cache[key] = features
+        while len(_reference_feature_cache) > REFERENCE_FEATURE_CACHE_SIZE:
+            _reference_feature_cache.popitem(last=False)
+    return features
 
 
-def homography(images, debug=False, output_directory=None):
+class ReferenceModel:
     """
-    Apply homography transformation to align two images.
+    The reference side of the preprocessing of a golden board, built once and reused for every board inspected
+    against it: the resized reference and its SIFT features and matcher index. Pass it to `pipeline` in place of the
+    reference image. The histogram matching still runs per board, on the reference warped onto the board, so a model
+    gives the same results as the reference image it was built from.
+    Attributes:
+        image (numpy.ndarray): The reference resized by `resize_factor`.
+        features (ReferenceFeatures): The features of the reference at the resolution they are detected at, the
+            resized reference or, for pyramid alignment, the coarse level.
+        resize_factor (float): The resize factor the model was built for.
+        alignment (str): The alignment mode the model was built for, "features" or "pyramid".
+        pyramid_factor (float): The extra downsampling of the coarse pyramid level.
+        coarse_image (numpy.ndarray): The reference at the coarse pyramid level, None for feature alignment.
+    """
+
+    def __init__(
+        self,
+        image,
+        features,
+        resize_factor=1.0,
+        alignment="features",
+        pyramid_factor=0.25,
+        coarse_image=None,
+    ):
+        self.image = image
+        self.features = features
+        self.resize_factor = resize_factor
+        self.alignment = alignment
+        self.pyramid_factor = pyramid_factor
+        self.coarse_image = coarse_image
+
+    @classmethod
+    def build(
+        cls,
+        reference_image,
+        resize_factor=1.0,
+        alignment="features",
+        pyramid_factor=0.25,
+        matcher="bruteforce",
+    ):
+        """
+        Precompute the reference side of `preprocess_images` for a golden board.
+        Args:
+            reference_image (numpy.ndarray): The full-size reference image.
+            resize_factor (float, optional): The resize factor of the pipeline. Defaults to 1.0.
+            alignment (str, optional): The alignment mode of the pipeline, "features" or "pyramid". Defaults to "features".
+            pyramid_factor (float, optional): The extra downsampling of the coarse pyramid level. Defaults to 0.25.
+            matcher (str, optional): The matcher backend whose index is built ahead. Defaults to "bruteforce".
+        Returns:
+            ReferenceModel: The model of the reference.
+        Raises:
+            ValueError: If the alignment mode is unknown.
+        """
+        if alignment not in ("features", "pyramid"):
+            raise ValueError(
+                f"Unknown alignment mode '{alignment}', expected 'features' or 'pyramid'"
+            )
+        (image,) = resize_to((reference_image,), reference_image.shape, resize_factor)
+        coarse_image = None
+        detection_image = image
+        if alignment == "pyramid":
+            (coarse_image,) = resize_to(
+                (reference_image,),
+                reference_image.shape,
+                resize_factor * pyramid_factor,
+            )
+            detection_image = coarse_image
+        features = ReferenceFeatures.compute(detection_image)
+        features.matcher(matcher)
+        return cls(
+            image,
+            features,
+            resize_factor=resize_factor,
+            alignment=alignment,
+            pyramid_factor=pyramid_factor,
+            coarse_image=coarse_image,
+        )
+
+    def check(self, resize_factor, alignment, pyramid_factor):
+        """
+        Raise a ValueError unless the model was built for these pipeline parameters.
+        """
+        if (resize_factor, alignment) != (self.resize_factor, self.alignment) or (
+            alignment == "pyramid" and pyramid_factor != self.pyramid_factor
+        ):
+            raise ValueError(
+                f"Reference model built for resize_factor={self.resize_factor}, alignment='{self.alignment}' "
+                f"and pyramid_factor={self.pyramid_factor}, got resize_factor={resize_factor}, "
+                f"alignment='{alignment}' and pyramid_factor={pyramid_factor}"
+            )
+
+    def save(self, path):
+        """
+        Save the model to a ".npz" file. Matcher indices are not saved, they are rebuilt on first use after `load`.
+        """
+        keypoints = self.features.keypoints
+        arrays = dict(
+            image=self.image,
+            keypoints=np.array(
+                [
+                    (*k.pt, k.size, k.angle, k.response, k.octave, k.class_id)
+                    for k in keypoints
+                ],
+                dtype=np.float64,
+            ).reshape(-1, 7),
+            descriptors=self.features.descriptors,
+            feature_shape=np.array(self.features.shape),
+            detector=np.array(self.features.detector),
+            resize_factor=np.array(self.resize_factor),
+            alignment=np.array(self.alignment),
+            pyramid_factor=np.array(self.pyramid_factor),
+        )
+        if self.coarse_image is not None:
+            arrays["coarse_image"] = self.coarse_image
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a model saved with `save`.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            keypoints = tuple(
+                cv2.KeyPoint(x, y, size, angle, response, int(octave), int(class_id))
+                for x, y, size, angle, response, octave, class_id in data["keypoints"]
+            )
+            features = ReferenceFeatures(
+                keypoints,
+                data["descriptors"],
+                data["feature_shape"],
+                detector=str(data["detector"]),
+            )
+            coarse_image = data["coarse_image"] if "coarse_image" in data else None
+            # The features were detected on the coarse level for pyramid alignment
+            features.digest = image_digest(
+                data["image"] if coarse_image is None else coarse_image
+            )
+            return cls(
+                data["image"],
+                features,
+                resize_factor=float(data["resize_factor"]),
+                alignment=str(data["alignment"]),
+                pyramid_factor=float(data["pyramid_factor"]),
+                coarse_image=coarse_image,
+            )
+
+
+def estimate_homography(
+    images,
+    debug=False,
+    output_directory=None,
+    reference_features=None,
+    matcher="bruteforce",
+    return_inliers=False,
+    artifacts=None,
+):
+    """
+    Estimate the homography that maps reference image coordinates onto input image coordinates from SIFT matches.
     Args:
         images (tuple): A tuple containing two images, where the first image is the input image and the second image is the reference image.
-        debug (bool, optional): If True, debug images will be generated. Defaults to False.
+        debug (bool, optional): If True, an image of the matches will be generated. Defaults to False.
         output_directory (str, optional): The directory to save the debug images. Defaults to None.
+        reference_features (ReferenceFeatures, optional): Precomputed features of the reference image. They are
+            recomputed if missing or computed on another image. Defaults to None.
+        matcher (str, optional): The descriptor matcher backend, "bruteforce" or "flann". Defaults to "bruteforce".
+        return_inliers (bool, optional): Also return the reference and input coordinates of the RANSAC inliers. Defaults to False.
+        artifacts (ArtifactSink, optional): Receives the debug artefacts in place of `debug` and `output_directory`,
+            see `artifacts.resolve_sink`. Defaults to None.
     Returns:
-        tuple: A tuple containing the aligned input image and the reference image.
+        numpy.ndarray: The 3x3 homography matrix, followed by the inlier reference and input points if `return_inliers` is True.
     """
     input_image, reference_image = images
     # Initiate SIFT detector
     sift = cv2.SIFT_create()
 
     # find the keypoints and descriptors with SIFT
-    input_keypoints, input_descriptors = sift.detectAndCompute(input_image, None)
-    reference_keypoints, reference_descriptors = sift.detectAndCompute(
-        reference_image, None
-    )
-    # BFMatcher with default params
-    bf = cv2.BFMatcher()
-    matches = bf.knnMatch(reference_descriptors, input_descriptors, k=2)
-
-    # Apply ratio test
-    good_draw = []
-    good_without_list = []
-    for m, n in matches:
-        if m.distance < 0.8 * n.distance:  # 0.8 = a value suggested by David G. Lowe.
-            good_draw.append([m])
-            good_without_list.append(m)
+    with stage("sift"):
+        input_keypoints, input_descriptors = sift.detectAndCompute(input_image, None)
+        if reference_features is None or not reference_features.matches_image(
+            reference_image
+        ):
+            reference_features = ReferenceFeatures.compute(reference_image)
+    reference_keypoints = reference_features.keypoints
+
+    # Match the input descriptors against the reference index and apply the ratio test
+    # (0.8 = a value suggested by David G. Lowe)
+    with stage("match"):
+        input_indices, reference_indices = reference_features.matcher(
+            matcher
+        ).good_matches(input_descriptors, ratio=0.8)
 
     # cv.drawMatchesKnn expects list of lists as matches.
-    if debug:
-        assert output_directory is not None, "Output directory must be provided"
-        os.makedirs(output_directory, exist_ok=True)
-        cv2.imwrite(
-            os.path.join(output_directory, "matching.png"),
-            cv2.drawMatchesKnn(
-                reference_image,
-                reference_keypoints,
-                input_image,
-                input_keypoints,
-                good_draw,
-                None,
-                flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS,
-            ),
-        )
+    artifacts = resolve_sink(artifacts, debug, output_directory)
+    artifacts.emit(
+        "matching.png",
+        lambda: cv2.drawMatchesKnn(
+            input_image,
+            input_keypoints,
+            reference_image,
+            reference_keypoints,
+            [
+                [cv2.DMatch(int(query), int(train), 0)]
+                for query, train in zip(input_indices, reference_indices)
+            ],
+            None,
+            flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS,
+        ),
+    )
 
     # Extract location of good matches
-    reference_points = np.zeros((len(good_without_list), 2), dtype=np.float32)
-    input_points = reference_points.copy()
-
-    for i, match in enumerate(good_without_list):
-        input_points[i, :] = reference_keypoints[match.queryIdx].pt
-        reference_points[i, :] = input_keypoints[match.trainIdx].pt
+    input_points = keypoints_to_array(input_keypoints)[input_indices]
+    reference_points = reference_features.points[reference_indices]
 
     # Find homography
-    h, _ = cv2.findHomography(input_points, reference_points, cv2.RANSAC)
+    with stage("ransac"):
+        h, mask = cv2.findHomography(reference_points, input_points, cv2.RANSAC)
+    if return_inliers:
+        inliers = mask.ravel() == 1
+        return h, reference_points[inliers], input_points[inliers]
+    return h
 
-    # Use homography
-    height, width = reference_image.shape[:2]
-    white_reference_image = 255 - np.zeros(shape=reference_image.shape, dtype=np.uint8)
-    white_reg = cv2.warpPerspective(white_reference_image, h, (width, height))
-    blank_pixels_mask = np.any(white_reg != [255, 255, 255], axis=-1)
-    reference_image_registered = cv2.warpPerspective(
-        reference_image, h, (width, height)
+
+# The valid-region mask only stays the same while the homography does (tracked or reused alignment),
+# so the last mask is enough.
+_warp_mask_cache = {}
+
+
+def warp_valid_mask(h, shape):
+    """
+    Compute the region of the output covered by an image of `shape` warped with `h`, as the filled polygon of its
+    projected corners. The corners are inset by one pixel so pixels blended with the border are excluded.
+    Args:
+        h (numpy.ndarray): The homography the image is warped with.
+        shape (tuple): The (height, width) of both the warped image and the output.
+    Returns:
+        numpy.ndarray: A (height, width) uint8 mask, 1 inside the warped image and 0 outside.
+    """
+    height, width = shape[:2]
+    key = (np.asarray(h, dtype=np.float64).tobytes(), height, width)
+    mask = _warp_mask_cache.get(key)
+    if mask is not None:
+        return mask
+
+    corners = np.float32(
+        [[1, 1], [width - 2, 1], [width - 2, height - 2], [1, height - 2]]
+    ).reshape(-1, 1, 2)
+    polygon = cv2.perspectiveTransform(corners, np.asarray(h, dtype=np.float64))
+    shift = 8  # sub-pixel precision of the polygon vertices
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.fillConvexPoly(
+        mask,
+        np.round(polygon.reshape(-1, 2) * (1 << shift)).astype(np.int32),
+        1,
+        cv2.LINE_8,
+        shift,
     )
-    if debug:
-        assert output_directory is not None, "Output directory must be provided"
-        cv2.imwrite(
-            os.path.join(output_directory, "aligned.png"), reference_image_registered
+    _warp_mask_cache.clear()
+    _warp_mask_cache[key] = mask
+    return mask
+
+
+def warp_reference(images, h, debug=False, output_directory=None, artifacts=None):
+    """
+    Warp the reference image onto the input image with a homography and black out the pixels it does not cover in both images.
+    Args:
+        images (tuple): A tuple containing the input image and the reference image.
+        h (numpy.ndarray): The homography mapping reference coordinates onto input coordinates.
+        debug (bool, optional): If True, the aligned reference image will be saved. Defaults to False.
+        output_directory (str, optional): The directory to save the debug images. Defaults to None.
+        artifacts (ArtifactSink, optional): Receives the debug artefacts in place of `debug` and `output_directory`,
+            see `artifacts.resolve_sink`. Defaults to None.
+    Returns:
+        tuple: A tuple containing the masked input image and the registered reference image.
+    """
+    input_image, reference_image = images
+    height, width = reference_image.shape[:2]
+    with stage("warp"):
+        valid_mask = warp_valid_mask(h, (height, width))
+        reference_image_registered = cv2.warpPerspective(
+            reference_image, h, (width, height)
         )
+        artifacts = resolve_sink(artifacts, debug, output_directory)
+        artifacts.emit("aligned.png", lambda: reference_image_registered)
 
-    input_image[blank_pixels_mask] = [0, 0, 0]
-    reference_image_registered[blank_pixels_mask] = [0, 0, 0]
+        # Zero the uncovered pixels in place, multiplying by the 0/1 mask
+        valid_mask = valid_mask[..., np.newaxis]
+        np.multiply(input_image, valid_mask, out=input_image)
+        np.multiply(reference_image_registered, valid_mask, out=reference_image_registered)
 
     return input_image, reference_image_registered
 
 
-def histogram_matching(images, debug=False, output_directory=None):
+def homography(
+    images,
+    debug=False,
+    output_directory=None,
+    reference_features=None,
+    matcher="bruteforce",
+    artifacts=None,
+):
+    """
+    Apply homography transformation to align two images.
+    Args:
+        images (tuple): A tuple containing two images, where the first image is the input image and the second image is the reference image.
+        debug (bool, optional): If True, debug images will be generated. Defaults to False.
+        output_directory (str, optional): The directory to save the debug images. Defaults to None.
+        reference_features (ReferenceFeatures, optional): Precomputed features of the reference image. They are
+            recomputed if missing or computed on another image. Defaults to None.
+        matcher (str, optional): The descriptor matcher backend, "bruteforce" or "flann". Defaults to "bruteforce".
+        artifacts (ArtifactSink, optional): Receives the debug artefacts in place of `debug` and `output_directory`,
+            see `artifacts.resolve_sink`. Defaults to None.
+    Returns:
+        tuple: A tuple containing the aligned input image and the reference image.
+    """
+    h = estimate_homography(
+        images,
+        debug=debug,
+        output_directory=output_directory,
+        reference_features=reference_features,
+        matcher=matcher,
+        artifacts=artifacts,
+    )
+    return warp_reference(
+        images,
+        h,
+        debug=debug,
+        output_directory=output_directory,
+        artifacts=artifacts,
+    )
+
+
+def scale_homography(h, source_shape, target_shape):
+    """
+    Rescale a homography estimated between images of `source_shape` so that it applies to images of `target_shape`.
+    Args:
+        h (numpy.ndarray): The 3x3 homography estimated at the source resolution.
+        source_shape (tuple): The (height, width) the homography was estimated at.
+        target_shape (tuple): The (height, width) it should apply to.
+    Returns:
+        numpy.ndarray: The rescaled homography.
+    """
+    scale_x = source_shape[1] / target_shape[1]
+    scale_y = source_shape[0] / target_shape[0]
+    # Maps target pixel centres onto source pixel centres
+    to_source = np.array(
+        [
+            [scale_x, 0, 0.5 * scale_x - 0.5],
+            [0, scale_y, 0.5 * scale_y - 0.5],
+            [0, 0, 1],
+        ]
+    )
+    h = np.linalg.inv(to_source) @ h @ to_source
+    return h / h[2, 2]
+
+
+def refine_homography_ecc(images, h, iterations=30, epsilon=1e-5):
+    """
+    Refine a homography to sub-pixel accuracy by maximising the enhanced correlation coefficient (ECC) between the
+    grayscale input image and the warped reference image.
+    Args:
+        images (tuple): A tuple containing the input image and the reference image.
+        h (numpy.ndarray): The initial homography mapping reference coordinates onto input coordinates.
+        iterations (int, optional): The maximum number of ECC iterations. Defaults to 30.
+        epsilon (float, optional): The ECC convergence threshold. Defaults to 1e-5.
+    Returns:
+        numpy.ndarray: The refined homography, or the initial one if ECC does not converge.
+    """
+    input_image, reference_image = images
+    input_gray = cv2.cvtColor(input_image, cv2.COLOR_BGR2GRAY)
+    reference_gray = cv2.cvtColor(reference_image, cv2.COLOR_BGR2GRAY)
+    # ECC warps the reference onto the input, i.e. it expects the input-to-reference mapping
+    warp_matrix = np.linalg.inv(h).astype(np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, iterations, epsilon)
+    try:
+        _, warp_matrix = cv2.findTransformECC(
+            input_gray,
+            reference_gray,
+            warp_matrix,
+            cv2.MOTION_HOMOGRAPHY,
+            criteria,
+            None,
+            5,
+        )
+    except cv2.error as e:
+        print(f"ECC refinement failed, keeping the coarse homography: {e}")
+        return h
+    h = np.linalg.inv(warp_matrix.astype(np.float64))
+    return h / h[2, 2]
+
+
+def refine_homography_patches(
+    images, h, reference_points, patch_size=31, max_patches=400
+):
+    """
+    Refine a homography to sub-pixel accuracy with a local patch search: a patch around each reference point is
+    tracked into the input image with iterative Lucas-Kanade, starting from the position predicted by `h`, and the
+    homography is re-estimated from the refined positions.
+    Args:
+        images (tuple): A tuple containing the input image and the reference image.
+        h (numpy.ndarray): The initial homography mapping reference coordinates onto input coordinates.
+        reference_points (numpy.ndarray): (N, 2) reference coordinates of well textured points, e.g. the coarse inliers.
+        patch_size (int, optional): The side of the square patches. Defaults to 31.
+        max_patches (int, optional): The maximum number of patches tracked. Defaults to 400.
+    Returns:
+        numpy.ndarray: The refined homography, or the initial one if too few patches could be tracked.
+    """
+    input_image, reference_image = images
+    input_gray = cv2.cvtColor(input_image, cv2.COLOR_BGR2GRAY)
+    reference_gray = cv2.cvtColor(reference_image, cv2.COLOR_BGR2GRAY)
+
+    step = max(1, len(reference_points) // max_patches)
+    reference_points = np.ascontiguousarray(
+        reference_points[::step], dtype=np.float32
+    ).reshape(-1, 1, 2)
+    predicted_points = cv2.perspectiveTransform(reference_points, h).astype(np.float32)
+    refined_points, status, _ = cv2.calcOpticalFlowPyrLK(
+        reference_gray,
+        input_gray,
+        reference_points,
+        predicted_points,
+        winSize=(patch_size, patch_size),
+        maxLevel=1,
+        criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.001),
+        flags=cv2.OPTFLOW_USE_INITIAL_FLOW,
+    )
+    tracked = status.ravel() == 1
+    if np.count_nonzero(tracked) < 8:
+        return h
+    refined, _ = cv2.findHomography(
+        reference_points[tracked], refined_points[tracked], cv2.RANSAC, 1.0
+    )
+    if refined is None:
+        return h
+    return refined / refined[2, 2]
+
+
+def pyramid_homography(
+    images,
+    coarse_images=None,
+    pyramid_factor=0.25,
+    debug=False,
+    output_directory=None,
+    reference_features=None,
+    matcher="bruteforce",
+    refinement="patches",
+    artifacts=None,
+):
+    """
+    Align two images coarse-to-fine: the homography is estimated from SIFT matches on a heavily downsampled pair and
+    then refined at the full resolution of `images`.
+    Args:
+        images (tuple): A tuple containing the input image and the reference image at full resolution.
+        coarse_images (tuple, optional): The downsampled pair. Defaults to `images` resized by `pyramid_factor`.
+        pyramid_factor (float, optional): The resize factor of the coarse level. Defaults to 0.25.
+        debug (bool, optional): If True, debug images will be generated. Defaults to False.
+        output_directory (str, optional): The directory to save the debug images. Defaults to None.
+        reference_features (ReferenceFeatures, optional): Precomputed features of the coarse reference image. Defaults to None.
+        matcher (str, optional): The descriptor matcher backend. Defaults to "bruteforce".
+        refinement (str, optional): "patches" for a Lucas-Kanade patch search around the coarse inliers (fast),
+            "ecc" for ECC maximisation over the whole image (slow at 4K), or None. Defaults to "patches".
+        artifacts (ArtifactSink, optional): Receives the debug artefacts in place of `debug` and `output_directory`,
+            see `artifacts.resolve_sink`. Defaults to None.
+    Returns:
+        tuple: A tuple containing the aligned input image and the reference image.
+    """
+    if coarse_images is None:
+        with stage("resize"):
+            coarse_images = resize_images(images, pyramid_factor)
+    coarse_shape = coarse_images[0].shape[:2]
+    full_shape = images[0].shape[:2]
+    h, reference_points, _ = estimate_homography(
+        coarse_images,
+        debug=debug,
+        output_directory=output_directory,
+        reference_features=reference_features,
+        matcher=matcher,
+        return_inliers=True,
+        artifacts=artifacts,
+    )
+    h = scale_homography(h, coarse_shape, full_shape)
+    with stage("refine"):
+        if refinement == "patches":
+            # Coarse inlier pixel centres in full resolution coordinates
+            scale = np.array(full_shape[::-1]) / np.array(coarse_shape[::-1])
+            reference_points = (reference_points + 0.5) * scale - 0.5
+            h = refine_homography_patches(images, h, reference_points)
+        elif refinement == "ecc":
+            h = refine_homography_ecc(images, h)
+    return warp_reference(
+        images,
+        h,
+        debug=debug,
+        output_directory=output_directory,
+        artifacts=artifacts,
+    )
+
+
+def histogram_matching(
+    images,
+    debug=False,
+    output_directory=None,
+    artifacts=None,
+):
     """
     Perform histogram matching between an input image and a reference image.
     Args:
         images (tuple): A tuple containing the input image and the reference image.
         debug (bool, optional): If True, save the histogram-matched image to the output directory. Defaults to False.
         output_directory (str, optional): The directory to save the histogram-matched image. Defaults to None.
+        artifacts (ArtifactSink, optional): Receives the debug artefacts in place of `debug` and `output_directory`,
+            see `artifacts.resolve_sink`. Defaults to None.
     Returns:
         tuple: A tuple containing the input image and the histogram-matched reference image.
     """
 
     input_image, reference_image = images
 
-    reference_image_matched = match_histograms(
-        reference_image, input_image, channel_axis=-1
-    )
-    if debug:
-        assert output_directory is not None, "Output directory must be provided"
-        cv2.imwrite(
-            os.path.join(output_directory, "histogram_matched.jpg"),
-            reference_image_matched,
-        )
-    reference_image_matched = np.asarray(reference_image_matched, dtype=np.uint8)
+    with stage("histogram"):
+        reference_image_matched = match_histograms_lut(reference_image, input_image)
+    artifacts = resolve_sink(artifacts, debug, output_directory)
+    artifacts.emit("histogram_matched.jpg", lambda: reference_image_matched)
     return input_image, reference_image_matched
 
 
-def preprocess_images(images, resize_factor=1.0, debug=False, output_directory=None):
+def preprocess_images(
+    images,
+    resize_factor=1.0,
+    debug=False,
+    output_directory=None,
+    reference_features=None,
+    matcher="bruteforce",
+    alignment="features",
+    pyramid_factor=0.25,
+    artifacts=None,
+):
     """
     Preprocesses a list of images by performing the following steps:
     1. Resizes the images based on the given resize factor.
     2. Applies homography to align the resized images.
     3. Performs histogram matching on the aligned images.
     Args:
-        images (tuple): A tuple containing the input image and the reference image.
+        images (tuple): A tuple containing the input image and the reference image, or a `ReferenceModel` of the
+            reference built for `resize_factor`, `alignment` and `pyramid_factor`. With a model, the input image is
+            resized to the resolution of the model and the reference side is not recomputed.
         resize_factor (float, optional): The factor by which to resize the images. Defaults to 1.0.
         debug (bool, optional): Whether to enable debug mode. Defaults to False.
         output_directory (str, optional): The directory to save the output images. Defaults to None.
+        reference_features (ReferenceFeatures, optional): Precomputed features of the reference image at the
+            resolution features are detected at. If None, they are looked up in the reference feature cache. Defaults to None.
+        matcher (str, optional): The descriptor matcher backend used for alignment. Defaults to "bruteforce".
+        alignment (str, optional): "features" to detect SIFT features on the resized images, or "pyramid" to
+            detect them on a pair downsampled by a further `pyramid_factor` and refine the result at the resized
+            resolution, see `pyramid_homography`. Defaults to "features".
+        pyramid_factor (float, optional): The extra downsampling of the coarse pyramid level. Defaults to 0.25.
+        artifacts (ArtifactSink, optional): Receives the debug artefacts in place of `debug` and `output_directory`,
+            see `artifacts.resolve_sink`. Defaults to None.
     Returns:
         tuple: The preprocessed images.
     Example:
@@ -165,12 +757,61 @@ def preprocess_images(images, resize_factor=1.0, debug=False, output_directory=N
         >>> preprocess_images(images, resize_factor=0.5, debug=True, output_directory='output/')
     """
     start_time = time.time()
-    resized_images = resize_images(images, resize_factor)
-    aligned_images = homography(
-        resized_images, debug=debug, output_directory=output_directory
-    )
+    input_image, reference = images
+    with stage("resize"):
+        if isinstance(reference, ReferenceModel):
+            # Only the input image is processed, at the resolution of the model
+            reference.check(resize_factor, alignment, pyramid_factor)
+            resized_images = (
+                *resize_to((input_image,), reference.image.shape),
+                reference.image,
+            )
+            if alignment == "pyramid":
+                coarse_images = (
+                    *resize_to((input_image,), reference.coarse_image.shape),
+                    reference.coarse_image,
+                )
+            reference_features = reference.features
+        else:
+            resized_images = resize_images(images, resize_factor)
+            if alignment == "pyramid":
+                coarse_images = resize_images(images, resize_factor * pyramid_factor)
+    if alignment == "pyramid":
+        if reference_features is None:
+            with stage("sift"):
+                reference_features = get_reference_features(
+                    reference, resize_factor * pyramid_factor
+                )
+        aligned_images = pyramid_homography(
+            resized_images,
+            coarse_images=coarse_images,
+            debug=debug,
+            output_directory=output_directory,
+            reference_features=reference_features,
+            matcher=matcher,
+            artifacts=artifacts,
+        )
+    elif alignment == "features":
+        if reference_features is None:
+            with stage("sift"):
+                reference_features = get_reference_features(reference, resize_factor)
+        aligned_images = homography(
+            resized_images,
+            debug=debug,
+            output_directory=output_directory,
+            reference_features=reference_features,
+            matcher=matcher,
+            artifacts=artifacts,
+        )
+    else:
+        raise ValueError(
+            f"Unknown alignment mode '{alignment}', expected 'features' or 'pyramid'"
+        )
     matched_images = histogram_matching(
-        aligned_images, debug=debug, output_directory=output_directory
+        aligned_images,
+        debug=debug,
+        output_directory=output_directory,
+        artifacts=artifacts,
     )
     print("--- Preprocessing time - %s seconds ---" % (time.time() - start_time))
     return matched_images
@@ -219,26 +860,203 @@ def find_FVS(descriptors, EVS, mean_vec):
     return FVS
 
 
-# assumes descriptors is already flattened
+def window_view(padded_image, window_size, shape):
+    """
+    Return a strided (zero-copy) view of every window_size x window_size window of a padded image.
+    Args:
+        padded_image (numpy.ndarray): A (H + 2 * (window_size // 2), W + 2 * (window_size // 2), C) image.
+        window_size (int): The size of the sliding window.
+        shape (tuple): The (height, width) of the unpadded image.
+    Returns:
+        numpy.ndarray: A read-only (H, W, C, window_size, window_size) view. Flattening a pixel's entry gives its
+            channel-major, row-major window descriptor.
+    """
+    height, width = shape
+    windows = np.lib.stride_tricks.sliding_window_view(
+        padded_image, (window_size, window_size), axis=(0, 1)
+    )[:height, :width]  # (H, W, C, ws, ws)
+    return windows
+
+
+# Upper bound on the size of the window descriptors materialised at once when projecting onto the PCA basis
+PROJECTION_TILE_BYTES = 32 * 1024 * 1024
+
+
+def project_windows_tiled(padded_image, EVS, mean_vec, window_size, shape):
+    """
+    Project the window descriptor of every pixel onto a PCA basis, materialising the descriptors in row tiles.
+    Args:
+        padded_image (numpy.ndarray): The (H + 2 * (window_size // 2), W + 2 * (window_size // 2), C) padded image.
+        EVS (numpy.ndarray): The (pca_target_dim, C * window_size**2) PCA components.
+        mean_vec (numpy.ndarray): The mean vector projected onto the components.
+        window_size (int): Size of the sliding window.
+        shape (tuple): The (height, width) of the unpadded image.
+    Returns:
+        numpy.ndarray: The (H * W, pca_target_dim) feature vector set.
+    """
+    height, width = shape
+    windows = window_view(padded_image, window_size, shape)
+    descriptor_size = EVS.shape[1]
+    FVS = np.empty((height * width, EVS.shape[0]), dtype=np.float64)
+    tile_rows = max(1, PROJECTION_TILE_BYTES // (width * descriptor_size * 8))
+    for row in range(0, height, tile_rows):
+        tile = windows[row : row + tile_rows].reshape(-1, descriptor_size)
+        FVS[row * width : row * width + len(tile)] = find_FVS(
+            tile, EVS.transpose(), mean_vec
+        )
+    return FVS
+
+
+def project_windows_convolution(padded_image, EVS, mean_vec, window_size, shape):
+    """
+    Project the window descriptor of every pixel onto a PCA basis as a bank of 2D filters: each component, reshaped
+    to one window_size x window_size kernel per channel, is correlated with the image using `cv2.filter2D`.
+    No per-pixel descriptor is ever built. Computed in float64 like the tiled projection, which it matches up to
+    rounding, see `project_windows_tiled` for the arguments.
+    """
+    height, width = shape
+    channels = padded_image.shape[2]
+    kernels = EVS.reshape(-1, channels, window_size, window_size)
+    planes = [
+        np.ascontiguousarray(padded_image[:, :, channel], dtype=np.float64)
+        for channel in range(channels)
+    ]
+    FVS = np.empty((height * width, EVS.shape[0]), dtype=np.float64)
+    response = np.empty(planes[0].shape, dtype=np.float64)
+    for component, component_kernels in enumerate(kernels):
+        projection = np.zeros(planes[0].shape, dtype=np.float64)
+        for plane, kernel in zip(planes, component_kernels):
+            # With the anchor at the top left corner, output (y, x) covers the window of unpadded pixel (y, x)
+            cv2.filter2D(
+                plane,
+                cv2.CV_64F,
+                kernel,
+                dst=response,
+                anchor=(0, 0),
+                borderType=cv2.BORDER_CONSTANT,
+            )
+            projection += response
+        FVS[:, component] = projection[:height, :width].ravel()
+        FVS[:, component] -= mean_vec[component]
+    return FVS
+
+
+class PCAModelCache:
+    """
+    Keeps the PCA bases fitted on the frames compared against one reference, so consecutive live frames can skip
+    the PCA fit. A cached basis is reused as long as it still explains nearly as much of the new frame's variance as
+    it did when it was fitted; once the explained variance has drifted by more than `drift_tolerance` it is refitted.
+    Call `reset` whenever the reference changes.
+    Attributes:
+        drift_tolerance (float): The tolerated drop of the explained variance ratio.
+        version (int): Incremented whenever a basis is (re)fitted.
+    """
+
+    def __init__(self, drift_tolerance=0.02):
+        self.drift_tolerance = drift_tolerance
+        self.reset()
+
+    def reset(self):
+        self.bases = {}
+        self.version = 0
+
+    def components(self, vector_set, pca_target_dim):
+        """
+        Return the PCA components for a mean-normalised vector set, refitting them only when they have drifted.
+        Args:
+            vector_set (numpy.ndarray): The mean-normalised (N, D) vector set of the current frame.
+            pca_target_dim (int): Target dimensionality for PCA.
+        Returns:
+            numpy.ndarray: The (pca_target_dim, D) PCA components.
+        """
+        key = (vector_set.shape[1], pca_target_dim)
+        cached = self.bases.get(key)
+        if cached is not None:
+            EVS, fitted_ratio = cached
+            total_variance = np.sum(vector_set**2)
+            explained_ratio = (
+                np.sum(np.dot(vector_set, EVS.transpose()) ** 2) / total_variance
+                if total_variance > 0
+                else fitted_ratio
+            )
+            if fitted_ratio - explained_ratio <= self.drift_tolerance:
+                return EVS
+
+        from sklearn.decomposition import PCA
+
+        pca = PCA(pca_target_dim)
+        pca.fit(vector_set)
+        self.bases[key] = (pca.components_, pca.explained_variance_ratio_.sum())
+        self.version += 1
+        return pca.components_
+
+
+PROJECTION_METHODS = {
+    "tiled": project_windows_tiled,
+    "convolution": project_windows_convolution,
+}
+
+
 # returns descriptors after moving them into the PCA vector space
-def descriptors_to_pca(descriptors, pca_target_dim, window_size, shape):
+def descriptors_to_pca(
+    padded_image,
+    pca_target_dim,
+    window_size,
+    shape,
+    projection="tiled",
+    pca_cache=None,
+):
     """
-    Applies Principal Component Analysis (PCA) to a set of descriptors.
+    Applies Principal Component Analysis (PCA) to the window descriptors of a padded difference image.
+    The PCA basis is fitted on the non-overlapping windows only, and the descriptors of all pixels are then projected
+    onto it without materialising the full (H * W, C * window_size**2) descriptor matrix.
     Args:
-        descriptors (list): List of descriptors.
+        padded_image (numpy.ndarray): The (H + 2 * (window_size // 2), W + 2 * (window_size // 2), C) padded difference image.
         pca_target_dim (int): Target dimensionality for PCA.
         window_size (int): Size of the sliding window.
-        shape (tuple): Shape of the descriptors.
+        shape (tuple): The (height, width) of the unpadded image.
+        projection (str, optional): "tiled" to project the descriptors in row tiles, or "convolution" to apply
+            the components as 2D filters. Defaults to "tiled".
+        pca_cache (PCAModelCache, optional): Cache of the PCA bases of previous frames against the same reference.
+            Defaults to None.
     Returns:
-        list: Feature vector set after applying PCA.
+        numpy.ndarray: The (H * W, pca_target_dim) feature vector set after applying PCA.
     """
-    vector_set, mean_vec = find_vector_set(descriptors, window_size, shape)
-    pca = PCA(pca_target_dim)
-    pca.fit(vector_set)
-    EVS = pca.components_
-    mean_vec = np.dot(mean_vec, EVS.transpose())
-    FVS = find_FVS(descriptors, EVS.transpose(), mean_vec)
-    return FVS
+    windows = window_view(padded_image, window_size, shape)
+    descriptor_size = np.prod(windows.shape[2:])
+
+    with stage("pca"):
+        sampled_windows = windows[::window_size, ::window_size]
+        vector_set, mean_vec = find_vector_set(
+            sampled_windows.reshape(-1, descriptor_size), 1, sampled_windows.shape[:2]
+        )
+        if pca_cache is not None:
+            EVS = pca_cache.components(vector_set, pca_target_dim)
+        else:
+            from sklearn.decomposition import PCA
+
+            pca = PCA(pca_target_dim)
+            pca.fit(vector_set)
+            EVS = pca.components_
+        mean_vec = np.dot(mean_vec, EVS.transpose())
+    with stage("descriptors"):
+        return PROJECTION_METHODS[projection](
+            padded_image, EVS, mean_vec, window_size, shape
+        )
+
+
+def difference_channels(images):
+    """
+    Compute the grayscale difference and the per-channel absolute differences of two images.
+    Args:
+        images (tuple): A tuple containing the input image and reference image.
+    Returns:
+        numpy.ndarray: A (H, W, 4) uint8 image holding the grayscale difference followed by the three channel differences.
+    """
+    input_image, reference_image = images
+    diff_image = cv2.absdiff(input_image, reference_image)
+    diff_image_gray = cv2.cvtColor(diff_image, cv2.COLOR_BGR2GRAY)
+    return cv2.merge([diff_image_gray, *cv2.split(diff_image)])
 
 
 def get_descriptors(
@@ -248,6 +1066,9 @@ def get_descriptors(
     pca_dim_rgb,
     debug=False,
     output_directory=None,
+    projection="tiled",
+    pca_cache=None,
+    artifacts=None,
 ):
     """
     Compute descriptors for input images using sliding window technique and PCA.
@@ -258,6 +1079,12 @@ def get_descriptors(
         pca_dim_rgb (int): The number of dimensions to keep for RGB PCA.
         debug (bool, optional): Whether to enable debug mode. Defaults to False.
         output_directory (str, optional): The directory to save debug images. Required if debug is True.
+        projection (str, optional): How the window descriptors are projected onto the PCA basis, "tiled"
+            or "convolution", see `descriptors_to_pca`. Defaults to "tiled".
+        pca_cache (PCAModelCache, optional): Cache of the PCA bases of previous frames against the same reference.
+            Defaults to None.
+        artifacts (ArtifactSink, optional): Receives the debug artefacts in place of `debug` and `output_directory`,
+            see `artifacts.resolve_sink`. Defaults to None.
     Returns:
         numpy.ndarray: The computed descriptors.
     Raises:
@@ -265,88 +1092,43 @@ def get_descriptors(
     """
     input_image, reference_image = images
 
-    diff_image_gray = cv2.cvtColor(
-        cv2.absdiff(input_image, reference_image), cv2.COLOR_BGR2GRAY
-    )
-
-    if debug:
-        assert output_directory is not None, "Output directory must be provided"
-        cv2.imwrite(os.path.join(output_directory, "diff.jpg"), diff_image_gray)
-
-    # Padding for windowing
-    padded_diff_gray = np.pad(
-        diff_image_gray,
-        ((window_size // 2, window_size // 2), (window_size // 2, window_size // 2)),
-        mode="constant",
-    )
+    # Grayscale and 3-channel RGB differences
+    with stage("descriptors"):
+        diff_image = difference_channels(images)
 
-    # Sliding window for gray
-    shape = (input_image.shape[0], input_image.shape[1], window_size, window_size)
-    strides = padded_diff_gray.strides * 2
-    windows_gray = np.lib.stride_tricks.as_strided(
-        padded_diff_gray, shape=shape, strides=strides
+    artifacts = resolve_sink(artifacts, debug, output_directory)
+    artifacts.emit("diff.jpg", lambda: diff_image[:, :, 0])
+    artifacts.emit(
+        "final_diff.jpg", lambda: cv2.absdiff(input_image, reference_image)
     )
-    descriptors_gray_diff = windows_gray.reshape(-1, window_size * window_size)
-
-    # 3-channel RGB differences
-    diff_image_r = cv2.absdiff(input_image[:, :, 0], reference_image[:, :, 0])
-    diff_image_g = cv2.absdiff(input_image[:, :, 1], reference_image[:, :, 1])
-    diff_image_b = cv2.absdiff(input_image[:, :, 2], reference_image[:, :, 2])
-
-    if debug:
-        assert output_directory is not None, "Output directory must be provided"
-        cv2.imwrite(
-            os.path.join(output_directory, "final_diff.jpg"),
-            cv2.absdiff(input_image, reference_image),
+    artifacts.emit("final_diff_r.jpg", lambda: diff_image[:, :, 1])
+    artifacts.emit("final_diff_g.jpg", lambda: diff_image[:, :, 2])
+    artifacts.emit("final_diff_b.jpg", lambda: diff_image[:, :, 3])
+
+    # Padding for windowing, once for all four channels
+    padding = window_size // 2
+    with stage("descriptors"):
+        padded_diff = cv2.copyMakeBorder(
+            diff_image, padding, padding, padding, padding, cv2.BORDER_CONSTANT, value=0
         )
-        cv2.imwrite(os.path.join(output_directory, "final_diff_r.jpg"), diff_image_r)
-        cv2.imwrite(os.path.join(output_directory, "final_diff_g.jpg"), diff_image_g)
-        cv2.imwrite(os.path.join(output_directory, "final_diff_b.jpg"), diff_image_b)
-
-    # Padding for windowing RGB
-    padded_diff_r = np.pad(
-        diff_image_r,
-        ((window_size // 2, window_size // 2), (window_size // 2, window_size // 2)),
-        mode="constant",
-    )
-    padded_diff_g = np.pad(
-        diff_image_g,
-        ((window_size // 2, window_size // 2), (window_size // 2, window_size // 2)),
-        mode="constant",
-    )
-    padded_diff_b = np.pad(
-        diff_image_b,
-        ((window_size // 2, window_size // 2), (window_size // 2, window_size // 2)),
-        mode="constant",
-    )
-
-    # Sliding window for RGB
-    windows_r = np.lib.stride_tricks.as_strided(
-        padded_diff_r, shape=shape, strides=strides
-    )
-    windows_g = np.lib.stride_tricks.as_strided(
-        padded_diff_g, shape=shape, strides=strides
-    )
-    windows_b = np.lib.stride_tricks.as_strided(
-        padded_diff_b, shape=shape, strides=strides
-    )
 
-    descriptors_rgb_diff = np.concatenate(
-        [
-            windows_r.reshape(-1, window_size * window_size),
-            windows_g.reshape(-1, window_size * window_size),
-            windows_b.reshape(-1, window_size * window_size),
-        ],
-        axis=1,
-    )
-
-    # PCA on descriptors
-    shape = input_image.shape[::-1][1:]  # shape = (height, width)
+    # PCA on the sliding window descriptors
+    shape = input_image.shape[:2]  # shape = (height, width)
     descriptors_gray_diff = descriptors_to_pca(
-        descriptors_gray_diff, pca_dim_gray, window_size, shape
+        padded_diff[:, :, :1],
+        pca_dim_gray,
+        window_size,
+        shape,
+        projection=projection,
+        pca_cache=pca_cache,
     )
     descriptors_rgb_diff = descriptors_to_pca(
-        descriptors_rgb_diff, pca_dim_rgb, window_size, shape
+        padded_diff[:, :, 1:],
+        pca_dim_rgb,
+        window_size,
+        shape,
+        projection=projection,
+        pca_cache=pca_cache,
     )
 
     # Concatenate grayscale and RGB PCA results
@@ -355,23 +1137,193 @@ def get_descriptors(
     return descriptors
 
 
-def k_means_clustering(FVS, components, image_shape):
+CLUSTERING_ENGINES = ("kmeans", "minibatch", "subsample")
+
+
+def assign_to_centroids(FVS, centroids):
+    """
+    Assign every feature vector to its nearest centroid.
+    Args:
+        FVS (numpy.ndarray): The (N, D) feature vectors.
+        centroids (numpy.ndarray): The (K, D) cluster centres.
+    Returns:
+        numpy.ndarray: The (N,) index of the nearest centroid of every feature vector.
+    """
+    centroids = centroids.astype(FVS.dtype, copy=False)
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, and |x|^2 does not change the argmin
+    distances = np.dot(FVS, centroids.transpose())
+    distances *= -2
+    distances += np.einsum("ij,ij->i", centroids, centroids)
+    return np.argmin(distances, axis=1)
+
+
+def k_means_clustering(
+    FVS,
+    components,
+    image_shape,
+    engine="kmeans",
+    sample_size=20000,
+    init=None,
+    max_iter=300,
+    return_centroids=False,
+):
     """
     Perform K-means clustering on the given feature vectors.
     Args:
         FVS (array-like): The feature vectors to be clustered.
         components (int): The number of clusters (components) to create.
         image_shape (tuple): The size of the images used to reshape the change map.
+        engine (str, optional): The clustering engine. "kmeans" fits `KMeans` on every feature vector, "minibatch"
+            fits `MiniBatchKMeans` and "subsample" fits `KMeans` on an evenly strided subsample of about
+            `sample_size` vectors; both of the latter then assign every vector to its nearest centroid.
+            Defaults to "kmeans".
+        sample_size (int, optional): The number of feature vectors the "subsample" engine fits on. Defaults to 20000.
+        init (numpy.ndarray, optional): (components, D) initial centroids, e.g. those of the previous frame. The fit
+            then starts from them with a single initialisation instead of k-means++. Defaults to None.
+        max_iter (int, optional): The maximum number of Lloyd iterations of the "kmeans" and "subsample" engines.
+            Defaults to 300.
+        return_centroids (bool, optional): Whether to also return the fitted centroids. Defaults to False.
     Returns:
-        array-like: The change map obtained from the K-means clustering.
+        array-like: The change map obtained from the K-means clustering, followed by the (components, D) centroids
+            if `return_centroids` is True.
+    Raises:
+        ValueError: If the engine is unknown.
     """
-    kmeans = KMeans(components, verbose=0)
-    kmeans.fit(FVS)
-    flatten_change_map = kmeans.predict(FVS)
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+
+    warm_start = init is not None
+    if not warm_start:
+        init = "k-means++"
+    if engine == "kmeans":
+        kmeans = KMeans(
+            components,
+            init=init,
+            n_init=1 if warm_start else "auto",
+            max_iter=max_iter,
+            verbose=0,
+        )
+        kmeans.fit(FVS)
+        flatten_change_map = kmeans.predict(FVS)
+    elif engine == "minibatch":
+        # Changes form small clusters, which the default reassignment would move into the background
+        kmeans = MiniBatchKMeans(
+            components,
+            init=init,
+            n_init=1 if warm_start else 3,
+            batch_size=4096,
+            reassignment_ratio=0,
+            verbose=0,
+        )
+        kmeans.fit(FVS)
+        flatten_change_map = assign_to_centroids(FVS, kmeans.cluster_centers_)
+    elif engine == "subsample":
+        step = max(1, len(FVS) // sample_size)
+        kmeans = KMeans(
+            components,
+            init=init,
+            n_init=1 if warm_start else "auto",
+            max_iter=max_iter,
+            verbose=0,
+        )
+        kmeans.fit(FVS[::step])
+        flatten_change_map = assign_to_centroids(FVS, kmeans.cluster_centers_)
+    else:
+        raise ValueError(
+            f"Unknown clustering engine '{engine}', expected one of {CLUSTERING_ENGINES}"
+        )
     change_map = np.reshape(flatten_change_map, (image_shape[0], image_shape[1]))
+    if return_centroids:
+        return change_map, kmeans.cluster_centers_
     return change_map
 
 
+class ClusteringSession:
+    """
+    Carries the clustering state of ChangeChip from one live frame to the next. Frames compared against the same
+    reference share a `PCAModelCache`, and as long as the PCA basis has not been refitted the descriptors of
+    consecutive frames live in the same space, so k-means is seeded with the centroids of the previous frame and only
+    runs a few Lloyd iterations. A refitted basis, a different number of clusters or `reset` start from k-means++
+    again. Call `reset` whenever the reference changes.
+    Attributes:
+        pca_cache (PCAModelCache): The PCA bases shared by the frames of the session.
+        centroids (numpy.ndarray): The centroids of the last frame, or None.
+    """
+
+    def __init__(self, max_iter=10, drift_tolerance=0.02):
+        self.max_iter = max_iter
+        self.pca_cache = PCAModelCache(drift_tolerance)
+        self.reset()
+
+    def reset(self):
+        self.pca_cache.reset()
+        self.centroids = None
+        self.centroids_key = None
+
+    def cluster(self, FVS, components, image_shape, engine="kmeans"):
+        """
+        Cluster the feature vectors of a frame, warm-started from the previous frame when compatible.
+        Args:
+            FVS (numpy.ndarray): The feature vectors, projected with the bases of `pca_cache`.
+            components (int): The number of clusters.
+            image_shape (tuple): The size of the images used to reshape the change map.
+            engine (str, optional): The clustering engine, see `k_means_clustering`. Defaults to "kmeans".
+        Returns:
+            numpy.ndarray: The change map.
+        """
+        key = (self.pca_cache.version, components, FVS.shape[1])
+        if self.centroids is not None and key == self.centroids_key:
+            change_map, self.centroids = k_means_clustering(
+                FVS,
+                components,
+                image_shape,
+                engine=engine,
+                init=self.centroids,
+                max_iter=self.max_iter,
+                return_centroids=True,
+            )
+        else:
+            change_map, self.centroids = k_means_clustering(
+                FVS, components, image_shape, engine=engine, return_centroids=True
+            )
+        self.centroids_key = key
+        return change_map
+
+
+def cluster_error_sums(change_map, input_image, reference_image, n):
+    """
+    Sum the squared differences between two images over the pixels of every cluster in a change map.
+    Args:
+        change_map (numpy.ndarray): Array representing the cluster labels for each pixel in the change map.
+        input_image (numpy.ndarray): Array representing the input image.
+        reference_image (numpy.ndarray): Array representing the reference image.
+        n (int): Number of clusters.
+    Returns:
+        tuple: The (n,) channel-averaged squared error sums and the (n,) pixel counts of the clusters.
+    """
+    labels = change_map.ravel()
+
+    # Squared differences summed over the channels, 3 * 255^2 fits comfortably in int32
+    difference = cv2.absdiff(input_image, reference_image).reshape(len(labels), -1)
+    channels = difference.shape[1]
+    squared_diff = np.square(difference, dtype=np.int32).sum(axis=1, dtype=np.int32)
+
+    # Sum and size of every cluster in one pass each
+    mse = np.bincount(labels, weights=squared_diff, minlength=n)[:n] / channels
+    size = np.bincount(labels, minlength=n)[:n]
+    return mse, size
+
+
+def normalize_cluster_errors(mse, size):
+    """
+    Normalize per-cluster squared error sums by the number of pixels and the maximum possible MSE (255^2).
+    Returns:
+        list: Normalized MSE values for each cluster.
+    """
+    with np.errstate(invalid="ignore"):
+        normalized_mse = (mse / size) / (255**2)
+    return normalized_mse.tolist()
+
+
 def clustering_to_mse_values(change_map, input_image, reference_image, n):
     """
     Compute the normalized mean squared error (MSE) values for each cluster in a change map.
@@ -383,29 +1335,81 @@ def clustering_to_mse_values(change_map, input_image, reference_image, n):
     Returns:
         list: Normalized MSE values for each cluster.
     """
+    mse, size = cluster_error_sums(change_map, input_image, reference_image, n)
+    return normalize_cluster_errors(mse, size)
+
+
+# Breakpoints (x, value) of the red, green and blue channels of matplotlib's "jet" colormap
+JET_SEGMENTS = (
+    ((0.0, 0.0), (0.35, 0.0), (0.66, 1.0), (0.89, 1.0), (1.0, 0.5)),
+    ((0.0, 0.0), (0.125, 0.0), (0.375, 1.0), (0.64, 1.0), (0.91, 0.0), (1.0, 0.0)),
+    ((0.0, 0.5), (0.11, 1.0), (0.34, 1.0), (0.65, 0.0), (1.0, 0.0)),
+)
+JET_TABLE = np.stack(
+    [
+        np.interp(np.linspace(0, 1, 256), *np.transpose(segments))
+        for segments in JET_SEGMENTS
+    ],
+    axis=-1,
+)
+
+
+def jet_colors(values):
+    """
+    Map values in [0, 1] to the RGB colours of matplotlib's 256-level "jet" colormap, the same as
+    `plt.cm.jet(values)[..., :3]` without importing matplotlib on the live path.
+    """
+    levels = np.clip((np.asarray(values) * 256).astype(int), 0, 255)
+    return JET_TABLE[levels]
 
-    # Ensure the images are in integer format for calculations
-    input_image = input_image.astype(int)
-    reference_image = reference_image.astype(int)
 
-    # Compute the squared differences
-    squared_diff = np.mean((input_image - reference_image) ** 2, axis=-1)
+def colorize_change_map(change_map, clusters, palette="jet"):
+    """
+    Colour every cluster of a change map for visualisation, imports matplotlib or seaborn.
+    Args:
+        change_map (numpy.ndarray): The (H, W) cluster labels.
+        clusters (int): The number of clusters.
+        palette (str, optional): "jet" for a jet colormap over the clusters or "paired" for the seaborn "Paired"
+            palette. Defaults to "jet".
+    Returns:
+        numpy.ndarray: The (H, W, 3) uint8 colour image.
+    """
+    if palette == "jet":
+        import matplotlib.colors as mcolors
+        import matplotlib.pyplot as plt
 
-    # Initialize arrays to store MSE and size for each cluster
-    mse = np.zeros(n, dtype=float)
-    size = np.zeros(n, dtype=int)
+        colormap = mcolors.LinearSegmentedColormap.from_list(
+            "custom_jet", plt.cm.jet(np.linspace(0, 1, clusters))
+        )
+        colors_array = colormap(np.linspace(0, 1, clusters))[:, :3]
+    else:
+        import seaborn as sns
 
-    # Compute the MSE and size for each cluster
-    for k in range(n):
-        mask = change_map == k
-        size[k] = np.sum(mask)
-        if size[k] > 0:
-            mse[k] = np.sum(squared_diff[mask])
+        colors_array = np.array(sns.color_palette("Paired", clusters))
+    colors_array = colors_array * 255  # Convert to RGB values
+    return colors_array[change_map].astype(np.uint8)
 
-    # Normalize MSE values by the number of pixels and the maximum possible MSE (255^2)
-    normalized_mse = (mse / size) / (255**2)
 
-    return normalized_mse.tolist()
+def plot_mse_classes(MSE_array, accepted_classes):
+    """
+    Plot the MSE of every class, the accepted classes highlighted, imports matplotlib.
+    Returns:
+        matplotlib.figure.Figure: The figure.
+    """
+    from matplotlib.figure import Figure
+
+    figure = Figure()
+    axes = figure.add_subplot()
+    axes.set_xlabel("Index")
+    axes.set_ylabel("MSE")
+    axes.scatter(range(len(MSE_array)), MSE_array, c="red")
+    axes.scatter(
+        accepted_classes[:],
+        np.array(MSE_array)[np.array(accepted_classes)],
+        c="blue",
+    )
+    axes.set_title("K Mean Classification")
+    return figure
 
 
 def compute_change_map(
@@ -416,6 +1420,11 @@ def compute_change_map(
     pca_dim_rgb,
     debug=False,
     output_directory=None,
+    projection="tiled",
+    pca_cache=None,
+    clustering_engine="kmeans",
+    clustering_session=None,
+    artifacts=None,
 ):
     """
     Compute the change map and mean squared error (MSE) array for a pair of input and reference images.
@@ -427,12 +1436,23 @@ def compute_change_map(
         pca_dim_rgb (int): The number of dimensions to reduce to for RGB images.
         debug (bool, optional): Whether to enable debug mode. Defaults to False.
         output_directory (str, optional): The directory to save the output files. Required if debug mode is enabled.
+        projection (str, optional): The PCA projection method, "tiled" or "convolution". Defaults to "tiled".
+        pca_cache (PCAModelCache, optional): Cache of the PCA bases of previous frames against the same reference.
+            Defaults to None.
+        clustering_engine (str, optional): The clustering engine, "kmeans", "minibatch" or "subsample", see
+            `k_means_clustering`. Defaults to "kmeans".
+        clustering_session (ClusteringSession, optional): Warm-start k-means from the previous live frame. Its PCA
+            cache is used when `pca_cache` is not given. Defaults to None.
+        artifacts (ArtifactSink, optional): Receives the debug artefacts in place of `debug` and `output_directory`,
+            see `artifacts.resolve_sink`. Defaults to None.
     Returns:
         tuple: A tuple containing the change map and MSE array.
     Raises:
         AssertionError: If debug mode is enabled but output_directory is not provided.
     """
     input_image, reference_image = images
+    if clustering_session is not None and pca_cache is None:
+        pca_cache = clustering_session.pca_cache
     descriptors = get_descriptors(
         images,
         window_size,
@@ -440,61 +1460,34 @@ def compute_change_map(
         pca_dim_rgb,
         debug=debug,
         output_directory=output_directory,
+        projection=projection,
+        pca_cache=pca_cache,
+        artifacts=artifacts,
     )
     # Now we are ready for clustering!
-    change_map = k_means_clustering(descriptors, clusters, input_image.shape)
-    mse_array = clustering_to_mse_values(
-        change_map, input_image, reference_image, clusters
-    )
-
-    colormap = mcolors.LinearSegmentedColormap.from_list(
-        "custom_jet", plt.cm.jet(np.linspace(0, 1, clusters))
-    )
-    colors_array = (
-        colormap(np.linspace(0, 1, clusters))[:, :3] * 255
-    )  # Convert to RGB values
-
-    palette = sns.color_palette("Paired", clusters)
-    palette = np.array(palette) * 255  # Convert to RGB values
-
-    # Optimized loop
-    change_map_flat = change_map.ravel()
-    colored_change_map_flat = (
-        colors_array[change_map_flat]
-        .reshape(change_map.shape[0], change_map.shape[1], 3)
-        .astype(np.uint8)
-    )
-    palette_colored_change_map_flat = (
-        palette[change_map_flat]
-        .reshape(change_map.shape[0], change_map.shape[1], 3)
-        .astype(np.uint8)
-    )
-
-    if debug:
-        assert output_directory is not None, "Output directory must be provided"
-        cv2.imwrite(
-            os.path.join(
-                output_directory,
-                f"window_size_{window_size}_pca_dim_gray{pca_dim_gray}_pca_dim_rgb{pca_dim_rgb}_clusters_{clusters}.jpg",
-            ),
-            colored_change_map_flat,
-        )
-        cv2.imwrite(
-            os.path.join(
-                output_directory,
-                f"PALETTE_window_size_{window_size}_pca_dim_gray{pca_dim_gray}_pca_dim_rgb{pca_dim_rgb}_clusters_{clusters}.jpg",
-            ),
-            palette_colored_change_map_flat,
+    with stage("kmeans"):
+        if clustering_session is not None:
+            change_map = clustering_session.cluster(
+                descriptors, clusters, input_image.shape, engine=clustering_engine
+            )
+        else:
+            change_map = k_means_clustering(
+                descriptors, clusters, input_image.shape, engine=clustering_engine
+            )
+    with stage("mse"):
+        mse_array = clustering_to_mse_values(
+            change_map, input_image, reference_image, clusters
         )
 
-    if debug:
-        assert output_directory is not None, "Output directory must be provided"
-        # Saving Output for later evaluation
-        np.savetxt(
-            os.path.join(output_directory, "clustering_data.csv"),
-            change_map,
-            delimiter=",",
-        )
+    artifacts = resolve_sink(artifacts, debug, output_directory)
+    name = f"window_size_{window_size}_pca_dim_gray{pca_dim_gray}_pca_dim_rgb{pca_dim_rgb}_clusters_{clusters}.jpg"
+    artifacts.emit(name, lambda: colorize_change_map(change_map, clusters, "jet"))
+    artifacts.emit(
+        "PALETTE_" + name,
+        lambda: colorize_change_map(change_map, clusters, "paired"),
+    )
+    # Saving Output for later evaluation
+    artifacts.emit("clustering_data.csv", lambda: change_map)
     return change_map, mse_array
 
 
@@ -502,7 +1495,7 @@ def compute_change_map(
 # this selection is done by an MSE heuristic using DBSCAN clustering, to seperate the highest mse-valued classes from the others.
 # the eps density parameter of DBSCAN might differ from system to system
 def find_group_of_accepted_classes_DBSCAN(
-    MSE_array, debug=False, output_directory=None
+    MSE_array, debug=False, output_directory=None, artifacts=None
 ):
     """
     Finds the group of accepted classes using the DBSCAN algorithm.
@@ -510,11 +1503,16 @@ def find_group_of_accepted_classes_DBSCAN(
     - MSE_array (list): A list of mean squared error values.
     - debug (bool): Flag indicating whether to enable debug mode or not. Default is False.
     - output_directory (str): The directory where the output files will be saved. Default is None.
+    - artifacts (ArtifactSink): Receives the MSE plot and accepted classes, in place of `debug` and `output_directory`. Default is None.
     Returns:
     - accepted_classes (list): A list of indices of the accepted classes.
     """
+    from sklearn.cluster import DBSCAN
 
-    clustering = DBSCAN(eps=0.02, min_samples=1).fit(np.array(MSE_array).reshape(-1, 1))
+    with stage("dbscan"):
+        clustering = DBSCAN(eps=0.02, min_samples=1).fit(
+            np.array(MSE_array).reshape(-1, 1)
+        )
     number_of_clusters = len(set(clustering.labels_))
     if number_of_clusters == 1:
         print("No significant changes are detected.")
@@ -533,27 +1531,10 @@ def find_group_of_accepted_classes_DBSCAN(
     min_class = np.argmin(centers)
     accepted_classes = np.where(clustering.labels_ != min_class)[0]
 
-    if debug:
-        assert output_directory is not None, "Output directory must be provided"
-        plt.figure()
-        plt.xlabel("Index")
-        plt.ylabel("MSE")
-        plt.scatter(range(len(MSE_array)), MSE_array, c="red")
-        plt.scatter(
-            accepted_classes[:],
-            np.array(MSE_array)[np.array(accepted_classes)],
-            c="blue",
-        )
-        plt.title("K Mean Classification")
-
-        plt.savefig(os.path.join(output_directory, "mse.png"))
-
-        # save output for later evaluation
-        np.savetxt(
-            os.path.join(output_directory, "accepted_classes.csv"),
-            accepted_classes,
-            delimiter=",",
-        )
+    artifacts = resolve_sink(artifacts, debug, output_directory)
+    artifacts.emit("mse.png", lambda: plot_mse_classes(MSE_array, accepted_classes))
+    # save output for later evaluation
+    artifacts.emit("accepted_classes.csv", lambda: accepted_classes)
     return [accepted_classes]
 
 
@@ -562,6 +1543,7 @@ def draw_combination_on_transparent_input_image(
 ):
     """
     Draws a combination of classes on a transparent input image based on their mean squared error (MSE) order.
+    Takes the pixel coordinates of every class, see `render_change_overlay` to paint from a change map.
     Args:
         classes_mse (numpy.ndarray): Array of mean squared errors for each class.
         clustering (dict): Dictionary containing the clustering information for each class.
@@ -571,21 +1553,81 @@ def draw_combination_on_transparent_input_image(
         numpy.ndarray: Transparent input image with the specified combination of classes drawn on it.
     """
 
-    # HEAT MAP ACCORDING TO MSE ORDER
-    sorted_indexes = np.argsort(classes_mse)
+    # HEAT MAP ACCORDING TO MSE ORDER, painted class by class from the colour table of `change_overlay_lut`
+    lut, _ = change_overlay_lut(classes_mse, combination)
     for class_ in combination:
-        index = np.argwhere(sorted_indexes == class_).flatten()[0]
-        c = plt.cm.jet(float(index) / (len(classes_mse) - 1))
-        for [i, j] in clustering[class_]:
-            transparent_input_image[i, j] = (
-                c[2] * 255,
-                c[1] * 255,
-                c[0] * 255,
-                255,
-            )  # BGR
+        coordinates = np.asarray(clustering[class_], dtype=np.intp).reshape(-1, 2)
+        transparent_input_image[coordinates[:, 0], coordinates[:, 1]] = lut[class_]
     return transparent_input_image
 
 
+def change_overlay_lut(classes_mse, combination):
+    """
+    Build the BGRA colour of every class for `render_change_overlay`: the classes in `combination` get their heat map
+    colour according to MSE order, as in `draw_combination_on_transparent_input_image`.
+    Args:
+        classes_mse (numpy.ndarray): Array of mean squared errors for each class.
+        combination (list): List of classes to be drawn on the image.
+    Returns:
+        tuple: The (n, 4) uint8 BGRA colour table and the (n,) boolean mask of the classes in `combination`.
+    """
+    n = len(classes_mse)
+    combination = np.asarray(combination, dtype=int)
+    # Position of every class in MSE order
+    ranks = np.empty(n, dtype=int)
+    ranks[np.argsort(classes_mse)] = np.arange(n)
+    colors = jet_colors(ranks[combination] / (n - 1))
+
+    lut = np.zeros((n, 4), dtype=np.uint8)
+    lut[combination, :3] = colors[:, 2::-1] * 255  # BGR
+    lut[combination, 3] = 255
+    accepted = np.zeros(n, dtype=bool)
+    accepted[combination] = True
+    return lut, accepted
+
+
+def render_change_overlay(input_image, change_map, classes_mse, combination, alpha):
+    """
+    Paint a combination of classes on a transparent copy of the input image with one lookup on the change map.
+    Produces the same image as `draw_combination_on_transparent_input_image` without per-pixel coordinate lists.
+    Args:
+        input_image (numpy.ndarray): The BGR input image.
+        change_map (numpy.ndarray): The (H, W) class label of every pixel.
+        classes_mse (numpy.ndarray): Array of mean squared errors for each class.
+        combination (list): List of classes to be drawn on the image.
+        alpha (int): The alpha value of the pixels that are not drawn.
+    Returns:
+        numpy.ndarray: The BGRA image with the specified combination of classes drawn on it.
+    """
+    lut, accepted = change_overlay_lut(classes_mse, combination)
+    output = cv2.cvtColor(input_image, cv2.COLOR_BGR2BGRA)
+    output[:, :, 3] = alpha
+    np.copyto(output, lut[change_map], where=accepted[change_map][:, :, None])
+    return output
+
+
+def change_details(change_map, classes_mse, combination):
+    """
+    Summarise a detection for reporting, e.g. as the scores of a board in a batch inspection.
+    Args:
+        change_map (numpy.ndarray): The (H, W) class label of every pixel.
+        classes_mse (list): The normalised mean squared error of every class.
+        combination (list): The accepted classes, drawn as changes.
+    Returns:
+        dict: "changed_fraction", the fraction of pixels in accepted classes, "max_mse", the largest MSE of an
+            accepted class (0 if there is none), "accepted_classes" and "mse".
+    """
+    accepted = np.zeros(len(classes_mse), dtype=bool)
+    accepted[np.asarray(combination, dtype=int)] = True
+    changed = np.count_nonzero(accepted[change_map])
+    return {
+        "changed_fraction": changed / change_map.size,
+        "max_mse": float(np.max(np.asarray(classes_mse)[accepted], initial=0.0)),
+        "accepted_classes": np.flatnonzero(accepted).tolist(),
+        "mse": list(classes_mse),
+    }
+
+
 def detect_changes(
     images,
     output_alpha,
@@ -595,6 +1637,12 @@ def detect_changes(
     pca_dim_rgb,
     debug=False,
     output_directory=None,
+    projection="tiled",
+    pca_cache=None,
+    clustering_engine="kmeans",
+    clustering_session=None,
+    artifacts=None,
+    return_details=False,
 ):
     """
     Detects changes between two images using a combination of clustering and image processing techniques.
@@ -607,8 +1655,19 @@ def detect_changes(
         pca_dim_rgb (int): The number of dimensions to reduce the RGB image to using PCA.
         debug (bool, optional): Whether to enable debug mode. Defaults to False.
         output_directory (str, optional): The output directory for saving intermediate results. Defaults to None.
+        projection (str, optional): The PCA projection method, "tiled" or "convolution". Defaults to "tiled".
+        pca_cache (PCAModelCache, optional): Cache of the PCA bases of previous frames against the same reference.
+            Defaults to None.
+        clustering_engine (str, optional): The clustering engine, "kmeans", "minibatch" or "subsample", see
+            `k_means_clustering`. Defaults to "kmeans".
+        clustering_session (ClusteringSession, optional): Warm-start k-means from the previous live frame. Its PCA
+            cache is used when `pca_cache` is not given. Defaults to None.
+        artifacts (ArtifactSink, optional): Receives the debug artefacts in place of `debug` and `output_directory`,
+            see `artifacts.resolve_sink`. Defaults to None.
+        return_details (bool, optional): Also return the scores of the detection, see `change_details`.
+            Defaults to False.
     Returns:
-        numpy.ndarray: The resulting image with detected changes.
+        numpy.ndarray: The resulting image with detected changes, and the scores dict if `return_details` is True.
     """
     start_time = time.time()
     input_image, _ = images
@@ -620,31 +1679,29 @@ def detect_changes(
         pca_dim_rgb=pca_dim_rgb,
         debug=debug,
         output_directory=output_directory,
+        projection=projection,
+        pca_cache=pca_cache,
+        clustering_engine=clustering_engine,
+        clustering_session=clustering_session,
+        artifacts=artifacts,
     )
 
-    clustering = [np.empty((0, 2), dtype=int) for _ in range(clusters)]
-
-    # Get the indices of each element in the clustering_map
-    indices = np.indices(clustering_map.shape).transpose(1, 2, 0).reshape(-1, 2)
-    flattened_map = clustering_map.flatten()
-
-    for cluster_idx in range(clusters):
-        clustering[cluster_idx] = indices[flattened_map == cluster_idx]
-
-    b_channel, g_channel, r_channel = cv2.split(input_image)
-    alpha_channel = np.ones(b_channel.shape, dtype=b_channel.dtype) * 255
-    alpha_channel[:, :] = output_alpha
-    groups = find_group_of_accepted_classes_DBSCAN(mse_array, output_directory)
+    groups = find_group_of_accepted_classes_DBSCAN(
+        mse_array,
+        debug=debug,
+        output_directory=output_directory,
+        artifacts=artifacts,
+    )
 
-    for group in groups:
-        transparent_input_image = cv2.merge(
-            (b_channel, g_channel, r_channel, alpha_channel)
-        )
-        result = draw_combination_on_transparent_input_image(
-            mse_array, clustering, group, transparent_input_image
-        )
+    with stage("render"):
+        for group in groups:
+            result = render_change_overlay(
+                input_image, clustering_map, mse_array, group, output_alpha
+            )
 
     print("--- Detect Changes time - %s seconds ---" % (time.time() - start_time))
+    if return_details:
+        return result, change_details(clustering_map, mse_array, group)
     return result
 
 
@@ -658,11 +1715,23 @@ def pipeline(
     pca_dim_rgb=9,
     debug=False,
     output_directory=None,
+    reference_features=None,
+    matcher="bruteforce",
+    alignment="features",
+    pyramid_factor=0.25,
+    projection="tiled",
+    pca_cache=None,
+    clustering_engine="kmeans",
+    clustering_session=None,
+    artifacts=None,
+    return_details=False,
+    return_metrics=False,
+    profile=None,
 ):
     """
     Applies a pipeline of image processing steps to detect changes in a sequence of images.
     Args:
-        images (tuple): A list of input images.
+        images (tuple): The input image and the reference image or its `ReferenceModel`, see `preprocess_images`.
         resize_factor (float, optional): The factor by which to resize the images. Defaults to 1.0.
         output_alpha (int, optional): The alpha value for the output images. Defaults to 50.
         window_size (int, optional): The size of the sliding window for change detection. Defaults to 5.
@@ -671,27 +1740,65 @@ def pipeline(
         pca_dim_rgb (int, optional): The number of dimensions to keep for RGB PCA. Defaults to 9.
         debug (bool, optional): Whether to enable debug mode. Defaults to False.
         output_directory (str, optional): The directory to save the output images. Defaults to None.
+        reference_features (ReferenceFeatures, optional): Precomputed features of the resized reference image,
+            see `get_reference_features`. Defaults to None.
+        matcher (str, optional): The descriptor matcher backend used for alignment, "bruteforce" or "flann".
+            Defaults to "bruteforce".
+        alignment (str, optional): "features" or "pyramid" (coarse-to-fine) alignment, see `preprocess_images`.
+            Defaults to "features".
+        pyramid_factor (float, optional): The extra downsampling of the coarse pyramid level. Defaults to 0.25.
+        projection (str, optional): The PCA projection method, "tiled" or "convolution". Defaults to "tiled".
+        pca_cache (PCAModelCache, optional): Cache of the PCA bases of previous frames against the same reference.
+            Defaults to None.
+        clustering_engine (str, optional): The clustering engine, "kmeans", "minibatch" or "subsample", see
+            `k_means_clustering`. Defaults to "kmeans".
+        clustering_session (ClusteringSession, optional): Warm-start k-means from the previous live frame. Its PCA
+            cache is used when `pca_cache` is not given. Defaults to None.
+        artifacts (ArtifactSink, optional): Receives the debug artefacts in place of `debug` and `output_directory`,
+            see `artifacts.resolve_sink`. Defaults to None.
+        return_details (bool, optional): Also return the scores of the detection, see `change_details`.
+            Defaults to False.
+        return_metrics (bool, optional): Also return the per-stage wall time, CPU time and peak allocation as an
+            `instrumentation.PipelineMetrics`. Defaults to False.
+        profile (str, optional): Capture a "cprofile" profile or the "tracemalloc" allocations into the returned
+            metrics, see `instrumentation.record_metrics`. Defaults to None.
     Returns:
-        numpy.ndarray: The resulting image with detected changes.
+        numpy.ndarray: The resulting image with detected changes, followed by the scores dict if `return_details`
+            is True and the metrics if `return_metrics` is True.
     """
     if output_directory:
         os.makedirs(output_directory, exist_ok=True)
 
-    preprocessed_images = preprocess_images(
-        images,
-        resize_factor=resize_factor,
-        debug=debug,
-        output_directory=output_directory,
-    )
-    result = detect_changes(
-        preprocessed_images,
-        output_alpha=output_alpha,
-        window_size=window_size,
-        clusters=clusters,
-        pca_dim_gray=pca_dim_gray,
-        pca_dim_rgb=pca_dim_rgb,
-        debug=debug,
-        output_directory=output_directory,
-    )
+    recording = record_metrics(profile) if return_metrics else contextlib.nullcontext()
+    with recording as metrics:
+        preprocessed_images = preprocess_images(
+            images,
+            resize_factor=resize_factor,
+            debug=debug,
+            output_directory=output_directory,
+            reference_features=reference_features,
+            matcher=matcher,
+            alignment=alignment,
+            pyramid_factor=pyramid_factor,
+            artifacts=artifacts,
+        )
+        result = detect_changes(
+            preprocessed_images,
+            output_alpha=output_alpha,
+            window_size=window_size,
+            clusters=clusters,
+            pca_dim_gray=pca_dim_gray,
+            pca_dim_rgb=pca_dim_rgb,
+            debug=debug,
+            output_directory=output_directory,
+            projection=projection,
+            pca_cache=pca_cache,
+            clustering_engine=clustering_engine,
+            clustering_session=clustering_session,
+            artifacts=artifacts,
+            return_details=return_details,
+        )
 
-    return result
\ No newline at end of file
+    if return_metrics:
+        return (*result, metrics) if return_details else (result, metrics)
+    return result
@@ -0,0 +1,312 @@
+import multiprocessing
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# Header of the shared block: the latest committed slot and the number of committed frames, then the sequence
+# number and capture time of every slot and the slot leased by every reader
+HEADER_FIELDS = 2
+ALIGNMENT = 64
+
+
+_tracker_lock = threading.Lock()
+
+
+def attach_shared_memory(name):
+    """
+    Open an existing shared memory block without registering it with the resource tracker of this process, which
+    would unlink it when this process exits or warn that it leaked. Python before 3.13 registers every opened block
+    and has no `track=False`. Unregistering after opening is no fix: processes spawned by the creator share its
+    tracker, which would then forget the block of the creator.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    with _tracker_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class FrameRef:
+    """
+    A picklable reference to a frame in a `FrameRingBuffer`, sent to worker processes in place of the pixels.
+    Attributes:
+        spec (tuple): The `FrameRingBuffer.spec` of the buffer.
+        slot (int): The slot holding the frame.
+        sequence (int): The sequence number of the frame, a monotonically increasing frame id.
+        captured_at (float): The `time.perf_counter` capture time of the frame.
+    """
+
+    def __init__(self, spec, slot, sequence, captured_at):
+        self.spec = spec
+        self.slot = slot
+        self.sequence = sequence
+        self.captured_at = captured_at
+
+    def age(self, now=None):
+        """
+        Seconds since the frame was captured.
+        """
+        return (time.perf_counter() if now is None else now) - self.captured_at
+
+
+class FrameRingBuffer:
+    """
+    A ring of preallocated frame slots in shared memory, written by one capture thread and read without copies by
+    the processing threads and worker processes. Frames get increasing sequence numbers starting at 1. A reader
+    leases the slot it uses, and the writer never reuses a leased slot, so a leased frame stays intact until it is
+    released. Closing the buffer while this process leases a frame defers freeing the memory to the last release.
+    The slot and lease bookkeeping is guarded by a lock, the pixels are not.
+    Attributes:
+        shape (tuple): The shape of a frame.
+        dtype (numpy.dtype): The dtype of a frame.
+        slots (int): The number of frame slots, at least the number of readers plus two.
+        readers (int): The number of readers that can hold a lease at the same time.
+        name (str): The name of the shared memory block.
+        frames (numpy.ndarray): The (slots, *shape) frames, a view of the shared memory.
+    """
+
+    def __init__(self, shape, dtype=np.uint8, slots=4, readers=2, name=None, lock=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self.readers = readers
+        if slots < readers + 2:
+            raise ValueError(
+                f"A ring buffer for {readers} readers needs at least {readers + 2} slots, got {slots}"
+            )
+        header_bytes = 8 * (HEADER_FIELDS + 2 * slots + readers)
+        self._frames_offset = -(-header_bytes // ALIGNMENT) * ALIGNMENT
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        size = self._frames_offset + slots * frame_bytes
+        self.owner = name is None
+        if self.owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._shm = attach_shared_memory(name)
+        self.name = self._shm.name
+        self._lock = lock if lock is not None else multiprocessing.Lock()
+
+        buffer = self._shm.buf
+        self._control = np.ndarray((HEADER_FIELDS,), np.int64, buffer, 0)
+        self._sequences = np.ndarray((slots,), np.int64, buffer, 8 * HEADER_FIELDS)
+        self._timestamps = np.ndarray(
+            (slots,), np.float64, buffer, 8 * (HEADER_FIELDS + slots)
+        )
+        self._leases = np.ndarray(
+            (readers,), np.int64, buffer, 8 * (HEADER_FIELDS + 2 * slots)
+        )
+        self.frames = np.ndarray(
+            (slots, *self.shape), self.dtype, buffer, self._frames_offset
+        )
+        if self.owner:
+            self._control[:] = (-1, 0)
+            self._sequences[:] = 0
+            self._timestamps[:] = 0
+            self._leases[:] = -1
+        self._writing = None
+        # The readers leasing a frame through this object, and whether `close` was called
+        self._held = set()
+        self._closing = False
+
+    @property
+    def spec(self):
+        """
+        The arguments `attach` needs to open the buffer in another process.
+        """
+        return (self.name, self.shape, self.dtype.str, self.slots, self.readers)
+
+    @classmethod
+    def attach(cls, spec, lock=None):
+        """
+        Open a buffer created by another process from its `spec`. Without the lock of the creator, the attached
+        buffer can only `read` frames leased on its behalf.
+        """
+        name, shape, dtype, slots, readers = spec
+        return cls(shape, dtype, slots, readers, name=name, lock=lock)
+
+    @property
+    def closed(self):
+        """
+        Whether `close` was called. No frame can be leased once it is, the memory stays mapped until the last lease
+        is released.
+        """
+        return self._closing
+
+    @property
+    def written(self):
+        """
+        The number of committed frames, also the sequence number of the latest one.
+        """
+        return int(self._control[1])
+
+    def begin_write(self):
+        """
+        Reserve the oldest slot no reader leases for the next frame.
+        Returns:
+            tuple: The slot index and the writable frame view, e.g. for `cap.read(image=view)`.
+        """
+        with self._lock:
+            leased = set(self._leases.tolist())
+            free = [slot for slot in range(self.slots) if slot not in leased]
+            slot = min(free, key=lambda slot: self._sequences[slot])
+            # Mark the slot as being written, readers skip it
+            self._sequences[slot] = -1
+        self._writing = slot
+        return slot, self.frames[slot]
+
+    def commit(self, timestamp=None):
+        """
+        Publish the frame written into the slot reserved by `begin_write`.
+        Args:
+            timestamp (float, optional): The `time.perf_counter` capture time. Defaults to now.
+        Returns:
+            int: The sequence number of the frame.
+        """
+        slot, self._writing = self._writing, None
+        with self._lock:
+            sequence = int(self._control[1]) + 1
+            self._timestamps[slot] = (
+                time.perf_counter() if timestamp is None else timestamp
+            )
+            self._sequences[slot] = sequence
+            self._control[:] = (slot, sequence)
+        return sequence
+
+    def abort(self):
+        """
+        Give up the slot reserved by `begin_write`, e.g. when the camera returned no frame.
+        """
+        slot, self._writing = self._writing, None
+        with self._lock:
+            # The previous frame of the slot may be partly overwritten
+            self._sequences[slot] = 0
+
+    def write(self, frame, timestamp=None):
+        """
+        Copy a frame into the buffer.
+        Returns:
+            int: The sequence number of the frame.
+        """
+        _, view = self.begin_write()
+        np.copyto(view, frame)
+        return self.commit(timestamp)
+
+    def latest(self):
+        """
+        Returns:
+            tuple: The (slot, sequence number) of the latest frame, (-1, 0) before the first one. Without a lease the
+                frame may be overwritten at any time, which is harmless for display only.
+        """
+        with self._lock:
+            slot = int(self._control[0])
+            return slot, int(self._sequences[slot]) if slot >= 0 else 0
+
+    def acquire(self, reader, sequence=None):
+        """
+        Lease a frame for `reader`, releasing the frame it leased before.
+        Args:
+            reader (int): The id of the reader, below `readers`.
+            sequence (int, optional): The sequence number of the frame. Defaults to the latest frame.
+        Returns:
+            tuple: The (slot, sequence number, capture time) of the leased frame, or None if the frame was already
+                overwritten, no frame was written yet or the buffer is closed.
+        """
+        with self._lock:
+            if self.closed:
+                return None
+            if sequence is None:
+                slot = int(self._control[0])
+            else:
+                matches = np.flatnonzero(self._sequences == sequence)
+                slot = int(matches[0]) if len(matches) else -1
+            if slot < 0 or self._sequences[slot] <= 0:
+                self._leases[reader] = -1
+                self._held.discard(reader)
+                return None
+            self._leases[reader] = slot
+            self._held.add(reader)
+            return slot, int(self._sequences[slot]), float(self._timestamps[slot])
+
+    def release(self, reader):
+        """
+        Release the frame leased by `reader`, and free the buffer if it was closed and this was the last lease.
+        """
+        with self._lock:
+            if self._leases is None:
+                return
+            self._leases[reader] = -1
+            self._held.discard(reader)
+            if self._closing and not self._held:
+                self._unmap()
+
+    def ref(self, slot):
+        """
+        A `FrameRef` to the frame in `slot`, for a worker process to `read`.
+        """
+        with self._lock:
+            return FrameRef(
+                self.spec,
+                slot,
+                int(self._sequences[slot]),
+                float(self._timestamps[slot]),
+            )
+
+    def read(self, ref):
+        """
+        The frame a `FrameRef` points to, without a copy. Only valid while the frame is leased.
+        Raises:
+            ValueError: If the slot no longer holds the frame.
+        """
+        if self._sequences[ref.slot] != ref.sequence:
+            raise ValueError(f"Frame {ref.sequence} was overwritten")
+        return self.frames[ref.slot]
+
+    def close(self):
+        """
+        Close this process's view of the buffer, and free the shared memory if it created it. While this process
+        leases a frame, the buffer is only freed when the last lease is released. Views of unleased frames, like
+        the `latest` frame shown by the display, must not be used after closing.
+        """
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            if not self._held:
+                self._unmap()
+
+    def _unmap(self):
+        # Closing unmaps the memory even under live views of it, which crash on their next access. Called with the
+        # lock held.
+        self.frames = self._control = self._sequences = None
+        self._timestamps = self._leases = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+
+# The buffer attached by a worker process, by name
+_attached_buffers = {}
+
+
+def resolve_frame(frame):
+    """
+    Return the pixels of a frame passed to a worker: either the array itself or, for a `FrameRef`, a view of the
+    shared buffer, attached on first use in this process.
+    """
+    if not isinstance(frame, FrameRef):
+        return frame
+    buffer = _attached_buffers.get(frame.spec[0])
+    if buffer is None:
+        # The capture replaced its buffer, e.g. for a new frame size, release the mapping of the old one
+        for stale in _attached_buffers.values():
+            stale.close()
+        _attached_buffers.clear()
+        buffer = _attached_buffers[frame.spec[0]] = FrameRingBuffer.attach(frame.spec)
+    return buffer.read(frame)
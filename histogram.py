@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+
+
+def channel_histograms(image):
+    """
+    Compute the 256-bin histogram of every channel of a uint8 image.
+    Args:
+        image (numpy.ndarray): A (H, W) or (H, W, C) uint8 image.
+    Returns:
+        numpy.ndarray: A (C, 256) array of pixel counts.
+    """
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    return np.stack(
+        [
+            cv2.calcHist([image], [channel], None, [256], [0, 256]).ravel()
+            for channel in range(channels)
+        ]
+    ).astype(np.float64)
+
+
+def histograms_to_cdfs(histograms):
+    """
+    Convert per-channel histograms to normalised cumulative distribution functions.
+    """
+    cdfs = np.cumsum(histograms, axis=1)
+    return cdfs / cdfs[:, -1:]
+
+
+def matching_luts(source_cdfs, template_cdfs):
+    """
+    Build the per-channel lookup tables that map the source distribution onto the template distribution.
+    This is the mapping used by `skimage.exposure.match_histograms`, evaluated once per grey level instead of once per pixel.
+    Args:
+        source_cdfs (numpy.ndarray): (C, 256) CDFs of the image to transform.
+        template_cdfs (numpy.ndarray): (C, 256) CDFs of the image to match.
+    Returns:
+        numpy.ndarray: A (256, 1, C) uint8 table for `cv2.LUT`.
+    """
+    levels = np.arange(256)
+    luts = np.empty((256, 1, len(source_cdfs)), dtype=np.uint8)
+    for channel, (source_cdf, template_cdf) in enumerate(
+        zip(source_cdfs, template_cdfs)
+    ):
+        # Only the grey levels present in the template are valid targets
+        present = np.diff(template_cdf, prepend=0) > 0
+        values = np.interp(source_cdf, template_cdf[present], levels[present])
+        luts[:, 0, channel] = values.astype(np.uint8)
+    return luts
+
+
+def apply_luts(image, luts):
+    """
+    Apply per-channel lookup tables built by `matching_luts` to a uint8 image.
+    """
+    if image.ndim == 2:
+        return cv2.LUT(image, luts[:, :, 0])
+    return cv2.LUT(image, luts)
+
+
+class HistogramMatcher:
+    """
+    Histogram matching against a fixed template image. The template CDFs are computed once, so matching a frame only
+    costs one histogram of the frame, a 256-entry lookup table per channel and a `cv2.LUT` pass, and returns uint8.
+    Attributes:
+        template_cdfs (numpy.ndarray): The (C, 256) CDFs of the template image.
+    """
+
+    def __init__(self, template_image=None, template_cdfs=None):
+        if template_cdfs is None:
+            template_cdfs = histograms_to_cdfs(channel_histograms(template_image))
+        self.template_cdfs = template_cdfs
+
+    def match(self, image):
+        """
+        Transform `image` so that its per-channel histograms match the template's.
+        Args:
+            image (numpy.ndarray): The uint8 image to transform.
+        Returns:
+            numpy.ndarray: The transformed uint8 image.
+        """
+        source_cdfs = histograms_to_cdfs(channel_histograms(image))
+        return apply_luts(image, matching_luts(source_cdfs, self.template_cdfs))
+
+
+def match_histograms_lut(image, template_image):
+    """
+    Match the per-channel histograms of `image` to those of `template_image`, both uint8.
+    Equivalent to `skimage.exposure.match_histograms(image, template_image, channel_axis=-1).astype(np.uint8)`.
+    """
+    return HistogramMatcher(template_image).match(image)
@@ -0,0 +1,190 @@
+import contextvars
+import cProfile
+import pstats
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+PROFILERS = ("cprofile", "tracemalloc")
+
+# The metrics the stages of the current thread (or task) record into, None when nothing is recording
+_current_metrics = contextvars.ContextVar("current_metrics", default=None)
+
+
+class StageTiming:
+    """
+    The accumulated cost of one pipeline stage.
+    Attributes:
+        name (str): The name of the stage.
+        calls (int): How many times the stage ran.
+        wall (float): The wall time in seconds.
+        cpu (float): The CPU time of the process in seconds, including other threads running meanwhile.
+        peak_bytes (int): The peak memory allocated by Python and NumPy during the stage on top of what was allocated
+            when it started, or None unless tracemalloc is tracing.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_bytes = None
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "wall_ms": self.wall * 1000,
+            "cpu_ms": self.cpu * 1000,
+            "peak_bytes": self.peak_bytes,
+        }
+
+
+class PipelineMetrics:
+    """
+    Per-stage wall time, CPU time and peak allocation of a run of the pipeline, filled by `record_metrics`.
+    Attributes:
+        stages (OrderedDict): The `StageTiming` of every stage, in the order the stages first ran.
+        total (StageTiming): The cost of the whole run.
+        profile (pstats.Stats): The cProfile statistics of the run, None unless recorded with profile="cprofile".
+        snapshot (tracemalloc.Snapshot): The allocations alive at the end of the run, None unless recorded with
+            profile="tracemalloc".
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.total = StageTiming("total")
+        self.profile = None
+        self.snapshot = None
+        # Absolute traced memory peaks of the open stages, innermost last
+        self._peaks = []
+
+    @contextmanager
+    def measure(self, timing):
+        """
+        Add the cost of the enclosed block to a `StageTiming`.
+        """
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            # Keep the peak of the enclosing stage before resetting it for this one
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self._peaks.append(current)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield timing
+        finally:
+            timing.calls += 1
+            timing.wall += time.perf_counter() - start_wall
+            timing.cpu += time.process_time() - start_cpu
+            if tracing and tracemalloc.is_tracing():
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                timing.peak_bytes = max(timing.peak_bytes or 0, peak - current)
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+
+    def stage(self, name):
+        """
+        Measure the enclosed block as (another call of) the stage `name`.
+        """
+        timing = self.stages.get(name)
+        if timing is None:
+            timing = self.stages[name] = StageTiming(name)
+        return self.measure(timing)
+
+    def merge(self, other):
+        """
+        Add the stages of another recording, e.g. one made in a worker process, to these metrics.
+        """
+        for name, timing in other.stages.items():
+            merged = self.stages.get(name)
+            if merged is None:
+                merged = self.stages[name] = StageTiming(name)
+            merged.calls += timing.calls
+            merged.wall += timing.wall
+            merged.cpu += timing.cpu
+            if timing.peak_bytes is not None:
+                merged.peak_bytes = max(merged.peak_bytes or 0, timing.peak_bytes)
+
+    def as_dict(self):
+        """
+        Returns:
+            dict: The costs of the stages and of the whole run, "total", in milliseconds and bytes.
+        """
+        costs = {name: timing.as_dict() for name, timing in self.stages.items()}
+        costs["total"] = self.total.as_dict()
+        return costs
+
+    def summary(self, separator=", "):
+        """
+        Returns:
+            str: The wall time of every stage in milliseconds, e.g. "sift 41 ms, match 12 ms, ...".
+        """
+        return separator.join(
+            f"{name} {timing.wall * 1000:.0f} ms"
+            for name, timing in self.stages.items()
+        )
+
+
+@contextmanager
+def record_metrics(profile=None):
+    """
+    Record the pipeline stages run in this context into a new `PipelineMetrics`. The recording is bound to the
+    current thread (or asyncio task), stages run by other threads meanwhile are not recorded.
+    Args:
+        profile (str, optional): Also capture a cProfile profile ("cprofile") or the allocations with tracemalloc
+            ("tracemalloc", which also fills `peak_bytes`). Both slow the pipeline down. Defaults to None.
+    Yields:
+        PipelineMetrics: The metrics, complete once the context exits.
+    Raises:
+        ValueError: If the profiler is unknown.
+    """
+    if profile is not None and profile not in PROFILERS:
+        raise ValueError(f"Unknown profiler '{profile}', expected one of {PROFILERS}")
+    metrics = PipelineMetrics()
+    token = _current_metrics.set(metrics)
+    profiler = None
+    started_tracing = False
+    if profile == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif profile == "tracemalloc" and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        started_tracing = True
+    try:
+        with metrics.measure(metrics.total):
+            yield metrics
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            metrics.profile = pstats.Stats(profiler)
+        if profile == "tracemalloc":
+            metrics.snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+        _current_metrics.reset(token)
+
+
+def current_metrics():
+    """
+    Returns:
+        PipelineMetrics: The metrics being recorded in this context, or None.
+    """
+    return _current_metrics.get()
+
+
+@contextmanager
+def stage(name):
+    """
+    Measure the enclosed block as the pipeline stage `name` if metrics are being recorded, see `record_metrics`.
+    Costs a context variable lookup otherwise.
+    """
+    metrics = _current_metrics.get()
+    if metrics is None:
+        yield None
+    else:
+        with metrics.stage(name) as timing:
+            yield timing
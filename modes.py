@@ -0,0 +1,117 @@
+import cv2
+
+from changechip import (
+    CHANGECHIP_MODULES,
+    ClusteringSession,
+    get_reference_features,
+    pipeline,
+)
+from framebuffer import resolve_frame
+from instrumentation import record_metrics
+
+# Modes heavy enough to run in a worker process, and the modules they import on first use
+HEAVY_MODES = ("ssim", "changechip")
+MODE_MODULES = {
+    "ssim": ("skimage.metrics",),
+    "changechip": CHANGECHIP_MODULES,
+}
+
+
+def ssim_difference(reference_image, frame):
+    """
+    Render the structural similarity map of a frame against the reference as a BGR image.
+    """
+    from skimage.metrics import structural_similarity
+
+    gray_reference = cv2.cvtColor(reference_image, cv2.COLOR_BGR2GRAY)
+    gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    _, diff = structural_similarity(gray_reference, gray_frame, full=True)
+    diff = (diff * 255).astype("uint8")
+    return cv2.cvtColor(diff, cv2.COLOR_GRAY2BGR)
+
+
+def changechip_overlay(
+    reference_image,
+    frame,
+    resize_factor=0.5,
+    reference_features=None,
+    matcher="bruteforce",
+    clustering_session=None,
+    clustering_engine="kmeans",
+):
+    """
+    Run ChangeChip on a frame and scale the overlay back to the size of the frame.
+    Args:
+        reference_image (np.array): The reference image.
+        frame (np.array): The frame to inspect.
+        resize_factor (float, optional): The resize factor of the pipeline. Defaults to 0.5.
+        reference_features (ReferenceFeatures, optional): Precomputed features of the resized reference. Defaults to None.
+        matcher (str, optional): The descriptor matcher backend. Defaults to "bruteforce".
+        clustering_session (ClusteringSession, optional): Warm-start state of the live frames. Defaults to None.
+        clustering_engine (str, optional): The clustering engine. Defaults to "kmeans".
+    Returns:
+        np.array: The BGRA overlay at the size of the frame.
+    """
+    output = pipeline(
+        (frame, reference_image),
+        resize_factor=resize_factor,
+        reference_features=reference_features,
+        matcher=matcher,
+        clustering_session=clustering_session,
+        clustering_engine=clustering_engine,
+    )
+    return cv2.resize(output, None, fx=1 / resize_factor, fy=1 / resize_factor)
+
+
+# The reference of every mode in a worker, sent along with the first job after it changes, and the ChangeChip state
+# derived from it. Keyed by mode, as the pools of all modes share this module when they run on threads.
+_worker_state = {}
+
+
+def run_heavy_mode(mode, frame, version, reference_image=None, options=None):
+    """
+    Process a frame in a heavy mode inside a worker process, see `scheduler.ProcessingScheduler`.
+    Args:
+        mode (str): One of `HEAVY_MODES`.
+        frame (np.array or framebuffer.FrameRef): The prepared frame, or the captured frame in the shared frame buffer.
+        version (int): The version of the reference the frame is processed against.
+        reference_image (np.array, optional): The reference, only sent when its version changed. Defaults to None.
+        options (dict, optional): Keyword arguments of `changechip_overlay`. Defaults to None.
+    Returns:
+        tuple: The processed frame and the `instrumentation.PipelineMetrics` of its stages in the worker.
+    Raises:
+        ValueError: If the mode is not a heavy mode or the worker does not hold the reference `version`.
+    """
+    if mode not in HEAVY_MODES:
+        raise ValueError(f"Unknown heavy mode '{mode}', expected one of {HEAVY_MODES}")
+    options = dict(options or {})
+    if reference_image is not None:
+        state = {"version": version, "reference": reference_image}
+        if mode == "changechip":
+            state["session"] = ClusteringSession()
+            state["features"] = {}
+        _worker_state[mode] = state
+    state = _worker_state.get(mode)
+    if state is None or state["version"] != version:
+        raise ValueError(f"Worker does not hold reference version {version}")
+    reference_image = state["reference"]
+    if mode == "changechip":
+        # Detect the reference features once per reference and resize factor, not on every frame
+        resize_factor = options.get("resize_factor", 0.5)
+        if resize_factor not in state["features"]:
+            state["features"][resize_factor] = get_reference_features(
+                reference_image, resize_factor
+            )
+        options["reference_features"] = state["features"][resize_factor]
+    frame = resolve_frame(frame)
+    with record_metrics() as metrics:
+        if mode == "ssim":
+            output = ssim_difference(reference_image, frame)
+        else:
+            output = changechip_overlay(
+                reference_image,
+                frame,
+                clustering_session=state["session"],
+                **options,
+            )
+    return output, metrics
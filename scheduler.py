@@ -0,0 +1,307 @@
+import itertools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from changechip import preload_modules
+from framebuffer import FrameRef
+from instrumentation import record_metrics
+from modes import HEAVY_MODES, MODE_MODULES, run_heavy_mode
+
+
+class FrameJob:
+    """
+    A captured frame waiting for, or going through, processing. Timestamps are `time.perf_counter` values.
+    Attributes:
+        frame_id (int): Increasing id of the job.
+        frame (np.array or framebuffer.FrameRef): The captured frame, or a reference to it in `frame_buffer`.
+        mode (str): The mode the frame is processed in.
+        captured_at (float): When the frame was captured.
+        started_at (float): When processing started, None before.
+        finished_at (float): When processing finished, None before.
+        displayed_at (float): When the result was displayed, set by the consumer of the result.
+        output (np.array): The processed frame, None until finished.
+        error (Exception): The error processing raised, if any.
+        metrics (instrumentation.PipelineMetrics): The stage timings of the frame.
+    """
+
+    def __init__(self, frame_id, frame, mode, captured_at):
+        self.frame_id = frame_id
+        self.frame = frame
+        self.mode = mode
+        self.captured_at = captured_at
+        self.started_at = None
+        self.finished_at = None
+        self.displayed_at = None
+        self.output = None
+        self.error = None
+        self.metrics = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """
+        Cancel the job. A queued job is skipped, the result of a running job is discarded.
+        """
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def queue_latency(self):
+        """
+        Seconds between capture and the start of processing.
+        """
+        return self.started_at - self.captured_at
+
+    @property
+    def display_latency(self):
+        """
+        Seconds between capture and display.
+        """
+        return self.displayed_at - self.captured_at
+
+
+class ProcessingScheduler:
+    """
+    Processes the latest captured frame in the background. Frames are submitted into a single slot: a frame
+    submitted while another one is still waiting replaces and cancels it, so processing always resumes on the most
+    recent frame. Light modes run on the dispatcher thread. Heavy modes (`modes.HEAVY_MODES`) run in a pool per mode,
+    of worker processes by default so their GIL-bound work does not starve the GUI and capture threads. Switching
+    modes cancels the running job instead of waiting for it.
+    Attributes:
+        prepare (callable): Called on the dispatcher thread with a frame before it is processed, e.g. alignment.
+        process (callable): Called on the dispatcher thread as process(mode, frame) for the light modes.
+        on_result (callable): Called on the dispatcher thread with every finished, not cancelled `FrameJob`.
+        options (dict): Keyword arguments of `modes.changechip_overlay` for the ChangeChip workers.
+        use_processes (bool): Run heavy modes in process pools, or in thread pools.
+        frame_buffer (framebuffer.FrameRingBuffer): The buffer of the submitted `FrameRef`s. The dispatcher leases
+            the frame it processes as reader `reader`, and passes frames it did not prepare into a new array to the
+            workers as a `FrameRef` instead of pickling them.
+        reader (int): The reader id of the dispatcher in `frame_buffer`.
+        dropped (int): The number of frames replaced before they were processed.
+        cancelled (int): The number of frames whose processing was cancelled.
+    """
+
+    def __init__(
+        self,
+        prepare=None,
+        process=None,
+        on_result=None,
+        options=None,
+        use_processes=True,
+        poll_interval=0.02,
+        frame_buffer=None,
+        reader=0,
+    ):
+        self.prepare = prepare
+        self.process = process
+        self.on_result = on_result
+        self.options = dict(options or {})
+        self.use_processes = use_processes
+        self.poll_interval = poll_interval
+        self.frame_buffer = frame_buffer
+        self.reader = reader
+        self.dropped = 0
+        self.cancelled = 0
+        self._ids = itertools.count()
+        self._condition = threading.Condition()
+        self._pending = None
+        self._running = None
+        self._closed = False
+        self._pools = {}
+        self._reference = None
+        self._reference_version = 0
+        self._sent_versions = {}
+        self._thread = threading.Thread(target=self._dispatch, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, mode, captured_at=None):
+        """
+        Queue a frame for processing, replacing the frame still waiting if there is one.
+        Args:
+            frame (np.array or framebuffer.FrameRef): The captured frame, or a reference to it in `frame_buffer`.
+            mode (str): The mode to process it in.
+            captured_at (float, optional): The `time.perf_counter` capture time. Defaults to now.
+        Returns:
+            FrameJob: The job of the frame.
+        """
+        if captured_at is None:
+            captured_at = time.perf_counter()
+        job = FrameJob(next(self._ids), frame, mode, captured_at)
+        with self._condition:
+            if self._pending is not None:
+                self._pending.cancel()
+                self.dropped += 1
+            self._pending = job
+            self._condition.notify()
+        return job
+
+    @property
+    def idle(self):
+        """
+        Whether no frame waits or is processed, i.e. a frame submitted now is processed right away.
+        """
+        with self._condition:
+            return self._pending is None and self._running is None
+
+    def cancel_all(self):
+        """
+        Cancel the waiting and the running job, e.g. when the mode changes.
+        """
+        with self._condition:
+            for job in (self._pending, self._running):
+                if job is not None and not job.cancelled:
+                    job.cancel()
+                    self.cancelled += 1
+            self._pending = None
+
+    def set_reference(self, reference_image):
+        """
+        Set the reference the heavy modes process frames against. Jobs against the previous reference are cancelled.
+        """
+        self.cancel_all()
+        with self._condition:
+            self._reference = reference_image
+            self._reference_version += 1
+
+    def warm_up(self, mode):
+        """
+        Start the pool of a heavy mode and import its dependencies there, ahead of its first frame.
+        Returns:
+            concurrent.futures.Future: Done once the worker is ready, None for a light mode.
+        """
+        if mode in HEAVY_MODES:
+            # Workers are started on the first submitted task
+            return self._pool(mode).submit(preload_modules, MODE_MODULES[mode])
+        return None
+
+    def shutdown(self, timeout=1.0):
+        """
+        Stop the dispatcher and the pools without waiting for the jobs running in the pools.
+        Args:
+            timeout (float, optional): Seconds to wait for the dispatcher to return, and release its lease of the
+                frame it processes. Defaults to 1.0.
+        """
+        self.cancel_all()
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if threading.current_thread() is not self._thread:
+            # A cancelled heavy job returns within `poll_interval`, a light one once it is processed
+            self._thread.join(timeout)
+        for pool in self._pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._pools.clear()
+
+    def _pool(self, mode):
+        with self._condition:
+            pool = self._pools.get(mode)
+            if pool is None:
+                # One worker per mode: frames are processed in order against the reference it holds
+                if self.use_processes:
+                    # Forking a process running Tk and capture threads is unsafe
+                    pool = ProcessPoolExecutor(
+                        max_workers=1, mp_context=multiprocessing.get_context("spawn")
+                    )
+                else:
+                    pool = ThreadPoolExecutor(max_workers=1)
+                self._pools[mode] = pool
+                self._sent_versions.pop(mode, None)
+            return pool
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                job, self._pending = self._pending, None
+                self._running = job
+            job.started_at = time.perf_counter()
+            captured = job.frame
+            # The capture replaces its frame buffer when the frame size changes, release the lease where it was taken
+            frame_buffer = self.frame_buffer
+            if isinstance(captured, FrameRef):
+                if (
+                    captured.spec[0] != frame_buffer.name
+                    or frame_buffer.acquire(self.reader, captured.sequence) is None
+                ):
+                    # Overwritten by the capture while waiting, or in a replaced buffer, a newer frame is on its way
+                    with self._condition:
+                        self._running = None
+                        self.dropped += 1
+                    continue
+                captured = frame_buffer.read(job.frame)
+            try:
+                with record_metrics() as job.metrics:
+                    frame = captured if self.prepare is None else self.prepare(captured)
+                    if job.mode in HEAVY_MODES:
+                        if (
+                            self.use_processes
+                            and frame is captured
+                            and captured is not job.frame
+                        ):
+                            # The worker reads the unprepared frame from the shared slot, leased until the job
+                            # finishes. The slot of a cancelled job is released while the worker may still read
+                            # it, its result is discarded anyway.
+                            frame = job.frame
+                        job.output = self._run_heavy(job, frame)
+                    else:
+                        job.output = self.process(job.mode, frame)
+                if job.output is captured and captured is not job.frame:
+                    # The slot is reused once released
+                    job.output = captured.copy()
+            except Exception as e:
+                job.error = e
+            finally:
+                if captured is not job.frame:
+                    frame_buffer.release(self.reader)
+            job.finished_at = time.perf_counter()
+            with self._condition:
+                self._running = None
+            if not job.cancelled and self.on_result is not None:
+                self.on_result(job)
+
+    def _run_heavy(self, job, frame):
+        with self._condition:
+            version = self._reference_version
+            reference = self._reference
+        mode = job.mode
+        pool = self._pool(mode)
+        # The worker keeps the reference, it is only sent with the first job after it changed
+        sent = self._sent_versions.get(mode) == version
+        self._sent_versions[mode] = version
+        future = pool.submit(
+            run_heavy_mode,
+            mode,
+            frame,
+            version,
+            None if sent else reference,
+            self.options,
+        )
+        while True:
+            try:
+                output, metrics = future.result(timeout=self.poll_interval)
+                break
+            except FutureTimeoutError:
+                if job.cancelled:
+                    # A running frame is finished by the worker and its result discarded
+                    if future.cancel() and not sent:
+                        self._sent_versions.pop(mode, None)
+                    return None
+            except BrokenProcessPool:
+                with self._condition:
+                    self._pools.pop(mode, None)
+                raise
+            except Exception:
+                # The worker may not hold the reference, send it again with the next frame
+                self._sent_versions.pop(mode, None)
+                raise
+        job.metrics.merge(metrics)
+        return output
@@ -0,0 +1,231 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".bmp", ".jpeg", ".jpg", ".png", ".tif", ".tiff")
+
+
+class CameraSource(cv2.VideoCapture):
+    """
+    A camera, opened with the requested frame size.
+    Args:
+        camera_id (int): The index of the camera.
+        width (int, optional): The requested frame width. Defaults to the default of the camera.
+        height (int, optional): The requested frame height. Defaults to the default of the camera.
+        api (int, optional): The OpenCV capture backend. Defaults to DirectShow.
+    """
+
+    def __init__(self, camera_id, width=None, height=None, api=cv2.CAP_DSHOW):
+        super().__init__(camera_id, api)
+        if width:
+            self.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            self.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+
+
+class ReplaySource:
+    """
+    Base of the sources replaying recorded frames through the part of the `cv2.VideoCapture` interface the app uses:
+    isOpened, grab, retrieve, read and release. Like a camera, `grab` blocks until the next frame is due at `fps`,
+    and `retrieve` decodes the grabbed frame. In `realtime`, frames whose time passed while nobody grabbed them are
+    skipped, as a camera drops them, so slow consumers see the footage at its recorded pace. Otherwise every frame is
+    delivered, at most `fps` per second.
+    Subclasses implement `_seek`, `_decode` and `_rewind`.
+    Attributes:
+        fps (float): The replay rate in frames per second, 0 or None for as fast as frames are grabbed.
+        loop (bool): Start over at the end of the footage.
+        realtime (bool): Skip the frames that were due while nobody grabbed them.
+        position (int): The index of the grabbed frame in the footage, -1 before the first grab.
+        skipped (int): The number of frames skipped in realtime.
+    """
+
+    def __init__(self, fps=None, loop=False, realtime=True):
+        self.fps = fps
+        self.loop = loop
+        self.realtime = realtime
+        self.position = -1
+        self.skipped = 0
+        self._opened = True
+        self._started_at = None
+
+    def isOpened(self):
+        return self._opened
+
+    def grab(self):
+        """
+        Wait until the next frame is due and advance to it.
+        Returns:
+            bool: False at the end of the footage, unless looping, or once released.
+        """
+        if not self._opened:
+            return False
+        now = time.perf_counter()
+        target = self.position + 1
+        if self._started_at is None:
+            self._started_at = now
+        elif self.fps:
+            due = self._started_at + target / self.fps
+            if now < due:
+                time.sleep(due - now)
+            elif self.realtime:
+                late = int((now - self._started_at) * self.fps)
+                if late > target:
+                    self.skipped += late - target
+                    target = late
+        if not self._seek(target):
+            if not self.loop or target == 0:
+                self._opened = False
+                return False
+            self._rewind()
+            self.position = -1
+            # The next frame is due right away, the loop restarts the clock
+            self._started_at = time.perf_counter()
+            target = 0
+            if not self._seek(target):
+                self._opened = False
+                return False
+        self.position = target
+        return True
+
+    def retrieve(self, image=None):
+        """
+        Decode the grabbed frame, into `image` if it has the size of the frame.
+        Returns:
+            tuple: Whether a frame was decoded, and the frame.
+        """
+        if self.position < 0 or not self._opened:
+            return False, None
+        frame = self._decode(image)
+        if frame is None:
+            return False, None
+        if image is not None and frame is not image and image.shape == frame.shape:
+            np.copyto(image, frame)
+            frame = image
+        return True, frame
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def release(self):
+        self._opened = False
+
+    def _seek(self, index):
+        """
+        Advance to the frame `index`, at or after the current position. Returns False past the end.
+        """
+        raise NotImplementedError
+
+    def _decode(self, image=None):
+        """
+        Decode the frame at the current position, optionally into `image`. Returns None on failure.
+        """
+        raise NotImplementedError
+
+    def _rewind(self):
+        """
+        Go back to before the first frame.
+        """
+        raise NotImplementedError
+
+
+class ImageDirectorySource(ReplaySource):
+    """
+    Replays the images of a directory in file name order. Every retrieved image is decoded from its file, like a
+    camera frame.
+    Args:
+        directory (str): The directory of the images.
+        fps (float, optional): The replay rate. Defaults to 10 frames per second.
+        loop (bool, optional): Start over after the last image. Defaults to True.
+        realtime (bool, optional): Skip the images that were due while nobody grabbed them. Defaults to True.
+    Raises:
+        ValueError: If the directory holds no images.
+    """
+
+    def __init__(self, directory, fps=10, loop=True, realtime=True):
+        super().__init__(fps, loop, realtime)
+        self.paths = [
+            os.path.join(directory, file_name)
+            for file_name in sorted(os.listdir(directory))
+            if file_name.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+        if not self.paths:
+            raise ValueError(f"No images in {directory}")
+
+    def _seek(self, index):
+        return index < len(self.paths)
+
+    def _decode(self, image=None):
+        return cv2.imread(self.paths[self.position])
+
+    def _rewind(self):
+        pass
+
+
+class VideoFileSource(ReplaySource):
+    """
+    Replays a video file.
+    Args:
+        path (str): The video file.
+        fps (float, optional): The replay rate. Defaults to the frame rate of the video.
+        loop (bool, optional): Start over after the last frame. Defaults to True.
+        realtime (bool, optional): Skip the frames that were due while nobody grabbed them. Defaults to True.
+    Raises:
+        ValueError: If the video cannot be opened.
+    """
+
+    def __init__(self, path, fps=None, loop=True, realtime=True):
+        self.video = cv2.VideoCapture(path)
+        if not self.video.isOpened():
+            raise ValueError(f"Could not open the video {path}")
+        if fps is None:
+            fps = self.video.get(cv2.CAP_PROP_FPS) or None
+        super().__init__(fps, loop, realtime)
+        # The frame the video is positioned on, -1 before the first one
+        self._video_position = -1
+
+    def _seek(self, index):
+        while self._video_position < index:
+            # Grabbing without decoding is what skipping costs a camera too
+            if not self.video.grab():
+                return False
+            self._video_position += 1
+        return True
+
+    def _decode(self, image=None):
+        ret, frame = self.video.retrieve(image)
+        return frame if ret else None
+
+    def _rewind(self):
+        self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        self._video_position = -1
+
+    def release(self):
+        super().release()
+        self.video.release()
+
+
+def open_source(source, fps=None, width=None, height=None, loop=True, realtime=True):
+    """
+    Open a frame source from a command line argument.
+    Args:
+        source (str or int): A camera index, a directory of images or a video file.
+        fps (float, optional): The replay rate of recorded frames. Defaults to the frame rate of the video, or 10
+            for images.
+        width (int, optional): The requested frame width of a camera. Defaults to None.
+        height (int, optional): The requested frame height of a camera. Defaults to None.
+        loop (bool, optional): Start recorded frames over at the end. Defaults to True.
+        realtime (bool, optional): Skip recorded frames that were due while nobody grabbed them. Defaults to True.
+    Returns:
+        CameraSource, ImageDirectorySource or VideoFileSource: The source.
+    Raises:
+        ValueError: If the recorded frames cannot be opened.
+    """
+    if isinstance(source, int) or str(source).isdigit():
+        return CameraSource(int(source), width, height)
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, fps or 10, loop, realtime)
+    return VideoFileSource(source, fps, loop, realtime)
@@ -0,0 +1,487 @@
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from artifacts import resolve_sink
+from changechip import (
+    PROJECTION_METHODS,
+    ReferenceFeatures,
+    assign_to_centroids,
+    change_overlay_lut,
+    cluster_error_sums,
+    difference_channels,
+    estimate_homography,
+    find_group_of_accepted_classes_DBSCAN,
+    k_means_clustering,
+    normalize_cluster_errors,
+)
+from histogram import apply_luts, channel_histograms, histograms_to_cdfs, matching_luts
+
+
+def iter_tiles(shape, tile_size):
+    """
+    Split an image of `shape` into row-major tiles of at most tile_size x tile_size pixels.
+    Yields:
+        tuple: The (y0, y1, x0, x1) bounds of every tile.
+    """
+    height, width = shape[:2]
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            yield y0, min(y0 + tile_size, height), x0, min(x0 + tile_size, width)
+
+
+def temporary_memmap(shape, dtype):
+    """
+    Allocate a zero-filled array in a memory map of an anonymous temporary file, deleted once the array is garbage
+    collected, so the OS can page it out instead of holding the whole array in memory.
+    """
+    with tempfile.TemporaryFile() as file:
+        # The memory map keeps its own handle of the file open
+        return np.memmap(file, dtype=dtype, mode="w+", shape=shape)
+
+
+def pixel_scale_matrix(source_shape, target_shape):
+    """
+    The affine matrix mapping pixel centres of an image of `source_shape` onto those of its resized `target_shape` copy.
+    """
+    scale_x = target_shape[1] / source_shape[1]
+    scale_y = target_shape[0] / source_shape[0]
+    return np.array(
+        [
+            [scale_x, 0, 0.5 * scale_x - 0.5],
+            [0, scale_y, 0.5 * scale_y - 0.5],
+            [0, 0, 1],
+        ]
+    )
+
+
+# Sub-pixel precision of the fixed point coordinate maps of cv2.remap
+INTER_BITS = 5
+# Sub-pixel precision of the valid region polygon vertices
+MASK_SHIFT = 8
+
+
+class PanelAlignment:
+    """
+    A reference panel aligned onto an input panel at the working resolution, produced tile by tile. Every tile is
+    resized and warped from the full resolution panels on its own, so no full size intermediate image is ever built,
+    and overlapping tiles see the same pixel values.
+    The working resolution is the panel resolution divided by an integer `reduction`, so that block averaging tiles
+    with `cv2.INTER_AREA` gives the same pixels as resizing the whole panel.
+    Attributes:
+        h (numpy.ndarray): The homography mapping working reference coordinates onto working input coordinates.
+        shape (tuple): The (height, width) of the input panel at the working resolution.
+        luts (numpy.ndarray): Histogram matching lookup tables applied to the warped reference tiles, or None.
+    """
+
+    def __init__(self, images, h, reduction=1):
+        self.input_image, self.reference_image = images
+        self.reduction = reduction
+        self.h = h
+        self.shape = tuple(s // reduction for s in self.input_image.shape[:2])
+        self.reference_shape = tuple(
+            s // reduction for s in self.reference_image.shape[:2]
+        )
+        self.luts = None
+
+        # The region covered by the warped reference, see `changechip.warp_valid_mask`
+        height, width = self.reference_shape
+        corners = np.float32(
+            [[1, 1], [width - 2, 1], [width - 2, height - 2], [1, height - 2]]
+        ).reshape(-1, 1, 2)
+        polygon = cv2.perspectiveTransform(corners.astype(np.float64), h)
+        # In fixed point, so that translating it to a tile is exact
+        self.valid_polygon = np.round(polygon.reshape(-1, 2) * (1 << MASK_SHIFT))
+        self.valid_polygon = self.valid_polygon.astype(np.int64)
+        edges = np.roll(self.valid_polygon, -1, axis=0)
+        self.orientation = np.sign(
+            np.sum(
+                self.valid_polygon[:, 0] * edges[:, 1]
+                - edges[:, 0] * self.valid_polygon[:, 1]
+            )
+        )
+        self.h_inverse = np.linalg.inv(h)
+
+    def reduce(self, image, y0, y1, x0, x1):
+        """
+        The working resolution pixels [y0, y1) x [x0, x1) of a full resolution panel.
+        """
+        n = self.reduction
+        crop = image[n * y0 : n * y1, n * x0 : n * x1]
+        if n == 1:
+            # Always a copy, tiles are modified in place
+            return crop.copy()
+        return cv2.resize(crop, (x1 - x0, y1 - y0), interpolation=cv2.INTER_AREA)
+
+    def valid_mask(self, y0, y1, x0, x1):
+        """
+        The (y1 - y0, x1 - x0) uint8 mask of the pixels inside the warped reference, tested exactly in fixed point on
+        absolute pixel coordinates so that overlapping tiles agree (`cv2.fillConvexPoly` clips differently per canvas).
+        """
+        ys, xs = np.ogrid[y0:y1, x0:x1]
+        ys = ys.astype(np.int64) << MASK_SHIFT
+        xs = xs.astype(np.int64) << MASK_SHIFT
+        inside = np.ones((y1 - y0, x1 - x0), dtype=bool)
+        polygon = self.valid_polygon
+        for (ax, ay), (bx, by) in zip(polygon, np.roll(polygon, -1, axis=0)):
+            cross = (bx - ax) * (ys - ay) - (by - ay) * (xs - ax)
+            inside &= cross * self.orientation >= 0
+        return inside.view(np.uint8)
+
+    def warped_reference(self, y0, y1, x0, x1):
+        """
+        Warp the part of the reference covering the input pixels [y0, y1) x [x0, x1), at the working resolution.
+        The source coordinates are computed from absolute panel coordinates and quantised to the fixed point
+        format of `cv2.remap` before they are made relative to the reference crop, so every tile samples exactly
+        the same reference pixels as its overlapping neighbours.
+        """
+        ys, xs = np.mgrid[y0:y1, x0:x1]
+        h = self.h_inverse
+        w = h[2, 0] * xs + h[2, 1] * ys + h[2, 2]
+        source_x = (h[0, 0] * xs + h[0, 1] * ys + h[0, 2]) / w
+        source_y = (h[1, 0] * xs + h[1, 1] * ys + h[1, 2]) / w
+
+        # Crop with a margin of two pixels for the bilinear interpolation, clamp the rest to outside the crop
+        height, width = self.reference_shape
+        rx0 = max(int(np.floor(source_x.min())) - 2, 0)
+        ry0 = max(int(np.floor(source_y.min())) - 2, 0)
+        rx1 = min(int(np.ceil(source_x.max())) + 3, width)
+        ry1 = min(int(np.ceil(source_y.max())) + 3, height)
+        if rx0 >= rx1 or ry0 >= ry1:
+            return np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+        crop = self.reduce(self.reference_image, ry0, ry1, rx0, rx1)
+
+        tab_size = 1 << INTER_BITS
+        fixed_x = np.round(np.clip(source_x, -2, width + 1) * tab_size).astype(np.int32)
+        fixed_y = np.round(np.clip(source_y, -2, height + 1) * tab_size).astype(
+            np.int32
+        )
+        fixed_x -= rx0 * tab_size
+        fixed_y -= ry0 * tab_size
+        map_xy = np.dstack((fixed_x >> INTER_BITS, fixed_y >> INTER_BITS)).astype(
+            np.int16
+        )
+        map_fraction = (
+            (fixed_y & (tab_size - 1)) * tab_size + (fixed_x & (tab_size - 1))
+        ).astype(np.uint16)
+        return cv2.remap(
+            crop, map_xy, map_fraction, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT
+        )
+
+    def tile(self, y0, y1, x0, x1):
+        """
+        The aligned input and reference pixels [y0, y1) x [x0, x1), uncovered pixels zeroed in both, the reference
+        histogram matched if `luts` is set. The same as `changechip.preprocess_images` on the whole panel.
+        Returns:
+            tuple: The input and reference tiles.
+        """
+        valid_mask = self.valid_mask(y0, y1, x0, x1)[..., np.newaxis]
+        input_tile = self.reduce(self.input_image, y0, y1, x0, x1)
+        reference_tile = self.warped_reference(y0, y1, x0, x1)
+        np.multiply(input_tile, valid_mask, out=input_tile)
+        np.multiply(reference_tile, valid_mask, out=reference_tile)
+        if self.luts is not None:
+            reference_tile = apply_luts(reference_tile, self.luts)
+        return input_tile, reference_tile
+
+    def padded_tile(self, y0, y1, x0, x1, padding):
+        """
+        The tile [y0, y1) x [x0, x1) together with its difference channels padded with `padding` pixels of halo on
+        every side. The halo is taken from the neighbouring tiles inside the panel and is zero outside of it, the
+        same padding as `changechip.get_descriptors`.
+        Returns:
+            tuple: The input tile, the reference tile and the padded (H + 2 * padding, W + 2 * padding, 4) differences.
+        """
+        height, width = self.shape
+        hy0, hy1 = max(y0 - padding, 0), min(y1 + padding, height)
+        hx0, hx1 = max(x0 - padding, 0), min(x1 + padding, width)
+        input_halo, reference_halo = self.tile(hy0, hy1, hx0, hx1)
+        padded_diff = cv2.copyMakeBorder(
+            difference_channels((input_halo, reference_halo)),
+            hy0 - (y0 - padding),
+            (y1 + padding) - hy1,
+            hx0 - (x0 - padding),
+            (x1 + padding) - hx1,
+            cv2.BORDER_CONSTANT,
+            value=0,
+        )
+        core = (slice(y0 - hy0, y1 - hy0), slice(x0 - hx0, x1 - hx0))
+        return input_halo[core], reference_halo[core], padded_diff
+
+
+def align_panels(images, reduction, pyramid_factor, matcher, artifacts):
+    """
+    Estimate the homography between two panels once, from SIFT matches on a heavily downsampled pair.
+    Returns:
+        numpy.ndarray: The homography mapping working reference coordinates onto working input coordinates.
+    """
+    coarse_images = []
+    for image in images:
+        coarse_shape = tuple(
+            max(1, int(s * pyramid_factor / reduction)) for s in image.shape[:2]
+        )
+        coarse_images.append(
+            cv2.resize(image, coarse_shape[::-1], interpolation=cv2.INTER_AREA)
+        )
+    h = estimate_homography(
+        coarse_images,
+        reference_features=ReferenceFeatures.compute(coarse_images[1]),
+        matcher=matcher,
+        artifacts=artifacts,
+    )
+    # Working reference -> coarse reference -> coarse input -> working input
+    working_shapes = [tuple(s // reduction for s in i.shape[:2]) for i in images]
+    to_coarse = pixel_scale_matrix(working_shapes[1], coarse_images[1].shape)
+    to_working = pixel_scale_matrix(coarse_images[0].shape, working_shapes[0])
+    h = to_working @ h @ to_coarse
+    return h / h[2, 2]
+
+
+def sample_tile_windows(alignment, tile, window_size, step):
+    """
+    Cut the windows centred on the pixels of a tile lying on a global grid of `step` pixels, skipping pixels whose
+    window leaves the panel.
+    Returns:
+        tuple: The (N, window_size, window_size, 3) input and reference windows, and the (N,) flat panel index of
+            their centres.
+    """
+    y0, y1, x0, x1 = tile
+    padding = window_size // 2
+    height, width = alignment.shape
+    ys = np.arange(-(-max(y0, padding) // step) * step, min(y1, height - padding), step)
+    xs = np.arange(-(-max(x0, padding) // step) * step, min(x1, width - padding), step)
+    empty = np.zeros((0, window_size, window_size, 3), dtype=np.uint8)
+    if len(ys) == 0 or len(xs) == 0:
+        return empty, empty, np.zeros(0, dtype=np.int64)
+    halo = alignment.tile(
+        ys[0] - padding, ys[-1] + padding + 1, xs[0] - padding, xs[-1] + padding + 1
+    )
+    windows = []
+    for image in halo:
+        view = np.lib.stride_tricks.sliding_window_view(
+            image, (window_size, window_size), axis=(0, 1)
+        )[::step, ::step]
+        windows.append(view.reshape(-1, 3, window_size, window_size))
+    # (N, 3, ws, ws) -> (N, ws, ws, 3)
+    input_windows, reference_windows = (w.transpose(0, 2, 3, 1) for w in windows)
+    centres = (ys[:, np.newaxis] * width + xs).ravel()
+    return input_windows.copy(), reference_windows.copy(), centres
+
+
+def fit_pca(vectors, pca_target_dim):
+    """
+    Fit a PCA basis on a sample of window descriptors.
+    Returns:
+        tuple: The (pca_target_dim, D) components and the mean vector projected onto them.
+    """
+    from sklearn.decomposition import PCA
+
+    mean_vec = vectors.mean(axis=0)
+    pca = PCA(pca_target_dim)
+    pca.fit(vectors - mean_vec)
+    EVS = pca.components_
+    return EVS, np.dot(mean_vec, EVS.transpose())
+
+
+def fit_sample_model(
+    samples,
+    luts,
+    window_size,
+    clusters,
+    pca_dim_gray,
+    pca_dim_rgb,
+    clustering_engine,
+):
+    """
+    Fit the global PCA bases and k-means centroids of a panel on the windows sampled from its tiles.
+    Args:
+        samples (list): The `sample_tile_windows` output of every tile.
+        luts (numpy.ndarray): The histogram matching lookup tables of the reference.
+        window_size (int): The size of the sliding window.
+        clusters (int): The number of clusters.
+        pca_dim_gray (int): The number of dimensions to keep for grayscale PCA.
+        pca_dim_rgb (int): The number of dimensions to keep for RGB PCA.
+        clustering_engine (str): The clustering engine, see `changechip.k_means_clustering`.
+    Returns:
+        tuple: The (channels, EVS, mean_vec) basis of the grayscale and RGB differences, and the centroids.
+    """
+    input_windows, reference_windows, centres = zip(*samples)
+    # In panel order, so the fit does not depend on the tiling
+    order = np.argsort(np.concatenate(centres))
+    input_windows = np.concatenate(input_windows)[order]
+    reference_windows = apply_luts(
+        np.concatenate(reference_windows)[order].reshape(-1, window_size, 3), luts
+    )
+    sample_diff = difference_channels(
+        (input_windows.reshape(-1, window_size, 3), reference_windows)
+    ).reshape(-1, window_size, window_size, 4)
+    sample_diff = sample_diff.transpose(0, 3, 1, 2)
+
+    bases = []
+    FVS = []
+    for channels, pca_dim in ((slice(0, 1), pca_dim_gray), (slice(1, 4), pca_dim_rgb)):
+        vectors = sample_diff[:, channels].reshape(len(sample_diff), -1)
+        vectors = vectors.astype(np.float64)
+        EVS, mean_vec = fit_pca(vectors, pca_dim)
+        bases.append((channels, EVS, mean_vec))
+        FVS.append(np.dot(vectors, EVS.transpose()) - mean_vec)
+    _, centroids = k_means_clustering(
+        np.concatenate(FVS, axis=-1),
+        clusters,
+        (len(sample_diff), 1),
+        engine=clustering_engine,
+        return_centroids=True,
+    )
+    return bases, centroids
+
+
+def tiled_pipeline(
+    images,
+    resize_factor=1.0,
+    tile_size=1024,
+    output_alpha=50,
+    window_size=5,
+    clusters=16,
+    pca_dim_gray=3,
+    pca_dim_rgb=9,
+    pyramid_factor=0.25,
+    sample_size=100000,
+    matcher="bruteforce",
+    projection="tiled",
+    clustering_engine="kmeans",
+    output=None,
+    debug=False,
+    output_directory=None,
+    artifacts=None,
+):
+    """
+    ChangeChip for arbitrarily large panels, streaming overlapping tiles instead of holding every intermediate of
+    the whole panel in memory like `changechip.pipeline`:
+    1. The homography is estimated once on the panels downsampled by `pyramid_factor`.
+    2. One pass over the tiles accumulates the histograms for the global histogram matching and samples windows on
+       a regular grid; the PCA bases and the k-means centroids are fitted on that sample.
+    3. A second pass projects the windows of every tile, padded with a halo of window_size // 2 pixels from its
+       neighbours, onto the global bases and assigns them to the global centroids, so the labels match across seams.
+       The per-cluster errors are accumulated along the way.
+    4. The accepted clusters are painted onto the output.
+    Besides the tiles, the only panel sized buffers are the output and a uint8 label map (uint16 for more than
+    256 clusters), both memory maps of temporary files unless `output` is given, so peak memory scales with the
+    tile size and not with the panel.
+    Args:
+        images (tuple): The input and reference panels, numpy arrays or memory maps.
+        resize_factor (float, optional): The working resolution, 1 / n for an integer n. Defaults to 1.0.
+        tile_size (int, optional): The side of the tiles at the working resolution. Defaults to 1024.
+        output_alpha (int, optional): The alpha value for the output images. Defaults to 50.
+        window_size (int, optional): The size of the sliding window for change detection. Defaults to 5.
+        clusters (int, optional): The number of clusters. Defaults to 16.
+        pca_dim_gray (int, optional): The number of dimensions to keep for grayscale PCA. Defaults to 3.
+        pca_dim_rgb (int, optional): The number of dimensions to keep for RGB PCA. Defaults to 9.
+        pyramid_factor (float, optional): The downsampling of the working resolution features are detected at.
+            Defaults to 0.25.
+        sample_size (int, optional): The approximate number of windows the PCA bases and centroids are fitted on.
+            Defaults to 100000.
+        matcher (str, optional): The descriptor matcher backend used for alignment. Defaults to "bruteforce".
+        projection (str, optional): The PCA projection method, "tiled" or "convolution". Defaults to "tiled".
+        clustering_engine (str, optional): The clustering engine fitting the centroids, see
+            `changechip.k_means_clustering`. Defaults to "kmeans".
+        output (numpy.ndarray, optional): A (H, W, 4) uint8 array receiving the result at the working resolution,
+            e.g. a `numpy.memmap` of the output file. Defaults to None, a memory map of a temporary file.
+        debug (bool, optional): Whether to enable debug mode. Defaults to False.
+        output_directory (str, optional): The directory to save the debug artefacts. Defaults to None.
+        artifacts (ArtifactSink, optional): Receives the debug artefacts in place of `debug` and `output_directory`,
+            see `artifacts.resolve_sink`. Defaults to None.
+    Returns:
+        numpy.ndarray: The (H, W, 4) BGRA image with the detected changes, `output` if given.
+    Raises:
+        ValueError: If `resize_factor` is not the inverse of an integer.
+    """
+    start_time = time.time()
+    reduction = int(round(1 / resize_factor))
+    if not np.isclose(reduction * resize_factor, 1):
+        raise ValueError(
+            f"resize_factor must be 1 / n for an integer n in tiled mode, got {resize_factor}"
+        )
+    artifacts = resolve_sink(artifacts, debug, output_directory)
+    h = align_panels(images, reduction, pyramid_factor, matcher, artifacts)
+    alignment = PanelAlignment(images, h, reduction)
+    height, width = alignment.shape
+    tiles = list(iter_tiles(alignment.shape, tile_size))
+    print("--- Alignment time - %s seconds ---" % (time.time() - start_time))
+
+    # Pass 1: histograms and a regular sample of windows
+    step = max(window_size, int(np.sqrt(height * width / sample_size)))
+    input_histograms = np.zeros((3, 256))
+    reference_histograms = np.zeros((3, 256))
+    samples = []
+    for tile in tiles:
+        input_tile, reference_tile = alignment.tile(*tile)
+        input_histograms += channel_histograms(input_tile)
+        reference_histograms += channel_histograms(reference_tile)
+        samples.append(sample_tile_windows(alignment, tile, window_size, step))
+    alignment.luts = matching_luts(
+        histograms_to_cdfs(reference_histograms), histograms_to_cdfs(input_histograms)
+    )
+
+    bases, centroids = fit_sample_model(
+        samples,
+        alignment.luts,
+        window_size,
+        clusters,
+        pca_dim_gray,
+        pca_dim_rgb,
+        clustering_engine,
+    )
+    del samples
+    print("--- Sampling time - %s seconds ---" % (time.time() - start_time))
+
+    # Pass 2: labels, per-cluster errors and the transparent input
+    if output is None:
+        output = temporary_memmap((height, width, 4), np.uint8)
+    labels = temporary_memmap(
+        (height, width), np.uint8 if clusters <= 256 else np.uint16
+    )
+    mse = np.zeros(clusters)
+    size = np.zeros(clusters, dtype=np.int64)
+    padding = window_size // 2
+    for y0, y1, x0, x1 in tiles:
+        input_tile, reference_tile, padded_diff = alignment.padded_tile(
+            y0, y1, x0, x1, padding
+        )
+        tile_shape = (y1 - y0, x1 - x0)
+        descriptors = np.concatenate(
+            [
+                PROJECTION_METHODS[projection](
+                    padded_diff[:, :, channels], EVS, mean_vec, window_size, tile_shape
+                )
+                for channels, EVS, mean_vec in bases
+            ],
+            axis=-1,
+        )
+        tile_labels = assign_to_centroids(descriptors, centroids).reshape(tile_shape)
+        labels[y0:y1, x0:x1] = tile_labels
+        tile_mse, tile_count = cluster_error_sums(
+            tile_labels, input_tile, reference_tile, clusters
+        )
+        mse += tile_mse
+        size += tile_count
+        output_tile = output[y0:y1, x0:x1]
+        output_tile[:, :, :3] = input_tile
+        output_tile[:, :, 3] = output_alpha
+
+    # Accepted clusters, painted band by band
+    mse_array = normalize_cluster_errors(mse, size)
+    groups = find_group_of_accepted_classes_DBSCAN(mse_array, artifacts=artifacts)
+    for group in groups:
+        lut, accepted = change_overlay_lut(mse_array, group)
+        for y0 in range(0, height, tile_size):
+            band = labels[y0 : y0 + tile_size]
+            np.copyto(
+                output[y0 : y0 + tile_size],
+                lut[band],
+                where=accepted[band][:, :, None],
+            )
+
+    print("--- Tiled pipeline time - %s seconds ---" % (time.time() - start_time))
+    return output
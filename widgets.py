@@ -1,7 +1,43 @@
 import tkinter as tk
+import cv2
 import numpy as np
 from PIL import Image, ImageTk
 
+# OpenCV rotations matching PIL's counterclockwise Image.rotate angles
+ROTATIONS = {
+    90: cv2.ROTATE_90_COUNTERCLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_CLOCKWISE,
+}
+
+
+def to_display_image(frame, size=None, rotation_angle=180):
+    """
+    Convert a BGR frame into an RGB PIL image for display. The frame is downscaled first, so the rotation and the
+    color swap only touch the pixels that are displayed.
+    Args:
+        frame (np.array): The BGR frame.
+        size (tuple, optional): The (width, height) to resize to. Defaults to the size of the frame.
+        rotation_angle (int, optional): The counterclockwise rotation, a multiple of 90 degrees. Defaults to 180.
+    Returns:
+        PIL.Image: The image.
+    Raises:
+        ValueError: If the rotation is not a multiple of 90 degrees.
+    """
+    rotation_angle %= 360
+    if rotation_angle and rotation_angle not in ROTATIONS:
+        raise ValueError(f"Unsupported rotation {rotation_angle}, expected a multiple of 90 degrees")
+    if size is not None and rotation_angle in (90, 270):
+        # Resize to the size the image has after the rotation
+        size = size[::-1]
+    if size is not None and tuple(size) != frame.shape[1::-1]:
+        frame = cv2.resize(frame, tuple(size))
+    if rotation_angle == 180:
+        frame = cv2.flip(frame, -1)
+    elif rotation_angle:
+        frame = cv2.rotate(frame, ROTATIONS[rotation_angle])
+    return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
 
 class PanZoomCanvas(tk.Frame):
     def __init__(self, master):
@@ -27,22 +63,15 @@ class PanZoomCanvas(tk.Frame):
             "<Double-Button-1>", self.mouse_double_click_left
         )  # MouseDoubleClick
         self.canvas.bind("<MouseWheel>", self.mouse_wheel)  # MouseWheel
+        self.canvas.bind(
+            "<Configure>", lambda event: self.redraw_image()
+        )  # Resize, the image is otherwise only redrawn when it changes
 
     def set_image(self, image):
         # PIL.Image
         self.pil_image = image
-        # Preserve current zoom level
-        current_scale = self.scale_factor
-        current_offset_x = self.offset_x
-        current_offset_y = self.offset_y
-
-        # Set the affine transformation matrix to display the entire image.
-        self.zoom_fit(self.pil_image.width, self.pil_image.height)
-
-        # Restore previous zoom level
-        self.scale_factor = current_scale
-        self.offset_x = current_offset_x
-        self.offset_y = current_offset_y
+        # Keep the current zoom level. Fitting the image first would only pump the Tk event loop through
+        # zoom_fit, the zoom level it sets is restored anyway.
 
         # Redraw the image on the canvas
         self.redraw_image()